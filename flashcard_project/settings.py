@@ -29,6 +29,74 @@ SECURE_SSL_REDIRECT = os.getenv("DJANGO_ENV") == "production"
 
 # LLM key for card generation
 LLM_API_KEY = os.getenv('LLM_API_KEY')
+# Model per call site: a cheap, fast model for box matching and format repair
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-3.5-turbo')
+LLM_MODELS = {
+    'generation': os.getenv('LLM_MODEL_GENERATION', LLM_MODEL),
+    'regeneration': os.getenv('LLM_MODEL_REGENERATION', LLM_MODEL),
+    'enforce_format': os.getenv('LLM_MODEL_ENFORCE_FORMAT', 'gpt-4o-mini'),
+    'box_matching': os.getenv('LLM_MODEL_BOX_MATCHING', 'gpt-4o-mini'),
+}
+# Shared LLM client: timeouts in seconds, keep-alive connection pool, retries, hedging and circuit breaker
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+LLM_CONNECT_TIMEOUT = float(os.getenv('LLM_CONNECT_TIMEOUT', 5))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 20))
+LLM_BASE_URL = os.getenv('LLM_BASE_URL') or None  # OpenAI-compatible endpoint, e.g. a local stub server
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', 0.5))  # seconds, doubled on every retry and jittered
+LLM_HEDGE_REQUESTS = os.getenv('LLM_HEDGE_REQUESTS', '').lower() in ('true', '1', 'yes')
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', 5))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', 30))
+# Governor on outgoing LLM calls, per worker process: split the provider limits across workers. 0 disables a rate limit
+LLM_MAX_CONCURRENT_CALLS = int(os.getenv('LLM_MAX_CONCURRENT_CALLS', 8))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', 0))
+LLM_TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', 0))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 30))  # seconds a call may wait before giving up
+# LLM backend: 'openai', 'record' (call the provider and save every call) or 'replay' (serve recordings offline)
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')
+LLM_RECORDINGS_PATH = os.getenv('LLM_RECORDINGS_PATH', BASE_DIR / 'llm_recordings.jsonl')
+LLM_REPLAY_LATENCY = float(os.getenv('LLM_REPLAY_LATENCY')) if os.getenv('LLM_REPLAY_LATENCY') else None  # seconds, overrides recorded latency
+LLM_REPLAY_LATENCY_SCALE = float(os.getenv('LLM_REPLAY_LATENCY_SCALE', 1.0))
+LLM_REPLAY_ERROR_RATE = float(os.getenv('LLM_REPLAY_ERROR_RATE', 0.0))
+# LLM call ledger: one llm_call row per provider call, written in batches by a background thread
+LLM_LEDGER_ENABLED = os.getenv('LLM_LEDGER_ENABLED', 'true').lower() in ('true', '1', 'yes')
+LLM_LEDGER_BATCH_SIZE = int(os.getenv('LLM_LEDGER_BATCH_SIZE', 100))
+LLM_LEDGER_FLUSH_SECONDS = float(os.getenv('LLM_LEDGER_FLUSH_SECONDS', 5))
+# LLM response cache: per-process LRU, optionally backed by the llm_response_cache table
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+LLM_CACHE_PERSISTENT = os.getenv('LLM_CACHE_PERSISTENT', '').lower() in ('true', '1', 'yes')
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600))  # seconds
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 1000))
+LLM_CACHE_PERSISTENT_MAX_ENTRIES = int(os.getenv('LLM_CACHE_PERSISTENT_MAX_ENTRIES', 20000))
+# Maximum concurrent LLM calls when generating a long document in chunks
+LLM_CHUNK_CONCURRENCY = int(os.getenv('LLM_CHUNK_CONCURRENCY', 4))
+# Flashcard generation output: 'csv', or 'json' for structured output (needs a model supporting JSON schemas)
+FLASHCARD_OUTPUT_FORMAT = os.getenv('FLASHCARD_OUTPUT_FORMAT', 'csv')
+
+# Bearer token accepted by the /metrics endpoint for scrapers, besides staff sessions
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# New flashcards scoring at least this similar (0-100) to a card in the deck are duplicates, 0 disables
+FLASHCARD_DEDUP_THRESHOLD = float(os.getenv('FLASHCARD_DEDUP_THRESHOLD', 90))
+FLASHCARD_DEDUP_ACTION = os.getenv('FLASHCARD_DEDUP_ACTION', 'drop')  # 'drop' or 'flag'
+
+# Box matches scoring at least this (0-100) locally skip the LLM
+BOX_MATCH_LOCAL_THRESHOLD = float(os.getenv('BOX_MATCH_LOCAL_THRESHOLD', 80))
+# Shorter answers (e.g. "Yes", a year) align almost anywhere, so they are always matched by the LLM
+BOX_MATCH_MIN_ANSWER_CHARS = int(os.getenv('BOX_MATCH_MIN_ANSWER_CHARS', 12))
+# Cards without boxes are linked to their source when at least this share (0-100) of their words is found
+SOURCE_LINK_THRESHOLD = float(os.getenv('SOURCE_LINK_THRESHOLD', 60))
+
+# Regeneration of flagged cards: at most this many cards per call, each with this many characters of its source
+REGENERATION_MAX_CARDS = int(os.getenv('REGENERATION_MAX_CARDS', 20))
+REGENERATION_EXCERPT_CHARS = int(os.getenv('REGENERATION_EXCERPT_CHARS', 600))
+
+# Suggested cards generated in the background for each page of an uploaded PDF, using at most
+# this share of the user's token allowance. Pages with less text than the minimum are skipped
+PREGENERATE_ON_UPLOAD = os.getenv('PREGENERATE_ON_UPLOAD', '').lower() in ('true', '1', 'yes')
+PREGENERATION_MAX_PAGES = int(os.getenv('PREGENERATION_MAX_PAGES', 30))
+PREGENERATION_MIN_PAGE_CHARS = int(os.getenv('PREGENERATION_MIN_PAGE_CHARS', 200))
+PREGENERATION_BUDGET_SHARE = float(os.getenv('PREGENERATION_BUDGET_SHARE', 0.5))
 
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.getenv('SECRET_KEY')
@@ -61,6 +129,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "flashcards.middleware.RequestMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "flashcard_project.urls"
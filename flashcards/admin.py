@@ -1,6 +1,10 @@
 from django.contrib import admin
 from flashcards.models import Flashcard, Deck, FailedFeedback
-from .models import UserPlan, TokenUsage, UserDocument
+from .models import UserPlan, TokenUsage, UserDocument, GenerationJob, TokenEstimatorFit, TokenUsageHourly, LLMCall
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from datetime import timedelta
 
 # Register your models here.
 @admin.register(UserDocument)
@@ -38,13 +42,14 @@ class UserPlanAdmin(admin.ModelAdmin):
 
 @admin.register(TokenUsage)
 class TokenUsageAdmin(admin.ModelAdmin):
+    # Raw rows only; analytics over time live in the TokenUsageHourly dashboard
     list_display = ('user_username', 'tokens_used', 'timestamp')
-    list_filter = ['timestamp']
     search_fields = ['user__username']
-    date_hierarchy = 'timestamp'
+    ordering = ('-timestamp',)
+    show_full_result_count = False
     
     # Values not editable
-    readonly_fields = ('user', 'tokens_used', 'timestamp')
+    readonly_fields = ('user', 'tokens_used', 'timestamp', 'input_chars', 'script', 'rolled_up')
 
     @admin.display(description='User')  # This is the modern way to set column header
     def user_username(self, obj):
@@ -52,4 +57,81 @@ class TokenUsageAdmin(admin.ModelAdmin):
     user_username.short_description = 'User'  # Column header in admin
 
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('user')
\ No newline at end of file
+        return super().get_queryset(request).select_related('user')
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'kind', 'status', 'tokens_used', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('user__username',)
+    readonly_fields = ('result_card_ids', 'result_cards', 'tokens_used', 'error', 'created_at', 'started_at', 'finished_at')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+@admin.register(LLMCall)
+class LLMCallAdmin(admin.ModelAdmin):
+    list_display = ('call_site', 'model', 'prompt_tokens', 'completion_tokens', 'latency', 'retries', 'failed', 'created_at')
+    list_filter = ('call_site', 'model', 'failed')
+    search_fields = ('prompt_hash',)
+    ordering = ('-created_at',)
+    show_full_result_count = False
+    readonly_fields = ('call_site', 'model', 'prompt_hash', 'prompt_tokens', 'completion_tokens', 'latency', 'retries', 'failed', 'token_usage', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(TokenEstimatorFit)
+class TokenEstimatorFitAdmin(admin.ModelAdmin):
+    list_display = ('script', 'per_char', 'intercept', 'margin', 'n_samples', 'fitted_at')
+    readonly_fields = ('script', 'per_char', 'intercept', 'margin', 'n_samples', 'fitted_at')
+
+@admin.register(TokenUsageHourly)
+class TokenUsageHourlyAdmin(admin.ModelAdmin):
+    """
+    Usage dashboard built only on the hourly rollups (see compact_token_usage).
+    """
+    change_list_template = 'admin/flashcards/tokenusagehourly/change_list.html'
+    list_display = ('user', 'hour', 'tokens_used', 'calls')
+    search_fields = ['user__username']
+    date_hierarchy = 'hour'
+    ordering = ('-hour',)
+    readonly_fields = ('user', 'hour', 'tokens_used', 'calls')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        since = timezone.now() - timedelta(days=days)
+        rollups = TokenUsageHourly.objects.filter(hour__gte=since)
+
+        extra_context = extra_context or {}
+        extra_context['dashboard_days'] = days
+        extra_context['dashboard_totals'] = rollups.aggregate(tokens=Sum('tokens_used'), calls=Sum('calls'))
+        extra_context['dashboard_daily'] = (
+            rollups.annotate(day=TruncDate('hour'))
+            .values('day')
+            .annotate(tokens=Sum('tokens_used'), calls=Sum('calls'))
+            .order_by('-day')
+        )
+        extra_context['dashboard_top_users'] = (
+            rollups.values('user__username')
+            .annotate(tokens=Sum('tokens_used'), calls=Sum('calls'))
+            .order_by('-tokens')[:10]
+        )
+
+        # "days" drives the dashboard only, keep it out of the changelist filters
+        if 'days' in request.GET:
+            request.GET = request.GET.copy()
+            del request.GET['days']
+        return super().changelist_view(request, extra_context=extra_context)
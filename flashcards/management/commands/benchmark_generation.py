@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from flashcards.models import Deck, UserDocument
+from flashcards.services import build_llm_client, get_flashcard_generator, match_flashcards_to_text_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput of flashcard generation plus box matching. "
+        "Flashcards and LLM calls are not written to the database. Meant to run with LLM_BACKEND=replay."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('text_file', help="Text to generate flashcards from, split into selections")
+        parser.add_argument('--requests', type=int, default=50, help="Number of selections to process")
+        parser.add_argument('--concurrency', type=int, default=8, help="Selections processed at the same time")
+        parser.add_argument('--selection-chars', type=int, default=1500, help="Characters per selection")
+        parser.add_argument('--context', default="", help="AI context sent with every selection")
+        parser.add_argument('--allow-live', action='store_true', help="Allow running against the real provider")
+
+    def handle(self, *args, **options):
+        if settings.LLM_BACKEND != 'replay' and not options['allow_live']:
+            raise CommandError(f"LLM_BACKEND is '{settings.LLM_BACKEND}', set it to 'replay' or pass --allow-live")
+
+        with open(options['text_file'], encoding='utf-8') as text_file:
+            text = text_file.read()
+        size = options['selection_chars']
+        selections = [text[start:start + size] for start in range(0, len(text), size) if text[start:start + size].strip()]
+        if not selections:
+            raise CommandError("The text file is empty")
+
+        # Unsaved instances: flashcards are built and matched but never stored
+        user = User(username='benchmark')
+        deck = Deck(user=user, name='benchmark')
+        document = UserDocument(user=user, deck=deck, name='benchmark')
+        # A client of its own, outside the LLM ledger
+        llm_client = build_llm_client(ledger=False)
+        generator = get_flashcard_generator(llm_client)
+
+        def run(idx):
+            selection = selections[idx % len(selections)]
+            boxes = [{'text': word} for word in selection.split()]
+            start = time.monotonic()
+            flashcards, tokens = generator.generate_flashcards(user, deck, selection, options['context'])
+            match_flashcards_to_text_batch(flashcards, document, boxes, llm_client=llm_client)
+            return time.monotonic() - start, len(flashcards), tokens
+
+        latencies, n_flashcards, n_tokens, errors = [], 0, 0, 0
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            futures = [executor.submit(run, idx) for idx in range(options['requests'])]
+            for future in futures:
+                try:
+                    latency, flashcards, tokens = future.result()
+                except Exception as e:
+                    errors += 1
+                    self.stderr.write(f"Selection failed: {e}")
+                    continue
+                latencies.append(latency)
+                n_flashcards += flashcards
+                n_tokens += tokens
+        elapsed = time.monotonic() - start
+
+        latencies.sort()
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
+        self.stdout.write(
+            f"{options['requests']} selections in {elapsed:.2f}s "
+            f"({options['requests'] / elapsed:.2f}/s), {errors} errors\n"
+            f"latency p50 {percentile(0.5):.2f}s, p95 {percentile(0.95):.2f}s, max {percentile(1.0):.2f}s\n"
+            f"{n_flashcards} flashcards, {n_tokens} tokens"
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from flashcards.models import TokenUsageHourly, LLMCall
+
+
+class Command(BaseCommand):
+    help = "Fold raw token usage into hourly rollups, trim old raw rows and old LLM call records."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=30, help="Days of raw token usage to keep after rolling up")
+        parser.add_argument('--ledger-keep-days', type=int, default=90, help="Days of LLM call records to keep")
+
+    def handle(self, *args, **options):
+        n_folded, n_deleted = TokenUsageHourly.compact(options['keep_days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {n_folded} token usage rows into hourly rollups, deleted {n_deleted} old rows"
+        ))
+        n_calls = LLMCall.trim(options['ledger_keep_days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {n_calls} old LLM call records"))
@@ -0,0 +1,43 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from flashcards.models import TokenUsage, TokenEstimatorFit
+from src.backend.token_estimator import fit_linear
+
+
+class Command(BaseCommand):
+    help = "Fit the token estimator coefficients per script bucket from recorded token usage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Only use usage recorded in the last N days")
+        parser.add_argument('--min-samples', type=int, default=50, help="Minimum samples needed to fit a bucket")
+        parser.add_argument('--coverage', type=float, default=0.9, help="Share of calls the estimate should cover")
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options['days'])
+        # Responses served from the LLM cache are recorded with 0 tokens and would drag the fit down
+        rows = TokenUsage.objects.filter(
+            timestamp__gte=since,
+            input_chars__isnull=False,
+            tokens_used__gt=0
+        ).exclude(script='').values_list('script', 'input_chars', 'tokens_used')
+
+        samples = {}
+        for script, input_chars, tokens_used in rows.iterator():
+            samples.setdefault(script, []).append((input_chars, tokens_used))
+
+        for script, script_samples in samples.items():
+            if len(script_samples) < options['min_samples']:
+                self.stdout.write(f"{script}: only {len(script_samples)} samples, skipping")
+                continue
+            per_char, intercept, margin = fit_linear(script_samples, options['coverage'])
+            fit, _ = TokenEstimatorFit.objects.update_or_create(
+                script=script,
+                defaults={
+                    'per_char': per_char,
+                    'intercept': intercept,
+                    'margin': margin,
+                    'n_samples': len(script_samples),
+                }
+            )
+            self.stdout.write(self.style.SUCCESS(f"Fitted {fit}"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from flashcards.models import Flashcard, UserDocument
+from flashcards.services import build_document_index, link_flashcards_to_source
+
+
+class Command(BaseCommand):
+    help = (
+        "Link flashcards without bounding boxes to their source in the PDF of their deck, "
+        "using the document word index. No LLM calls."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--build-missing', action='store_true', help="Index PDFs uploaded before word indexes existed")
+
+    def handle(self, *args, **options):
+        unlinked = Flashcard.objects.filter(Q(bounding_box=[]) | Q(bounding_box__isnull=True))
+        documents = UserDocument.objects.filter(file_type='pdf', deck__flashcards__in=unlinked).distinct()
+        if not options['build_missing']:
+            documents = documents.filter(word_index__isnull=False)
+
+        n_documents, n_linked = 0, 0
+        for document in documents:
+            index = None if hasattr(document, 'word_index') else build_document_index(document)
+            n_linked += len(link_flashcards_to_source(document, index))
+            n_documents += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Linked {n_linked} flashcards in {n_documents} documents"))
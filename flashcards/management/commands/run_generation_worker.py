@@ -0,0 +1,64 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from flashcards.models import GenerationJob
+from flashcards.services import run_generation_job
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process queued flashcard generation jobs with a pool of threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Number of jobs processed concurrently")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument('--heartbeat-interval', type=float, default=30.0, help="Seconds between heartbeats of running jobs and checks for stale ones")
+        parser.add_argument('--requeue-after', type=int, default=2, help="Minutes without a heartbeat after which a running job is requeued")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        self.stdout.write(f"Generation worker started with {threads} threads")
+
+        # Future of each job being processed -> job id
+        in_flight = {}
+        next_heartbeat = 0.0
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            while True:
+                in_flight = {future: job_id for future, job_id in in_flight.items() if not future.done()}
+                if time.monotonic() >= next_heartbeat:
+                    self.heartbeat(list(in_flight.values()), options['requeue_after'])
+                    next_heartbeat = time.monotonic() + options['heartbeat_interval']
+                free_slots = threads - len(in_flight)
+
+                jobs = GenerationJob.claim(free_slots) if free_slots else []
+                for job in jobs:
+                    in_flight[executor.submit(self.process, job.id)] = job.id
+
+                if not jobs:
+                    if options['once'] and not in_flight:
+                        break
+                    time.sleep(options['poll_interval'])
+
+        self.stdout.write("Generation worker stopped")
+
+    def heartbeat(self, job_ids, requeue_after):
+        """
+        Keep this worker's jobs alive and requeue those of workers that stopped beating.
+        """
+        if job_ids:
+            GenerationJob.heartbeat(job_ids)
+        requeued = GenerationJob.requeue_stale(requeue_after)
+        if requeued:
+            logger.warning(f"Requeued {requeued} stale generation jobs")
+
+    def process(self, job_id):
+        close_old_connections()
+        try:
+            job = GenerationJob.objects.select_related('user', 'deck', 'document').get(id=job_id)
+            run_generation_job(job)
+        finally:
+            close_old_connections()
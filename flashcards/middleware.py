@@ -0,0 +1,37 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from src.backend.metrics import HTTP_REQUEST_SECONDS
+
+
+class RequestMetricsMiddleware:
+    """
+    Record the latency of every request by view name, method and status code.
+    Works for both sync and async views.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, time.perf_counter() - start)
+        return response
+
+    def observe(self, request, response, seconds):
+        # Label by route name, not path, to keep the number of series bounded
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        HTTP_REQUEST_SECONDS.observe(seconds, view=view, method=request.method, status=response.status_code)
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-18 03:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0024_userdocument_file_size_alter_flashcard_accepted"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedLLMResponse",
+            fields=[
+                (
+                    "key",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("response", models.TextField()),
+                ("total_tokens", models.IntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("last_accessed", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "llm_response_cache",
+                "indexes": [
+                    models.Index(
+                        fields=["last_accessed"], name="llm_respons_last_ac_e30c76_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.4 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0026_generationjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenEstimatorFit",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("script", models.CharField(max_length=20, unique=True)),
+                ("per_char", models.FloatField()),
+                ("intercept", models.FloatField()),
+                ("margin", models.FloatField()),
+                ("n_samples", models.IntegerField()),
+                ("fitted_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "token_estimator_fit",
+            },
+        ),
+        migrations.AddField(
+            model_name="tokenusage",
+            name="input_chars",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="tokenusage",
+            name="script",
+            field=models.CharField(blank=True, default="", max_length=20),
+        ),
+    ]
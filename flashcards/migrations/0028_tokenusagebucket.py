@@ -0,0 +1,73 @@
+# Generated by Django 5.1.4 on 2026-10-18 03:42
+
+import django.db.models.deletion
+from django.conf import settings
+from datetime import timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_buckets(apps, schema_editor):
+    """
+    Fill the buckets from the token usage of the retention period, so the token
+    check does not reset when this migration is applied.
+    """
+    TokenUsage = apps.get_model("flashcards", "TokenUsage")
+    TokenUsageBucket = apps.get_model("flashcards", "TokenUsageBucket")
+    since = timezone.now() - timedelta(hours=24)
+    totals = {}
+    for user_id, timestamp, tokens_used in TokenUsage.objects.filter(
+        timestamp__gte=since
+    ).values_list("user_id", "timestamp", "tokens_used"):
+        key = (user_id, timestamp.replace(second=0, microsecond=0))
+        totals[key] = totals.get(key, 0) + tokens_used
+    TokenUsageBucket.objects.bulk_create(
+        [
+            TokenUsageBucket(user_id=user_id, minute=minute, tokens_used=tokens_used)
+            for (user_id, minute), tokens_used in totals.items()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0027_token_estimator"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenUsageBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("minute", models.DateTimeField()),
+                ("tokens_used", models.IntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="token_usage_buckets",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "token_usage_bucket",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "minute"), name="unique_user_minute_bucket"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
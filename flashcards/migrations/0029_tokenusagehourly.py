@@ -0,0 +1,67 @@
+# Generated by Django 5.1.4 on 2026-10-18 03:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0028_tokenusagebucket"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TokenUsageHourly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("hour", models.DateTimeField()),
+                ("tokens_used", models.BigIntegerField(default=0)),
+                ("calls", models.IntegerField(default=0)),
+            ],
+            options={
+                "verbose_name_plural": "token usage hourly",
+                "db_table": "token_usage_hourly",
+            },
+        ),
+        migrations.AddField(
+            model_name="tokenusage",
+            name="rolled_up",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="tokenusage",
+            index=models.Index(
+                fields=["rolled_up", "timestamp"], name="token_usage_rolled__c3c66c_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="tokenusagehourly",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="token_usage_hourly",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tokenusagehourly",
+            index=models.Index(fields=["hour"], name="token_usage_hour_63599f_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="tokenusagehourly",
+            constraint=models.UniqueConstraint(
+                fields=("user", "hour"), name="unique_user_hour_rollup"
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0029_tokenusagehourly"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="generationjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("selection", "selection"),
+                    ("text", "text"),
+                    ("document", "document"),
+                ],
+                default="selection",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 03:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0030_generationjob_document_kind"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DocumentWordIndex",
+            fields=[
+                (
+                    "document",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="word_index",
+                        serialize=False,
+                        to="flashcards.userdocument",
+                    ),
+                ),
+                ("boxes", models.JSONField(default=list)),
+                ("postings", models.JSONField(default=dict)),
+                ("built_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "document_word_index",
+            },
+        ),
+        migrations.AlterField(
+            model_name="generationjob",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("selection", "selection"),
+                    ("text", "text"),
+                    ("document", "document"),
+                    ("index", "index"),
+                ],
+                default="selection",
+                max_length=20,
+            ),
+        ),
+    ]
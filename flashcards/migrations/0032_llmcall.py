@@ -0,0 +1,62 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0031_documentwordindex"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LLMCall",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("call_site", models.CharField(max_length=50)),
+                ("model", models.CharField(max_length=100)),
+                ("prompt_hash", models.CharField(max_length=64)),
+                ("prompt_tokens", models.IntegerField(default=0)),
+                ("completion_tokens", models.IntegerField(default=0)),
+                ("latency", models.FloatField()),
+                ("retries", models.IntegerField(default=0)),
+                ("failed", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "token_usage",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="llm_calls",
+                        to="flashcards.tokenusage",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "llm_call",
+                "indexes": [
+                    models.Index(
+                        fields=["created_at"], name="llm_call_created_6378d2_idx"
+                    ),
+                    models.Index(
+                        fields=["call_site", "created_at"],
+                        name="llm_call_call_si_0fcd49_idx",
+                    ),
+                    models.Index(
+                        fields=["prompt_hash"], name="llm_call_prompt__1570bc_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flashcards", "0032_llmcall"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,10 +1,11 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 import uuid
 from datetime import date, timedelta
 from django.contrib.auth.models import User
 import logging
 from django.utils import timezone
-from django.db.models import Sum, Max
+from django.db.models import Sum, Max, F, Count, Q
+from django.db.models.functions import TruncHour
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -39,11 +40,15 @@ class TokenUsage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usage')
     tokens_used = models.IntegerField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    input_chars = models.IntegerField(null=True, blank=True)  # Length of the text sent, to calibrate estimates
+    script = models.CharField(max_length=20, blank=True, default='')  # Script bucket of that text
+    rolled_up = models.BooleanField(default=False)  # Already counted in TokenUsageHourly
 
     class Meta:
         db_table = 'token_usage'
         indexes = [
             models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['rolled_up', 'timestamp']),
         ]
 
     def __str__(self):
@@ -77,6 +82,230 @@ class TokenUsage(models.Model):
         """
         recent_timestamp = cls.objects.filter(user=user).aggregate(latest=Max('timestamp'))['latest']
         return recent_timestamp
+
+    @classmethod
+    def record(cls, user, usages):
+        """
+        Store token usage rows and add them to the user's per-minute counters
+        in the same transaction.
+
+        :param usages: list of dicts with the TokenUsage fields (tokens_used, input_chars, script)
+        """
+        with transaction.atomic():
+            rows = cls.objects.bulk_create([cls(user=user, **usage) for usage in usages])
+            TokenUsageBucket.add(user, sum(usage['tokens_used'] for usage in usages))
+        return rows
+
+class LLMCall(models.Model):
+    """
+    One call to the LLM provider: call site, model, tokens, latency and retries,
+    with a hash of the prompt (the LLM cache key) to spot repeated prompts.
+    Written in batches by the LLM ledger (src/backend/llm_ledger.py).
+    """
+    call_site = models.CharField(max_length=50)
+    model = models.CharField(max_length=100)
+    prompt_hash = models.CharField(max_length=64)
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    latency = models.FloatField()  # Seconds, retries included
+    retries = models.IntegerField(default=0)
+    failed = models.BooleanField(default=False)
+    # Generation row the call counts toward; empty for calls not billed to the user (e.g. box matching)
+    token_usage = models.ForeignKey(TokenUsage, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'llm_call'
+        indexes = [
+            models.Index(fields=['created_at']),
+            models.Index(fields=['call_site', 'created_at']),
+            models.Index(fields=['prompt_hash']),
+        ]
+
+    def __str__(self):
+        return f"{self.call_site} call to {self.model} at {self.created_at}"
+
+    @classmethod
+    def trim(cls, keep_days):
+        """
+        Delete calls older than keep_days.
+        """
+        cutoff = timezone.now() - timedelta(days=keep_days)
+        deleted, _ = cls.objects.filter(created_at__lt=cutoff).delete()
+        return deleted
+
+
+class TokenUsageHourly(models.Model):
+    """
+    Per-user, per-hour rollup of token_usage, maintained by the
+    compact_token_usage management command and read by the admin dashboard.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usage_hourly')
+    hour = models.DateTimeField()
+    tokens_used = models.BigIntegerField(default=0)
+    calls = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'token_usage_hourly'
+        verbose_name_plural = 'token usage hourly'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'hour'], name='unique_user_hour_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} used {self.tokens_used} tokens in {self.calls} calls at {self.hour}"
+
+    @classmethod
+    def compact(cls, keep_days, batch_size=1000):
+        """
+        Fold the raw token_usage rows of every completed hour into the rollups,
+        then delete raw rows older than keep_days that were already folded.
+
+        Returns (rows folded, raw rows deleted).
+        """
+        cutoff = timezone.now().replace(minute=0, second=0, microsecond=0)
+        with transaction.atomic():
+            # Fold and mark the same rows: a row saved by a request that straddled the hour
+            # can commit with a past timestamp after the pending set was read
+            pending_ids = list(
+                TokenUsage.objects.select_for_update()
+                .filter(rolled_up=False, timestamp__lt=cutoff)
+                .values_list('id', flat=True)
+            )
+            n_folded = 0
+            for start in range(0, len(pending_ids), batch_size):
+                batch = TokenUsage.objects.filter(pk__in=pending_ids[start:start + batch_size])
+                totals = (
+                    batch.annotate(hour=TruncHour('timestamp'))
+                    .values('user_id', 'hour')
+                    .annotate(tokens=Sum('tokens_used'), n_calls=Count('id'))
+                )
+                for row in totals:
+                    rollup, created = cls.objects.get_or_create(
+                        user_id=row['user_id'], hour=row['hour'],
+                        defaults={'tokens_used': row['tokens'], 'calls': row['n_calls']}
+                    )
+                    if not created:
+                        cls.objects.filter(pk=rollup.pk).update(
+                            tokens_used=F('tokens_used') + row['tokens'],
+                            calls=F('calls') + row['n_calls']
+                        )
+                    n_folded += row['n_calls']
+                batch.update(rolled_up=True)
+
+        n_deleted, _ = TokenUsage.objects.filter(
+            rolled_up=True,
+            timestamp__lt=timezone.now() - timedelta(days=keep_days)
+        ).delete()
+        return n_folded, n_deleted
+
+class TokenUsageBucket(models.Model):
+    """
+    Per-user, per-minute token counter covering the recent usage window, so the
+    token check reads a handful of rows instead of aggregating token_usage.
+    """
+    RETENTION = timedelta(hours=24)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='token_usage_buckets')
+    minute = models.DateTimeField()
+    tokens_used = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'token_usage_bucket'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'minute'], name='unique_user_minute_bucket'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} used {self.tokens_used} tokens at {self.minute}"
+
+    @classmethod
+    def add(cls, user, tokens):
+        """
+        Atomically add tokens to the current minute's bucket.
+        """
+        minute = timezone.now().replace(second=0, microsecond=0)
+        updated = cls.objects.filter(user=user, minute=minute).update(tokens_used=F('tokens_used') + tokens)
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user=user, minute=minute, tokens_used=tokens)
+        except IntegrityError:
+            # Another request created the bucket in the meantime
+            cls.objects.filter(user=user, minute=minute).update(tokens_used=F('tokens_used') + tokens)
+            return
+        # First usage this minute: drop this user's buckets past the retention period
+        cls.objects.filter(user=user, minute__lt=minute - cls.RETENTION).delete()
+
+    @classmethod
+    def get_window(cls, user, hours):
+        """
+        Return (tokens used, most recent usage minute) over the last `hours` hours
+        with a single indexed query.
+        """
+        # Include the partially expired oldest minute, erring on the side of counting it
+        since = (timezone.now() - timedelta(hours=hours)).replace(second=0, microsecond=0)
+        buckets = cls.objects.filter(user=user, minute__gte=since).values_list('minute', 'tokens_used')
+        total, most_recent = 0, None
+        for minute, tokens_used in buckets:
+            total += tokens_used
+            if most_recent is None or minute > most_recent:
+                most_recent = minute
+        return total, most_recent
+
+class TokenEstimatorFit(models.Model):
+    """
+    Coefficients of the token estimator for one script bucket, fitted from
+    TokenUsage rows by the fit_token_estimator management command.
+    """
+    script = models.CharField(max_length=20, unique=True)
+    per_char = models.FloatField()
+    intercept = models.FloatField()
+    margin = models.FloatField()
+    n_samples = models.IntegerField()
+    fitted_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'token_estimator_fit'
+
+    def __str__(self):
+        return f"{self.script}: {self.per_char:.3f} tokens/char + {self.intercept:.0f} (+{self.margin:.0f}), n={self.n_samples}"
+
+class CachedLLMResponse(models.Model):
+    """
+    Persistent tier of the LLM response cache, keyed on a hash of
+    (model, system_message, prompt).
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    response = models.TextField()
+    total_tokens = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'llm_response_cache'
+        indexes = [
+            models.Index(fields=['last_accessed']),
+        ]
+
+    def __str__(self):
+        return f"{self.key[:12]}... ({self.total_tokens} tokens) at {self.created_at}"
+
+    @classmethod
+    def evict(cls, ttl_seconds, max_entries):
+        """
+        Delete expired entries, then the least recently used ones above max_entries
+        """
+        cls.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=ttl_seconds)).delete()
+        stale_keys = cls.objects.order_by('-last_accessed').values_list('key', flat=True)[max_entries:]
+        stale_keys = list(stale_keys)
+        if stale_keys:
+            cls.objects.filter(key__in=stale_keys).delete()
+        return len(stale_keys)
             
 class Deck(models.Model):
     """
@@ -156,6 +385,24 @@ class UserDocument(models.Model):
     def __str__(self):
         return f"{self.s3_key} ({self.file_type}) {self.user} - {self.uploaded_at}"
 
+class DocumentWordIndex(models.Model):
+    """
+    Word boxes of an uploaded PDF and the inverted index over them
+    (see src/backend/document_index.py), used to link cards to their source
+    without calling the LLM.
+    """
+    document = models.OneToOneField(UserDocument, on_delete=models.CASCADE, primary_key=True, related_name='word_index')
+    boxes = models.JSONField(default=list)
+    postings = models.JSONField(default=dict)  # token -> positions in the token sequence of the boxes
+    built_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'document_word_index'
+
+    def __str__(self):
+        return f"Word index of {self.document.name} ({len(self.boxes)} boxes)"
+
+
 class Flashcard(models.Model):
     """
     Django model representing a flashcard.
@@ -210,6 +457,16 @@ class Flashcard(models.Model):
         """
         super().save(*args, **kwargs)
 
+    @classmethod
+    def bulk_store(cls, flashcards):
+        """
+        Insert new flashcards with a single query inside one transaction.
+        """
+        if not flashcards:
+            return []
+        with transaction.atomic():
+            return cls.objects.bulk_create(flashcards)
+
     def get_next_intervals_ease_factors(self):
         """
         Calculate the next review intervals and corresponding ease factors for each quality level.
@@ -308,6 +565,100 @@ class Flashcard(models.Model):
 
 
 
+class GenerationJob(models.Model):
+    """
+    Flashcard generation request processed in the background by the
+    run_generation_worker management command.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    ]
+
+    SELECTION = 'selection'  # Text selected in the document viewer, matched to boxes and saved
+    TEXT = 'text'  # Free text, cards are returned as proposals without saving
+    DOCUMENT = 'document'  # Uploaded PDF, cards generated page by page and saved as suggestions
+    INDEX = 'index'  # Uploaded PDF, word index built and the deck's cards linked to their source
+
+    KIND_CHOICES = [
+        (SELECTION, 'selection'),
+        (TEXT, 'text'),
+        (DOCUMENT, 'document'),
+        (INDEX, 'index'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_jobs')
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE, null=True, blank=True, related_name='generation_jobs')
+    document = models.ForeignKey(UserDocument, on_delete=models.CASCADE, null=True, blank=True, related_name='generation_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=SELECTION)
+    input_text = models.TextField()
+    context = models.TextField(blank=True, default='')
+    boxes = models.JSONField(default=list, blank=True)
+    use_cache = models.BooleanField(default=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    result_card_ids = models.JSONField(default=list, blank=True)
+    result_cards = models.JSONField(default=list, blank=True)  # question/answer proposals for TEXT jobs
+    tokens_used = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # last sign of life from the worker running the job
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'generation_job'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} for {self.user.username} - {self.status}"
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Atomically claim up to `limit` pending jobs, oldest first, and mark them as running.
+        Rows locked by another worker are skipped.
+        """
+        with transaction.atomic():
+            jobs = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status=cls.PENDING)
+                .order_by('created_at')[:limit]
+            )
+            if jobs:
+                now = timezone.now()
+                cls.objects.filter(id__in=[job.id for job in jobs]).update(status=cls.RUNNING, started_at=now, heartbeat_at=now)
+                for job in jobs:
+                    job.status, job.started_at, job.heartbeat_at = cls.RUNNING, now, now
+        return jobs
+
+    @classmethod
+    def heartbeat(cls, job_ids):
+        """
+        Record that the worker running these jobs is still alive.
+        """
+        return cls.objects.filter(id__in=job_ids, status=cls.RUNNING).update(heartbeat_at=timezone.now())
+
+    @classmethod
+    def requeue_stale(cls, minutes):
+        """
+        Put back in the queue running jobs without a heartbeat for `minutes`
+        (e.g. after a worker crash). Long jobs of live workers are left alone.
+        """
+        cutoff = timezone.now() - timedelta(minutes=minutes)
+        stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+        return cls.objects.filter(stale, status=cls.RUNNING).update(status=cls.PENDING, started_at=None, heartbeat_at=None)
+
+
 class FailedFeedback(models.Model):
     name = models.CharField(max_length=255)
     username = models.CharField(max_length=255, blank=True, null=True)
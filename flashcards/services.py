@@ -1,10 +1,27 @@
 from src.backend.flashcard_generator import FlashcardGenerator
-from src.backend.llm_client import LLMClient
-from src.backend.usage_limits import assert_input_length, assert_enough_tokens, InsufficientTokensError
-from src.backend.input_content_processors import get_docx, get_pdf
+from src.backend.llm_client import LLMClient, get_shared_client
+from src.backend.llm_governor import LLMGovernor, LLMBusyError
+from src.backend.llm_replay import build_backend
+from src.backend.llm_ledger import LLMLedger
+from src.backend.llm_cache import LLMResponseCache, DatabaseCacheTier
+from src.backend.token_estimator import detect_script
+from src.backend.flashcard_dedup import find_duplicates
+from src.backend.box_matcher import BoxText, match_boxes_locally, BOX_MATCH_STATS
+from src.backend.document_index import DocumentIndex, locate_flashcard, SOURCE_LINK_STATS
+from src.backend.response_repair import REPAIR_STATS
+from src.backend.metrics import REGISTRY, S3_REQUEST_SECONDS, stats_collector
+from src.backend.usage_limits import assert_input_length, assert_enough_tokens, estimate_tokens, InsufficientTokensError, MAX_INPUT_LENGTH, MAX_DOCUMENT_LENGTH
+from src.backend.input_content_processors import get_docx, get_pdf, get_pdf_pages
 import logging
+import io
+import asyncio
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from flashcards.models import TokenUsage, UserDocument
+from flashcards.models import TokenUsage, UserDocument, GenerationJob, Flashcard, DocumentWordIndex, LLMCall
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
 from rapidfuzz.distance import Levenshtein
 from botocore.exceptions import ClientError
 from boto3 import client as boto3_client
@@ -16,6 +33,95 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+REGISTRY.add_collector(stats_collector(
+    "flashcard_parse_outcomes_total", "How flashcards were parsed from LLM responses.", REPAIR_STATS
+))
+REGISTRY.add_collector(stats_collector(
+    "box_match_outcomes_total", "Flashcards matched to source boxes locally or by the LLM.", BOX_MATCH_STATS
+))
+REGISTRY.add_collector(stats_collector(
+    "source_link_outcomes_total", "Flashcards without boxes linked to their source by the document index.", SOURCE_LINK_STATS
+))
+
+def write_llm_calls(entries):
+    """
+    Store a batch of LLM ledger entries. Runs in the ledger's background thread.
+    """
+    close_old_connections()
+    LLMCall.objects.bulk_create([LLMCall(**entry.as_dict()) for entry in entries])
+
+# Per-call records of the LLM client, written in batches off the request path
+LLM_LEDGER = LLMLedger(
+    write_llm_calls,
+    batch_size=settings.LLM_LEDGER_BATCH_SIZE,
+    flush_interval=settings.LLM_LEDGER_FLUSH_SECONDS
+)
+
+def build_llm_client(ledger=True):
+    """
+    Create an LLM client configured from settings.
+    Pass ledger=False to keep its calls out of the LLM ledger.
+    """
+    return LLMClient(
+        settings.LLM_API_KEY,
+        model=settings.LLM_MODEL,
+        models=settings.LLM_MODELS,
+        timeout=settings.LLM_TIMEOUT,
+        connect_timeout=settings.LLM_CONNECT_TIMEOUT,
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        cache=build_llm_cache(),
+        base_url=settings.LLM_BASE_URL,
+        max_retries=settings.LLM_MAX_RETRIES,
+        retry_backoff=settings.LLM_RETRY_BACKOFF,
+        hedge=settings.LLM_HEDGE_REQUESTS,
+        circuit_failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+        circuit_reset_seconds=settings.LLM_CIRCUIT_RESET_SECONDS,
+        governor=LLMGovernor(
+            max_concurrency=settings.LLM_MAX_CONCURRENT_CALLS,
+            requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+            tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+            max_wait=settings.LLM_QUEUE_TIMEOUT,
+            estimate=estimate_tokens
+        ),
+        backend=build_backend(
+            settings.LLM_BACKEND,
+            settings.LLM_RECORDINGS_PATH,
+            latency=settings.LLM_REPLAY_LATENCY,
+            latency_scale=settings.LLM_REPLAY_LATENCY_SCALE,
+            error_rate=settings.LLM_REPLAY_ERROR_RATE
+        ),
+        ledger=LLM_LEDGER if ledger and settings.LLM_LEDGER_ENABLED else None
+    )
+
+def get_llm_client():
+    """
+    Return the process-wide LLM client configured from settings.
+    """
+    return get_shared_client(build_llm_client)
+
+def get_flashcard_generator(llm_client):
+    """
+    FlashcardGenerator using the output format configured in settings.
+    """
+    return FlashcardGenerator(llm_client, output_format=settings.FLASHCARD_OUTPUT_FORMAT)
+
+def build_llm_cache():
+    """
+    Build the LLM response cache from settings, or None when caching is disabled.
+    """
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    persistent_tier = None
+    if settings.LLM_CACHE_PERSISTENT:
+        persistent_tier = DatabaseCacheTier(
+            ttl=settings.LLM_CACHE_TTL,
+            max_entries=settings.LLM_CACHE_PERSISTENT_MAX_ENTRIES
+        )
+    return LLMResponseCache(
+        ttl=settings.LLM_CACHE_TTL,
+        max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+        persistent_tier=persistent_tier
+    )
 
 def delete_document_from_s3(document):
     s3_client = boto3_client(
@@ -25,13 +131,28 @@ def delete_document_from_s3(document):
         region_name=settings.AWS_S3_REGION_NAME
     )
     try:
-        s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=document.s3_key)
+        with S3_REQUEST_SECONDS.time(operation='delete'):
+            s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=document.s3_key)
         document.delete()
         return True
     except ClientError as e:
         logger.error(f"Error deleting document {document.id} from S3: {e}")
         return False
 
+def download_document_from_s3(document):
+    """
+    Return the content of a stored document as a file-like object.
+    """
+    s3_client = boto3_client(
+        's3',
+        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_S3_REGION_NAME
+    )
+    with S3_REQUEST_SECONDS.time(operation='download'):
+        response = s3_client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=document.s3_key)
+        return io.BytesIO(response['Body'].read())
+
 def match_selected_text_to_word_boxes(text, words):
     logger.debug(f"Matching selected text to word boxes...")
     words_list = [word['text'] for word in words]
@@ -76,20 +197,157 @@ def find_best_match_edit_distance(text, words):
     return best_start, best_end, best_score
 
 
-def get_matched_flashcards_to_text(doc_id, text, boxes, aiContext, user, deck):
+def remove_duplicate_flashcards(flashcards, deck, threshold=None, action=None):
+    """
+    Compare newly generated flashcards against the deck and against each other,
+    before any box matching or DB write.
+
+    Duplicates of another new card are always dropped. Duplicates of a card
+    already in the deck are dropped, or with action 'flag' kept as not accepted
+    with the source location of the card they duplicate.
+
+    :return: (flashcards_to_match, flagged_flashcards)
+    """
+    threshold = settings.FLASHCARD_DEDUP_THRESHOLD if threshold is None else threshold
+    action = action or settings.FLASHCARD_DEDUP_ACTION
+    if not flashcards or not threshold:
+        return (flashcards, [])
+
+    existing = list(Flashcard.objects.filter(deck=deck).values_list('id', 'question', 'answer'))
+    duplicates = find_duplicates(
+        [(flashcard.question, flashcard.answer) for flashcard in flashcards],
+        [(question, answer) for _, question, answer in existing],
+        threshold=threshold
+    )
+
+    # (new flashcard, id of the existing card it duplicates); several new cards may duplicate the same one
+    unique, flagged = [], []
+    for flashcard, duplicate in zip(flashcards, duplicates):
+        if duplicate is None:
+            unique.append(flashcard)
+            continue
+        index, score = duplicate
+        logger.debug(f"Duplicate flashcard (score {score:.0f}): {flashcard.question}")
+        if action == 'flag' and index < len(existing):
+            flagged.append((flashcard, existing[index][0]))
+
+    if flagged:
+        sources = {
+            source_id: (document_id, bounding_box)
+            for source_id, document_id, bounding_box in Flashcard.objects.filter(
+                id__in={source_id for _, source_id in flagged}
+            ).values_list('id', 'document_id', 'bounding_box')
+        }
+        for flashcard, source_id in flagged:
+            document_id, bounding_box = sources.get(source_id, (None, []))
+            flashcard.accepted = False
+            flashcard.document_id = document_id
+            flashcard.bounding_box = list(bounding_box or [])
+
+    logger.info(f"Removed {len(flashcards) - len(unique) - len(flagged)} and flagged {len(flagged)} duplicate flashcards out of {len(flashcards)}")
+    return (unique, [flashcard for flashcard, _ in flagged])
+
+def get_matched_flashcards_to_text(doc_id, text, boxes, aiContext, user, deck, llm_client=None, batch_matching=True, use_cache=True, accepted=True):
+    """
+    Generate flashcards from text of a document, match them to their boxes and
+    store them. With accepted=False they are stored as suggestions to review.
+    """
     logger.debug(f"Processing selected text...")
+    llm_client = llm_client or get_llm_client()
 
-    flashcards = generate_flashcards(content=text, content_format='raw_string', context=aiContext, user=user, deck=deck)
+    flashcards, tokens = generate_flashcards_with_usage(content=text, content_format='raw_string', context=aiContext, user=user, deck=deck, llm_client=llm_client, use_cache=use_cache)
+    flashcards, flagged = remove_duplicate_flashcards(flashcards, deck)
     logger.debug(f"Trying to match flashcards and store them in db...")
-    for flashcard in flashcards:
-        logger.debug(f"Matching flashcard:\n{flashcard}")
-        match_flashcard_to_text(flashcard, doc_id, text, boxes)
-        logger.debug(f"Trying to store flashcards in db...")
-        flashcard.save()
-        logger.debug(f"Stored flashcard in db")
+    user_document = UserDocument.objects.get(id=doc_id)
+    if batch_matching:
+        match_flashcards_to_text_batch(flashcards, user_document, boxes, llm_client=llm_client)
+    else:
+        for flashcard in flashcards:
+            logger.debug(f"Matching flashcard: {flashcard.question}")
+            match_flashcard_to_text(flashcard, user_document, text, boxes, llm_client=llm_client)
+    if not accepted:
+        for flashcard in flashcards:
+            flashcard.accepted = False
+    flashcards = Flashcard.bulk_store(flashcards + flagged)
+    logger.debug(f"Stored {len(flashcards)} flashcards in db")
+
+    return (flashcards, tokens)
+
+async def aget_matched_flashcards_to_text(doc_id, text, boxes, aiContext, user, deck, llm_client=None, batch_matching=True, use_cache=True):
+    """
+    Async version of get_matched_flashcards_to_text. When not batching, box
+    matching for all the generated flashcards runs concurrently.
+    """
+    logger.debug(f"Processing selected text (async)...")
+    llm_client = llm_client or get_llm_client()
+
+    flashcards = await agenerate_flashcards(content=text, content_format='raw_string', context=aiContext, user=user, deck=deck, llm_client=llm_client, use_cache=use_cache)
+    flashcards, flagged = await sync_to_async(remove_duplicate_flashcards)(flashcards, deck)
+    logger.debug(f"Trying to match {len(flashcards)} flashcards and store them in db...")
+    user_document = await UserDocument.objects.aget(id=doc_id)
+    if batch_matching:
+        await amatch_flashcards_to_text_batch(flashcards, user_document, boxes, llm_client=llm_client)
+    else:
+        await asyncio.gather(*[
+            amatch_flashcard_to_text(flashcard, user_document, text, boxes, llm_client=llm_client)
+            for flashcard in flashcards
+        ])
+    await sync_to_async(Flashcard.bulk_store)(flashcards + flagged)
+    logger.debug(f"Stored flashcards in db")
 
     return True
 
+async def aassert_can_generate(user, content):
+    """
+    Run the input length and token budget checks for a single generation call.
+    """
+    if not content.strip():
+        raise ValueError("No input provided to generate flashcards")
+    assert_input_length(content)
+    await sync_to_async(assert_enough_tokens)(user, content)
+
+async def astream_matched_flashcards_to_text(doc_id, text, boxes, aiContext, user, deck, llm_client=None, use_cache=True):
+    """
+    Streaming version of aget_matched_flashcards_to_text. Call aassert_can_generate first.
+
+    Yields ("flashcard", data) for every card as soon as its CSV row is complete,
+    then matches all cards to boxes, stores them and yields ("done", data) with
+    the saved cards.
+    """
+    llm_client = llm_client or get_llm_client()
+    generator = get_flashcard_generator(llm_client)
+
+    flashcards, tokens = [], 0
+    with LLM_LEDGER.scope() as ledger_scope:
+        async for event, payload in generator.astream_flashcards(user, deck, text, aiContext, use_cache=use_cache):
+            if event == "tokens":
+                tokens = payload
+                continue
+            flashcards.append(payload)
+            yield ("flashcard", {"question": payload.question, "answer": payload.answer})
+
+        logger.debug(f"Total tokens used: {tokens}")
+        rows = await sync_to_async(TokenUsage.record)(user, [{'tokens_used': tokens, 'input_chars': len(text), 'script': detect_script(text)}])
+        ledger_scope.link([row.id for row in rows])
+
+    # Cards were already shown while streaming; "done" lists only the ones stored
+    flashcards, flagged = await sync_to_async(remove_duplicate_flashcards)(flashcards, deck)
+    user_document = await UserDocument.objects.aget(id=doc_id)
+    await amatch_flashcards_to_text_batch(flashcards, user_document, boxes, llm_client=llm_client)
+    flashcards = await sync_to_async(Flashcard.bulk_store)(flashcards + flagged)
+    logger.debug(f"Stored {len(flashcards)} streamed flashcards in db")
+
+    yield ("done", {"flashcards": [
+        {
+            "id": str(flashcard.id),
+            "bbox": flashcard.bounding_box,
+            "question": flashcard.question,
+            "answer": flashcard.answer,
+            "accepted": flashcard.accepted
+        }
+        for flashcard in flashcards
+    ]})
+
 def format_boxes(boxes):
     logger.debug(f"Formatting boxes...")
     formatted_boxes = []
@@ -99,8 +357,10 @@ def format_boxes(boxes):
     formatted_boxes = '\n'.join(formatted_boxes)
     return formatted_boxes
 
-def match_flashcard_to_text(flashcard, doc_id, text, boxes):
-
+def build_box_matching_prompt(flashcard, boxes):
+    """
+    Build the (prompt, system_message) pair asking which boxes a flashcard came from.
+    """
     formatted_boxes = format_boxes(boxes)
 # Prepare prompt for the LLM
     prompt = f"""
@@ -122,13 +382,12 @@ If multiple boxes contributed to the flashcard, include all relevant indices.
 If no boxes seem relevant, return "None".
 """
     system_message = "You are an expert at matching flashcards to their source text locations."
+    return prompt, system_message
 
-    # Call the LLM with the prompt
-    llm_api_key = settings.LLM_API_KEY
-    llm_client = LLMClient(llm_api_key)
-    indices_response, tokens = llm_client.query(prompt, system_message)
-    
-    # Parse the response to get the box indices
+def parse_box_indices(indices_response):
+    """
+    Parse a comma-separated list of box indices returned by the LLM.
+    """
     try:
         if indices_response.lower() == "none":
             box_indices = []
@@ -138,64 +397,545 @@ If no boxes seem relevant, return "None".
         logger.error(f"Error parsing LLM response: {e}")
         logger.error(f"Original response: {indices_response}")
         box_indices = []
-    
-    # Store in flashcard: docId and boxes
-    user_document = UserDocument.objects.get(id=doc_id)
+    return box_indices
+
+def assign_boxes_to_flashcard(flashcard, user_document, boxes, box_indices):
+    """
+    Store the document and the selected boxes in the flashcard.
+    """
     flashcard.document = user_document
     for idx in box_indices:
         if 0 <= idx < len(boxes):
             box_i = boxes[idx]
             flashcard.bounding_box.append(box_i)
-        
-    print(flashcard)
+
     logger.debug(f"Matched flashcard to {len(box_indices)} boxes")
     logger.debug(f"Matched indices are:\n{box_indices}")
+
+def build_batch_box_matching_prompt(flashcards, boxes):
+    """
+    Build the (prompt, system_message) pair asking which boxes each of several
+    flashcards came from. The boxes are listed only once for all the cards.
+    """
+    formatted_boxes = format_boxes(boxes)
+    formatted_flashcards = '\n'.join(
+        f"{idx}. Question: {flashcard.question} | Answer: {flashcard.answer}"
+        for idx, flashcard in enumerate(flashcards)
+    )
+    prompt = f"""
+CONTEXT:
+I have a document with extracted text and several flashcards generated from this text.
+I need to identify which specific text boxes each flashcard's information came from.
+
+FLASHCARDS, in the format of idx. Question | Answer\n
+{formatted_flashcards}
+
+TEXT BOXES, in the format of idx,text\n
+{formatted_boxes}
+
+TASK:
+For every flashcard, return ONE line in the format "flashcard_idx: box indices".
+The box indices should be provided as a comma-separated list of integers (e.g., "2: 0, 3, 5").
+If multiple boxes contributed to a flashcard, include all relevant indices.
+If no boxes seem relevant for a flashcard, write "None" as its indices (e.g., "4: None").
+Return only these lines, without any other text.
+"""
+    system_message = "You are an expert at matching flashcards to their source text locations."
+    return prompt, system_message
+
+def parse_batch_box_indices(indices_response, n_flashcards):
+    """
+    Parse the "flashcard_idx: box indices" lines returned by the LLM into one
+    list of box indices per flashcard. Flashcards with a missing or malformed
+    line get an empty list.
+    """
+    box_indices_per_card = [[] for _ in range(n_flashcards)]
+    for line in indices_response.strip().splitlines():
+        if ':' not in line:
+            continue
+        card_idx, indices = line.split(':', 1)
+        try:
+            card_idx = int(card_idx.strip().rstrip('.'))
+        except ValueError:
+            logger.error(f"Error parsing flashcard index in line: {line}")
+            continue
+        if 0 <= card_idx < n_flashcards:
+            box_indices_per_card[card_idx] = parse_box_indices(indices.strip())
+    return box_indices_per_card
+
+def match_flashcards_locally(flashcards, user_document, boxes, threshold=None):
+    """
+    Match flashcards to their source boxes with the local fuzzy matcher.
+
+    Returns the flashcards whose best local score is below threshold, which
+    still need the LLM.
+    """
+    threshold = settings.BOX_MATCH_LOCAL_THRESHOLD if threshold is None else threshold
+    box_text = BoxText(boxes)
+    remaining = []
+    for flashcard in flashcards:
+        score, box_indices = match_boxes_locally(
+            flashcard.question, flashcard.answer, box_text, threshold, settings.BOX_MATCH_MIN_ANSWER_CHARS
+        )
+        if score >= threshold:
+            assign_boxes_to_flashcard(flashcard, user_document, boxes, box_indices)
+        else:
+            logger.debug(f"Local box match too weak ({score:.0f}) for: {flashcard.question}")
+            remaining.append(flashcard)
+
+    BOX_MATCH_STATS['local'] += len(flashcards) - len(remaining)
+    BOX_MATCH_STATS['llm'] += len(remaining)
+    logger.info(f"Matched {len(flashcards) - len(remaining)}/{len(flashcards)} flashcards locally (totals: {dict(BOX_MATCH_STATS)})")
+    return remaining
+
+def match_flashcards_to_text_batch(flashcards, user_document, boxes, llm_client=None):
+    """
+    Match all flashcards to their source boxes, locally when possible and with
+    a single LLM call for the rest.
+    """
+    flashcards = match_flashcards_locally(flashcards, user_document, boxes)
+    if not flashcards:
+        return True
+    prompt, system_message = build_batch_box_matching_prompt(flashcards, boxes)
+
+    llm_client = llm_client or get_llm_client()
+    indices_response, tokens = llm_client.query(prompt, system_message, call_site="box_matching")
+    box_indices_per_card = parse_batch_box_indices(indices_response, len(flashcards))
+
+    for flashcard, box_indices in zip(flashcards, box_indices_per_card):
+        assign_boxes_to_flashcard(flashcard, user_document, boxes, box_indices)
+    return True
+
+async def amatch_flashcards_to_text_batch(flashcards, user_document, boxes, llm_client=None):
+    """
+    Async version of match_flashcards_to_text_batch.
+    """
+    flashcards = match_flashcards_locally(flashcards, user_document, boxes)
+    if not flashcards:
+        return True
+    prompt, system_message = build_batch_box_matching_prompt(flashcards, boxes)
+
+    llm_client = llm_client or get_llm_client()
+    indices_response, tokens = await llm_client.aquery(prompt, system_message, call_site="box_matching")
+    box_indices_per_card = parse_batch_box_indices(indices_response, len(flashcards))
+
+    for flashcard, box_indices in zip(flashcards, box_indices_per_card):
+        assign_boxes_to_flashcard(flashcard, user_document, boxes, box_indices)
+    return True
+
+def match_flashcard_to_text(flashcard, user_document, text, boxes, llm_client=None):
+    if not match_flashcards_locally([flashcard], user_document, boxes):
+        return True
+    prompt, system_message = build_box_matching_prompt(flashcard, boxes)
+
+    # Call the LLM with the prompt
+    llm_client = llm_client or get_llm_client()
+    indices_response, tokens = llm_client.query(prompt, system_message, call_site="box_matching")
+    
+    # Parse the response to get the box indices
+    box_indices = parse_box_indices(indices_response)
+    
+    # Store in flashcard: document and boxes
+    assign_boxes_to_flashcard(flashcard, user_document, boxes, box_indices)
     return True
 
-def generate_flashcards(content, content_format, context, user, deck):
+async def amatch_flashcard_to_text(flashcard, user_document, text, boxes, llm_client=None):
+    """
+    Async version of match_flashcard_to_text.
+    """
+    if not match_flashcards_locally([flashcard], user_document, boxes):
+        return True
+    prompt, system_message = build_box_matching_prompt(flashcard, boxes)
+
+    llm_client = llm_client or get_llm_client()
+    indices_response, tokens = await llm_client.aquery(prompt, system_message, call_site="box_matching")
+    box_indices = parse_box_indices(indices_response)
+
+    assign_boxes_to_flashcard(flashcard, user_document, boxes, box_indices)
+    return True
+
+def extract_text(content, content_format):
+    """
+    Text to generate flashcards from: content itself when it is a string, else
+    the text of the file-like content according to content_format ('.pdf',
+    '.docx', '.txt' or 'string' for a StringIO).
+
+    Raises:
+        ValueError: If the content format is not supported
+    """
+    if isinstance(content, str):
+        return content
+    if content_format == '.pdf':
+        return get_pdf(content)
+    if content_format == '.docx':
+        return get_docx(content)
+    if content_format in ('.txt', 'string'):
+        text = content.read()
+        return text.decode('utf-8') if isinstance(text, bytes) else text
+    raise ValueError(f"Unsupported content format: {content_format}")
+
+def generate_flashcards(content, content_format, context, user, deck, llm_client=None, use_cache=True):
     """
     Service function to generate flashcards from the input file and context.
+    See generate_flashcards_with_usage for the arguments.
+
+    Returns:
+        A list of generated flashcards.
+    """
+    flashcards, tokens = generate_flashcards_with_usage(content, content_format, context, user, deck, llm_client=llm_client, use_cache=use_cache)
+    return flashcards
+
+def generate_flashcards_with_usage(content, content_format, context, user, deck, llm_client=None, use_cache=True):
+    """
+    Service function to generate flashcards from the input file and context,
+    also returning the tokens consumed.
 
     Args:
-        content: File object or StringIO object containing the input content
-        content_format: String indicating the format ('txt' or 'string')
+        content: Text, or a file or StringIO object containing the input content
+        content_format: String indicating the format (see extract_text)
         context: Additional context string from the HTTP request
+        llm_client: Optional LLMClient; defaults to the process-wide shared client
+        use_cache: Set to False to bypass cached LLM responses (explicit regeneration)
+
+    Texts longer than MAX_INPUT_LENGTH are split into chunks that are generated
+    concurrently and merged. Token usage is recorded once per chunk, also for
+    chunks whose responses could not be used.
 
     Returns:
-        A list of generated flashcards.
+        A tuple of the list of generated flashcards and the total tokens used.
 
     Raises:
         ValueError: If no valid input is provided or if file format is invalid
         RuntimeError: If flashcard generation fails
     """
     logger.debug(f"Generating flashcards with format: {content_format}")
-    llm_api_key = settings.LLM_API_KEY
-    llm_client = LLMClient(llm_api_key)
-    generator = FlashcardGenerator(llm_client)
+    llm_client = llm_client or get_llm_client()
+    generator = get_flashcard_generator(llm_client)
 
+    content = extract_text(content, content_format)
     if not content.strip():
         raise ValueError("No input provided to generate flashcards")
 
     try:
         # Check length of inut text and user token consumption before proceeding
-        assert_input_length(content)
-        assert_enough_tokens(user, content)
+        assert_input_length(content, max_length=MAX_DOCUMENT_LENGTH)
+        chunks = [content] if len(content) <= MAX_INPUT_LENGTH else generator.split_into_chunks(content)
+        assert_enough_tokens(user, content, n_calls=len(chunks))
+
+        with LLM_LEDGER.scope() as ledger_scope:
+            # Generate flashcards using the pipeline
+            try:
+                if len(chunks) == 1:
+                    flashcards, tokens = generator.generate_flashcards(text_input=content, context=context, user=user, deck=deck, use_cache=use_cache)
+                    chunk_usage = [(content, tokens)]
+                else:
+                    flashcards, chunk_usage = generator.generate_flashcards_chunked(
+                        user, deck, content, context,
+                        max_concurrency=settings.LLM_CHUNK_CONCURRENCY, use_cache=use_cache, chunks=chunks
+                    )
+            except ValueError as e:
+                record_generation_usage(user, failed_generation_usage(e, content), ledger_scope, chunked=len(chunks) > 1)
+                raise
+            record_generation_usage(user, chunk_usage, ledger_scope, chunked=len(chunks) > 1)
+
+        return (flashcards, sum(tokens for _, tokens in chunk_usage))
+
+    except (InsufficientTokensError, LLMBusyError) as e:
+        raise
 
-        # Generate flashcards using the pipeline
-        flashcards, tokens = generator.generate_flashcards(text_input=content, context=context, user=user, deck=deck)
+    except Exception as e:
+        logger.error(f"Error generating flashcards: {e}")
+        raise RuntimeError("Failed to generate flashcards") from e
 
-        # Update TokenUsage database
-        logger.debug(f"Total tokens used: {tokens}")
-        TokenUsage.objects.create(
-            user=user,
-            tokens_used=tokens
-        )
+def record_generation_usage(user, chunk_usage, ledger_scope, chunked=False):
+    """
+    Store one TokenUsage row per (chunk, tokens) pair and point the LLM calls of
+    the ledger scope to them. In chunked generation the calls of each chunk count
+    toward that chunk's row.
+    """
+    if not chunk_usage:
+        return
+    logger.debug(f"Total tokens used: {sum(tokens for _, tokens in chunk_usage)} over {len(chunk_usage)} calls")
+    rows = TokenUsage.record(user, [
+        {'tokens_used': tokens, 'input_chars': len(chunk), 'script': detect_script(chunk)}
+        for chunk, tokens in chunk_usage
+    ])
+    ledger_scope.link([row.id for row in rows], [chunk for chunk, _ in chunk_usage] if chunked else None)
+
+def failed_generation_usage(error, content):
+    """
+    (chunk, tokens) pairs of a generation that raised error: the chunks of a
+    chunked generation, or content for a single call.
+    """
+    chunk_usage = getattr(error, 'chunk_usage', None)
+    if chunk_usage is None:
+        chunk_usage = [(content, getattr(error, 'tokens_used', 0))]
+    return [(chunk, tokens) for chunk, tokens in chunk_usage if tokens]
+
+async def agenerate_flashcards(content, content_format, context, user, deck, llm_client=None, use_cache=True):
+    """
+    Async version of generate_flashcards. Database checks run in a thread so the
+    event loop is only blocked by the LLM call's own awaits.
+    """
+    logger.debug(f"Generating flashcards (async) with format: {content_format}")
+    llm_client = llm_client or get_llm_client()
+    generator = get_flashcard_generator(llm_client)
+
+    # Parsing a PDF or DOCX is CPU and file bound, keep it off the event loop
+    content = await sync_to_async(extract_text)(content, content_format)
+    if not content.strip():
+        raise ValueError("No input provided to generate flashcards")
+
+    try:
+        # Check length of inut text and user token consumption before proceeding
+        assert_input_length(content, max_length=MAX_DOCUMENT_LENGTH)
+        chunks = [content] if len(content) <= MAX_INPUT_LENGTH else generator.split_into_chunks(content)
+        await sync_to_async(assert_enough_tokens)(user, content, n_calls=len(chunks))
+
+        with LLM_LEDGER.scope() as ledger_scope:
+            # Generate flashcards using the pipeline
+            try:
+                if len(chunks) == 1:
+                    flashcards, tokens = await generator.agenerate_flashcards(text_input=content, context=context, user=user, deck=deck, use_cache=use_cache)
+                    chunk_usage = [(content, tokens)]
+                else:
+                    flashcards, chunk_usage = await generator.agenerate_flashcards_chunked(
+                        user, deck, content, context,
+                        max_concurrency=settings.LLM_CHUNK_CONCURRENCY, use_cache=use_cache, chunks=chunks
+                    )
+            except ValueError as e:
+                await sync_to_async(record_generation_usage)(user, failed_generation_usage(e, content), ledger_scope, chunked=len(chunks) > 1)
+                raise
+            await sync_to_async(record_generation_usage)(user, chunk_usage, ledger_scope, chunked=len(chunks) > 1)
 
         return flashcards
 
-    except InsufficientTokensError as e:
+    except (InsufficientTokensError, LLMBusyError) as e:
         raise
 
     except Exception as e:
         logger.error(f"Error generating flashcards: {e}")
-        raise RuntimeError("Failed to generate flashcards") from e
\ No newline at end of file
+        raise RuntimeError("Failed to generate flashcards") from e
+
+def source_excerpt(flashcard, max_chars=None):
+    """
+    Text of the boxes a flashcard was matched to, cut to max_chars.
+    """
+    max_chars = settings.REGENERATION_EXCERPT_CHARS if max_chars is None else max_chars
+    excerpt = " ".join(box.get('text', '') for box in flashcard.bounding_box or [] if isinstance(box, dict))
+    return excerpt[:max_chars]
+
+def prepare_regeneration(user, card_ids, feedback, context=""):
+    """
+    Load the flashcards to regenerate and their source excerpts, and run the
+    input length and token budget checks on everything sent to the LLM.
+
+    Returns:
+        (flashcards, excerpts, request_text)
+    """
+    flashcards = list(Flashcard.objects.filter(id__in=card_ids, user=user).select_related('user', 'deck'))
+    if not flashcards:
+        raise ValueError("No flashcards to regenerate")
+    excerpts = [source_excerpt(flashcard) for flashcard in flashcards]
+
+    request_text = feedback + context + "".join(
+        flashcard.question + flashcard.answer + excerpt for flashcard, excerpt in zip(flashcards, excerpts)
+    )
+    assert_input_length(request_text)
+    assert_enough_tokens(user, request_text)
+    return (flashcards, excerpts, request_text)
+
+def save_regenerated_flashcards(user, flashcards, regenerated, tokens, request_text, ledger_scope):
+    """
+    Record the token usage of a regeneration and update the rewritten flashcards.
+    Rewrites are paired by the idx the LLM returned, never by position.
+    """
+    rows = TokenUsage.record(user, [{'tokens_used': tokens, 'input_chars': len(request_text), 'script': detect_script(request_text)}])
+    ledger_scope.link([row.id for row in rows])
+    if not regenerated:
+        raise RuntimeError("The LLM returned no usable regenerated flashcards")
+
+    updated = []
+    for idx, new_flashcard in sorted(regenerated.items()):
+        flashcard = flashcards[idx]
+        flashcard.question = new_flashcard.question
+        flashcard.answer = new_flashcard.answer
+        updated.append(flashcard)
+    Flashcard.objects.bulk_update(updated, ['question', 'answer'])
+    logger.info(f"Regenerated {len(updated)}/{len(flashcards)} flashcards with {tokens} tokens")
+    return updated
+
+def regenerate_flashcards(user, card_ids, feedback, context="", llm_client=None):
+    """
+    Rewrite only the given flashcards of the user according to the feedback and
+    update them in place. The prompt holds those cards and a bounded excerpt of
+    each one's source, so its size does not depend on the deck or the document.
+
+    Returns:
+        (flashcards, tokens), the updated flashcards.
+    """
+    flashcards, excerpts, request_text = prepare_regeneration(user, card_ids, feedback, context)
+    generator = get_flashcard_generator(llm_client or get_llm_client())
+    with LLM_LEDGER.scope() as ledger_scope:
+        regenerated, tokens = generator.regenerate_flashcards(flashcards, feedback, excerpts, context)
+        updated = save_regenerated_flashcards(user, flashcards, regenerated, tokens, request_text, ledger_scope)
+    return (updated, tokens)
+
+async def aregenerate_flashcards(user, card_ids, feedback, context="", llm_client=None):
+    """
+    Async version of regenerate_flashcards. Database work runs in a thread.
+    """
+    flashcards, excerpts, request_text = await sync_to_async(prepare_regeneration)(user, card_ids, feedback, context)
+    generator = get_flashcard_generator(llm_client or get_llm_client())
+    with LLM_LEDGER.scope() as ledger_scope:
+        regenerated, tokens = await generator.aregenerate_flashcards(flashcards, feedback, excerpts, context)
+        updated = await sync_to_async(save_regenerated_flashcards)(user, flashcards, regenerated, tokens, request_text, ledger_scope)
+    return (updated, tokens)
+
+def pregenerate_document_flashcards(document, user, deck, context="", llm_client=None):
+    """
+    Generate suggested flashcards (accepted=False) for each page of an uploaded
+    PDF, matched to the page's word boxes so the viewer shows them right away.
+
+    Pages are processed in order until PREGENERATION_MAX_PAGES, until the job
+    has used PREGENERATION_BUDGET_SHARE of the user's token allowance, or until
+    the user runs out of tokens. Cards of the pages already done are kept, and a
+    page whose generation fails is logged and skipped.
+
+    Returns:
+        (flashcards, tokens), the stored flashcards.
+    """
+    llm_client = llm_client or get_llm_client()
+    pages = get_pdf_pages(download_document_from_s3(document))
+    build_document_index(document, pages)
+    budget = int(user.userplan.total_tokens_allowed * settings.PREGENERATION_BUDGET_SHARE)
+
+    stored, tokens, failed_pages = [], 0, []
+    for page in pages[:settings.PREGENERATION_MAX_PAGES]:
+        if len(page['text'].strip()) < settings.PREGENERATION_MIN_PAGE_CHARS:
+            continue
+        if tokens + estimate_tokens(page['text']) > budget:
+            logger.info(f"Pre-generation of document {document.id} stopped at page {page['page']}: budget of {budget} tokens reached")
+            break
+        try:
+            flashcards, page_tokens = get_matched_flashcards_to_text(
+                document.id, page['text'], page['boxes'], context, user, deck,
+                llm_client=llm_client, accepted=False
+            )
+        except InsufficientTokensError:
+            logger.info(f"Pre-generation of document {document.id} stopped at page {page['page']}: user out of tokens")
+            break
+        except Exception as e:
+            # A failed page must not lose the cards of the others
+            logger.error(f"Pre-generation of document {document.id} failed on page {page['page']}: {e}", exc_info=True)
+            failed_pages.append(page['page'])
+            continue
+        stored.extend(flashcards)
+        tokens += page_tokens
+
+    if failed_pages:
+        logger.warning(f"Pre-generation of document {document.id} skipped failed pages {failed_pages}")
+    logger.info(f"Pre-generated {len(stored)} flashcards for document {document.id} with {tokens} tokens")
+    return (stored, tokens)
+
+def build_document_index(document, pages=None):
+    """
+    Build and store the word index of a PDF document, from its pages when
+    already extracted with get_pdf_pages.
+    """
+    if pages is None:
+        pages = get_pdf_pages(download_document_from_s3(document), strip_boilerplate=False)
+    index = DocumentIndex.from_pages(pages)
+    DocumentWordIndex.objects.update_or_create(document=document, defaults=index.to_dict())
+    logger.info(f"Indexed {len(index.boxes)} word boxes of document {document.id}")
+    return index
+
+def link_flashcards_to_source(document, index=None, threshold=None):
+    """
+    Fill in the document and bounding boxes of the cards of the document's deck
+    that have no boxes (e.g. created manually or from a file), by locating them
+    in the document's word index. No LLM calls.
+
+    Returns:
+        The linked flashcards.
+    """
+    threshold = settings.SOURCE_LINK_THRESHOLD if threshold is None else threshold
+    if index is None:
+        word_index = DocumentWordIndex.objects.get(document=document)
+        index = DocumentIndex(word_index.boxes, word_index.postings)
+
+    flashcards = Flashcard.objects.filter(deck=document.deck_id).filter(Q(bounding_box=[]) | Q(bounding_box__isnull=True))
+    linked = []
+    for flashcard in flashcards:
+        score, box_indices = locate_flashcard(flashcard.question, flashcard.answer, index, threshold)
+        if not box_indices:
+            logger.debug(f"No source found ({score:.0f}) for: {flashcard.question}")
+            SOURCE_LINK_STATS['unmatched'] += 1
+            continue
+        flashcard.document = document
+        flashcard.bounding_box = [index.boxes[idx] for idx in box_indices]
+        linked.append(flashcard)
+    SOURCE_LINK_STATS['linked'] += len(linked)
+
+    Flashcard.objects.bulk_update(linked, ['document', 'bounding_box'])
+    logger.info(f"Linked {len(linked)} flashcards to their source in document {document.id}")
+    return linked
+
+def out_of_tokens_message(error):
+    """
+    User-facing message for an InsufficientTokensError.
+    """
+    time_in_4_hours = error.most_recent_usage_timestamp + timedelta(hours=4) + timedelta(minutes=1)
+    formatted_time = time_in_4_hours.strftime('%I:%M %p')
+    if formatted_time.startswith('0'): # trick to avoid the preceding 0
+        formatted_time = formatted_time[1:]
+    return f"You are out of tokens until {formatted_time}. Unlimited Pro version coming soon."
+
+LLM_BUSY_MESSAGE = "The card generator is very busy right now. Please try again in a minute."
+
+def run_generation_job(job):
+    """
+    Run a claimed GenerationJob and store its outcome (cards, tokens, status) on it.
+    """
+    logger.info(f"Running generation job {job.id} ({job.kind})")
+    try:
+        if job.kind == GenerationJob.SELECTION:
+            flashcards, tokens = get_matched_flashcards_to_text(
+                job.document_id, job.input_text, job.boxes, job.context, job.user, job.deck,
+                use_cache=job.use_cache
+            )
+            job.result_card_ids = [str(flashcard.id) for flashcard in flashcards]
+        elif job.kind == GenerationJob.DOCUMENT:
+            flashcards, tokens = pregenerate_document_flashcards(job.document, job.user, job.deck, job.context)
+            job.result_card_ids = [str(flashcard.id) for flashcard in flashcards]
+        elif job.kind == GenerationJob.INDEX:
+            flashcards = link_flashcards_to_source(job.document, build_document_index(job.document))
+            job.result_card_ids = [str(flashcard.id) for flashcard in flashcards]
+            tokens = 0
+        else:
+            flashcards, tokens = generate_flashcards_with_usage(
+                job.input_text, 'string', job.context, job.user, job.deck,
+                use_cache=job.use_cache
+            )
+            job.result_cards = [{"question": fc.question, "answer": fc.answer} for fc in flashcards]
+        job.tokens_used = tokens
+        job.status = GenerationJob.DONE
+
+    except InsufficientTokensError as e:
+        logger.info(f"Generation job {job.id} rejected: {e}")
+        job.status = GenerationJob.FAILED
+        job.error = out_of_tokens_message(e)
+
+    except LLMBusyError as e:
+        logger.warning(f"Generation job {job.id} gave up waiting for the LLM: {e}")
+        job.status = GenerationJob.FAILED
+        job.error = LLM_BUSY_MESSAGE
+
+    except Exception as e:
+        logger.error(f"Generation job {job.id} failed: {e}", exc_info=True)
+        job.status = GenerationJob.FAILED
+        job.error = "There was an error while generating your cards. Please try again."
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result_card_ids', 'result_cards', 'tokens_used', 'status', 'error', 'finished_at'])
+    return job
@@ -1,9 +1,22 @@
 from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
 from django.dispatch import receiver
 from .models import UserPlan
 from django.contrib.auth.models import User
+from src.backend.metrics import DB_QUERY_SECONDS
 
 @receiver(post_save, sender=User)
 def create_user_plan(sender, instance, created, **kwargs):
     if created:  # Only create a UserPlan if the User is newly created
         UserPlan.objects.create(user=instance)
+
+@receiver(connection_created)
+def time_database_queries(sender, connection, **kwargs):
+    """
+    Time every query run on a new database connection, labelled by statement type.
+    """
+    def timed_execute(execute, sql, params, many, context):
+        statement = sql.lstrip().split(' ', 1)[0].upper() if sql else 'UNKNOWN'
+        with DB_QUERY_SECONDS.time(statement=statement):
+            return execute(sql, params, many, context)
+    connection.execute_wrappers.append(timed_execute)
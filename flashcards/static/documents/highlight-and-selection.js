@@ -234,8 +234,12 @@ document.getElementById('submitAiFlashcard').addEventListener('click', async fun
         const boxes = await processSelection(lastSelectionData);
         console.log('Boxes from text-to-boxes:', boxes);
 
-        // Step 2: Get matched flashcards to text using boxes
-        await matchFlashcardsToText(lastSelectionData, aiContext, boxes, currentDeckId);
+        // Step 2: Stream flashcards matched to text using boxes
+        let cardCount = 0;
+        await streamFlashcardsToText(lastSelectionData, aiContext, boxes, currentDeckId, (card) => {
+            cardCount += 1;
+            showLoading(`Generated ${cardCount} card${cardCount === 1 ? '' : 's'}... ${card.question}`);
+        });
 
         // Refresh the flashcards after successful processing
         if (currentDocumentId) {
@@ -304,6 +308,67 @@ async function matchFlashcardsToText(selection, aiContext, boxes, deckId) {
 }
 
 
+// Function 3: Call /stream-flashcards-to-text/ and report each card as it arrives
+async function streamFlashcardsToText(selection, aiContext, boxes, deckId, onCard) {
+    const response = await fetch('/stream-flashcards-to-text/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCsrfToken()
+        },
+        body: JSON.stringify({
+            selection: selection,
+            aiContext: aiContext,
+            boxes: boxes,
+            deck_id: deckId
+        })
+    });
+
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.error || 'Failed to generate cards.');
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-sent events are separated by a blank line
+        let separatorIndex;
+        while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separatorIndex);
+            buffer = buffer.slice(separatorIndex + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach((line) => {
+                if (line.startsWith('event: ')) eventName = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            const payload = data ? JSON.parse(data) : {};
+
+            if (eventName === 'flashcard') {
+                onCard(payload);
+            } else if (eventName === 'done') {
+                result = payload;
+            } else if (eventName === 'error') {
+                throw new Error(payload.error || 'Failed to generate cards.');
+            }
+        }
+    }
+
+    if (!result) {
+        throw new Error('Failed to generate cards.');
+    }
+    return result;
+}
+
 // Click handler for AI button
 document.getElementById('aiButton').addEventListener('click', () => {
     resetCreateState(); // Clear before entering AI view
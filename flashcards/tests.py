@@ -1,3 +1,633 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+import httpx
+import openai
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from datetime import timedelta
+from django.utils import timezone
+from flashcards.models import CachedLLMResponse, Deck, Flashcard, GenerationJob, TokenEstimatorFit, TokenUsage, TokenUsageBucket, TokenUsageHourly, UserDocument
+from flashcards.services import get_matched_flashcards_to_text, prepare_regeneration, regenerate_flashcards, pregenerate_document_flashcards, remove_duplicate_flashcards, match_flashcards_to_text_batch, build_batch_box_matching_prompt, extract_text, generate_flashcards, generate_flashcards_with_usage
+from src.backend.flashcard_generator import FlashcardGenerator
+from src.backend.llm_cache import DatabaseCacheTier, LLMResponseCache
+from src.backend.llm_client import LLMClient
+from src.backend.llm_ledger import LLMLedger
+from src.backend.llm_replay import ReplayBackend, ReplayCompletions, ChatClient
+from src.backend.token_estimator import TokenEstimator
 
-# Create your tests here.
+MODEL = "replay-model"
+
+
+class ReplayTestCase(TestCase):
+    """
+    Tests running the real LLMClient against recorded responses instead of the provider.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='replay')
+        self.deck = Deck.objects.create(user=self.user, name='replay')
+        recordings = tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False)
+        recordings.close()
+        self.recordings_path = recordings.name
+        self.addCleanup(os.remove, self.recordings_path)
+
+    def record(self, system_message, prompt, response):
+        with open(self.recordings_path, 'a', encoding='utf-8') as recordings:
+            recordings.write(json.dumps({
+                'model': MODEL,
+                'system_message': system_message,
+                'prompt': prompt,
+                'response': response,
+                'prompt_tokens': 10,
+                'completion_tokens': 5,
+                'latency': 0,
+            }) + "\n")
+
+    def llm_client(self):
+        return LLMClient("test", model=MODEL, backend=ReplayBackend(self.recordings_path, latency=0), max_retries=0)
+
+
+class FlashcardGeneratorReplayTests(ReplayTestCase):
+    def record_generation(self, text, response):
+        generator = FlashcardGenerator(None)
+        prompt, system_message = generator.build_generation_prompt(text, "")
+        self.record(system_message, prompt, response)
+
+    def test_parses_recorded_response(self):
+        text = "Mitochondria produce most of the ATP of the cell."
+        self.record_generation(text, '"What produces most of the ATP of the cell?","Mitochondria"\n"What is ATP?","The energy currency of the cell"')
+        generator = FlashcardGenerator(self.llm_client())
+
+        flashcards, tokens = generator.generate_flashcards(self.user, self.deck, text, "")
+
+        self.assertEqual(tokens, 15)
+        self.assertEqual(
+            [(f.question, f.answer) for f in flashcards],
+            [("What produces most of the ATP of the cell?", "Mitochondria"), ("What is ATP?", "The energy currency of the cell")]
+        )
+        self.assertTrue(all(f.user == self.user and f.deck == self.deck for f in flashcards))
+
+    def test_repairs_response_wrapped_in_code_fence(self):
+        text = "Paris is the capital of France."
+        self.record_generation(text, '```csv\n"What is the capital of France?","Paris"\n```')
+        generator = FlashcardGenerator(self.llm_client())
+
+        flashcards, tokens = generator.generate_flashcards(self.user, self.deck, text, "")
+
+        self.assertEqual([(f.question, f.answer) for f in flashcards], [("What is the capital of France?", "Paris")])
+
+    def test_caches_only_responses_that_could_be_parsed(self):
+        self.record_generation("Paris is the capital of France.", '"What is the capital of France?","Paris"')
+        self.record_generation("Unusable text.", "I cannot create flashcards from this text.")
+        cache = LLMResponseCache(persistent_tier=DatabaseCacheTier(ttl=3600, max_entries=100))
+        llm_client = LLMClient("test", model=MODEL, backend=ReplayBackend(self.recordings_path, latency=0), max_retries=0, cache=cache)
+        generator = FlashcardGenerator(llm_client)
+
+        with self.assertRaises(ValueError):
+            generator.generate_flashcards(self.user, self.deck, "Unusable text.", "")
+        generator.generate_flashcards(self.user, self.deck, "Paris is the capital of France.", "")
+
+        self.assertEqual(list(CachedLLMResponse.objects.values_list('response', flat=True)), ['"What is the capital of France?","Paris"'])
+        flashcards, tokens = generator.generate_flashcards(self.user, self.deck, "Paris is the capital of France.", "")
+        self.assertEqual(tokens, 0)
+
+    def test_split_into_chunks_respects_the_budget(self):
+        generator = FlashcardGenerator(None)
+        paragraphs = [f"Paragraph {idx} " + "word " * 50 for idx in range(20)]
+
+        chunks = generator.split_into_chunks("\n\n".join(paragraphs), max_chunk_chars=1000)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in chunks))
+        self.assertEqual(" ".join(" ".join(chunks).split()), " ".join(" ".join(paragraphs).split()))
+
+    def test_split_into_chunks_cuts_overlong_lines(self):
+        generator = FlashcardGenerator(None)
+
+        chunks = generator.split_into_chunks("x" * 2500, max_chunk_chars=1000)
+
+        self.assertEqual([len(chunk) for chunk in chunks], [1000, 1000, 500])
+
+    def test_chunked_generation_merges_duplicate_questions(self):
+        # Every chunk is answered by the same recording (matched by system message)
+        self.record_generation("unused", '"What is a cell?","The basic unit of life"\n"What is DNA?","The genetic material"')
+        generator = FlashcardGenerator(self.llm_client())
+        chunks = ["First chunk about cells.", "Second chunk about cells."]
+
+        flashcards, chunk_usage = generator.generate_flashcards_chunked(self.user, self.deck, "", "", chunks=chunks)
+
+        self.assertEqual([f.question for f in flashcards], ["What is a cell?", "What is DNA?"])
+        self.assertEqual(chunk_usage, [(chunk, 15) for chunk in chunks])
+
+    def test_chunked_generation_links_each_call_to_its_chunk(self):
+        self.record_generation("unused", '"What is a cell?","The basic unit of life"')
+        written = []
+        ledger = LLMLedger(written.extend)
+        llm_client = LLMClient("test", model=MODEL, backend=ReplayBackend(self.recordings_path, latency=0), max_retries=0, ledger=ledger)
+        generator = FlashcardGenerator(llm_client)
+        chunks = ["First chunk.", "Second chunk.", "Third chunk."]
+
+        with ledger.scope() as ledger_scope:
+            flashcards, chunk_usage = generator.generate_flashcards_chunked(self.user, self.deck, "", "", chunks=chunks)
+            ledger_scope.link([101, 102, 103], [chunk for chunk, _ in chunk_usage])
+
+        self.assertEqual(sorted((entry.group, entry.token_usage_id) for entry in ledger_scope.entries), sorted(zip(chunks, [101, 102, 103])))
+
+    def test_chunked_generation_records_the_usage_of_failed_chunks(self):
+        chunks = ["First chunk about cells.", "Second chunk about DNA.", "Third chunk, unusable."]
+        self.record_generation(chunks[0], '"What is a cell?","The basic unit of life"')
+        self.record_generation(chunks[1], '"What is DNA?","The genetic material"')
+        # No enforce_format recording: the cleanup call fails too
+        self.record_generation(chunks[2], 'I cannot create flashcards from this text.')
+
+        with mock.patch.object(FlashcardGenerator, 'split_into_chunks', return_value=chunks), \
+             mock.patch('flashcards.services.MAX_INPUT_LENGTH', 10), \
+             mock.patch('src.backend.flashcard_generator.connections') as connections:
+            flashcards, tokens = generate_flashcards_with_usage(" ".join(chunks), 'raw_string', "", self.user, self.deck, llm_client=self.llm_client())
+
+        self.assertEqual([f.question for f in flashcards], ["What is a cell?", "What is DNA?"])
+        self.assertEqual(tokens, 45)
+        self.assertEqual(sorted(TokenUsage.objects.filter(user=self.user).values_list('input_chars', 'tokens_used')), sorted((len(chunk), 15) for chunk in chunks))
+        # Every worker thread closed its database connections
+        self.assertEqual(connections.close_all.call_count, 3)
+
+    def test_failed_generation_records_the_tokens_used(self):
+        text = "Unusable text."
+        self.record_generation(text, 'I cannot create flashcards from this text.')
+
+        with self.assertRaises(RuntimeError):
+            generate_flashcards_with_usage(text, 'raw_string', "", self.user, self.deck, llm_client=self.llm_client())
+
+        self.assertEqual(list(TokenUsage.objects.filter(user=self.user).values_list('input_chars', 'tokens_used')), [(len(text), 15)])
+
+    def test_generates_from_uploaded_text_file(self):
+        text = "Mitochondria produce most of the ATP of the cell."
+        self.record_generation(text, '"What produces most of the ATP of the cell?","Mitochondria"')
+        upload = SimpleUploadedFile("notes.txt", text.encode('utf-8'))
+
+        flashcards = generate_flashcards(upload, '.txt', "", self.user, self.deck, llm_client=self.llm_client())
+
+        self.assertEqual([f.answer for f in flashcards], ["Mitochondria"])
+
+
+class RejectingCompletions(ReplayCompletions):
+    """
+    Replayed completions from a model without structured output support.
+    """
+    def create(self, model, messages, stream=False, response_format=openai.NOT_GIVEN, **kwargs):
+        if response_format is not openai.NOT_GIVEN:
+            request = httpx.Request("POST", "http://replay/chat/completions")
+            raise openai.BadRequestError("response_format is not supported", response=httpx.Response(400, request=request), body=None)
+        return super().create(model, messages, stream=stream, **kwargs)
+
+
+class RejectingBackend(ReplayBackend):
+    def sync_client(self, client):
+        return ChatClient(RejectingCompletions(self.store, **self.options))
+
+    def async_client(self, client):
+        return ChatClient(RejectingCompletions(self.store, is_async=True, **self.options))
+
+
+class JSONFallbackTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.text = "Mitochondria produce most of the ATP of the cell."
+        prompt, system_message = FlashcardGenerator(None).build_generation_prompt(self.text, "")
+        self.record(system_message, prompt, '"What produces most of the ATP of the cell?","Mitochondria"')
+        llm_client = LLMClient("test", model=MODEL, backend=RejectingBackend(self.recordings_path, latency=0), max_retries=0)
+        self.generator = FlashcardGenerator(llm_client, output_format="json")
+
+    def test_rejected_structured_request_falls_back_to_csv(self):
+        flashcards, tokens = self.generator.generate_flashcards(self.user, self.deck, self.text, "")
+
+        self.assertEqual([f.answer for f in flashcards], ["Mitochondria"])
+        self.assertEqual(tokens, 15)
+
+    def test_rejected_structured_stream_falls_back_to_csv(self):
+        async def collect():
+            return [item async for item in self.generator.astream_flashcards(self.user, self.deck, self.text, "")]
+
+        events = asyncio.run(collect())
+
+        self.assertEqual([payload.answer for event, payload in events if event == "flashcard"], ["Mitochondria"])
+        self.assertEqual(events[-1], ("tokens", 15))
+
+
+class RemoveDuplicateFlashcardsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='dedup')
+        self.deck = Deck.objects.create(user=self.user, name='dedup')
+        self.existing = Flashcard.objects.create(
+            user=self.user, deck=self.deck, question="What is the capital of France?", answer="Paris",
+            bounding_box=[{'text': "Paris", 'x': 1, 'y': 2, 'width': 3, 'height': 4, 'page': 1}]
+        )
+
+    def new_flashcard(self, question, answer):
+        return Flashcard(user=self.user, deck=self.deck, question=question, answer=answer)
+
+    def test_flags_every_duplicate_of_the_same_card(self):
+        flashcards = [
+            self.new_flashcard("What is the capital of France?", "Paris"),
+            self.new_flashcard("What is the capital of France ?", "Paris."),
+            self.new_flashcard("What is the boiling point of water?", "100 degrees Celsius"),
+        ]
+
+        unique, flagged = remove_duplicate_flashcards(flashcards, self.deck, threshold=90, action='flag')
+
+        self.assertEqual(unique, flashcards[2:])
+        self.assertEqual(flagged, flashcards[:2])
+        for flashcard in flagged:
+            self.assertFalse(flashcard.accepted)
+            self.assertEqual(flashcard.bounding_box, self.existing.bounding_box)
+
+    def test_drops_duplicates(self):
+        flashcards = [self.new_flashcard("What is the capital of France?", "Paris")]
+
+        self.assertEqual(remove_duplicate_flashcards(flashcards, self.deck, threshold=90, action='drop'), ([], []))
+
+
+class GenerationJobHeartbeatTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='worker')
+
+    def running_job(self, started_minutes_ago, heartbeat_minutes_ago):
+        now = timezone.now()
+        heartbeat_at = None if heartbeat_minutes_ago is None else now - timedelta(minutes=heartbeat_minutes_ago)
+        return GenerationJob.objects.create(
+            user=self.user, input_text="text", status=GenerationJob.RUNNING,
+            started_at=now - timedelta(minutes=started_minutes_ago), heartbeat_at=heartbeat_at
+        )
+
+    def test_requeues_only_jobs_without_recent_heartbeat(self):
+        long_running = self.running_job(started_minutes_ago=60, heartbeat_minutes_ago=0)
+        abandoned = self.running_job(started_minutes_ago=60, heartbeat_minutes_ago=10)
+        legacy = self.running_job(started_minutes_ago=60, heartbeat_minutes_ago=None)
+
+        self.assertEqual(GenerationJob.requeue_stale(2), 2)
+
+        statuses = dict(GenerationJob.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[long_running.id], GenerationJob.RUNNING)
+        self.assertEqual(statuses[abandoned.id], GenerationJob.PENDING)
+        self.assertEqual(statuses[legacy.id], GenerationJob.PENDING)
+
+    def test_heartbeat_keeps_a_claimed_job_running(self):
+        GenerationJob.objects.create(user=self.user, input_text="text")
+        job, = GenerationJob.claim(1)
+        GenerationJob.objects.filter(id=job.id).update(heartbeat_at=timezone.now() - timedelta(minutes=10))
+
+        GenerationJob.heartbeat([job.id])
+
+        self.assertEqual(GenerationJob.requeue_stale(2), 0)
+
+
+class PregenerateDocumentFlashcardsTests(TestCase):
+    def test_failed_page_keeps_the_cards_of_the_others(self):
+        user = User.objects.create(username='pregenerate')
+        deck = Deck.objects.create(user=user, name='pregenerate')
+        document = UserDocument.objects.create(user=user, deck=deck, name='notes.pdf', file_type='pdf', s3_key='notes.pdf', file_size=1)
+        pages = [{'page': number, 'text': f"Page {number} " + "content " * 50, 'boxes': []} for number in (1, 2, 3)]
+        card = Flashcard(user=user, deck=deck, question="Q", answer="A")
+
+        with mock.patch('flashcards.services.download_document_from_s3'), \
+             mock.patch('flashcards.services.get_pdf_pages', return_value=pages), \
+             mock.patch('flashcards.services.build_document_index'), \
+             mock.patch('flashcards.services.get_matched_flashcards_to_text',
+                        side_effect=[([card], 10), RuntimeError("LLM error"), ([card], 20)]) as generate:
+            flashcards, tokens = pregenerate_document_flashcards(document, user, deck, llm_client=object())
+
+        self.assertEqual(generate.call_count, 3)
+        self.assertEqual((flashcards, tokens), ([card, card], 30))
+
+
+class StreamFlashcardsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='stream')
+        self.deck = Deck.objects.create(user=self.user, name='stream')
+
+    def post(self):
+        data = {"selection": {"doc_id": "doc", "text": "Paris is the capital of France."}, "boxes": [{"text": "Paris"}], "deck_id": str(self.deck.id)}
+        return self.client.post(reverse('stream-flashcards-to-text'), json.dumps(data), content_type='application/json')
+
+    def test_anonymous_request_is_redirected_to_login(self):
+        response = self.post()
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/login/'))
+
+    def test_out_of_tokens(self):
+        self.user.userplan.total_tokens_allowed = 100
+        self.user.userplan.save()
+        TokenUsage.record(self.user, [{'tokens_used': 100}])
+        self.client.force_login(self.user)
+
+        response = self.post()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.json()["error"].startswith("You are out of tokens until"))
+
+
+@override_settings(METRICS_TOKEN='scrape-token')
+class MetricsViewTests(TestCase):
+    def test_accepts_the_scrape_token(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_a_wrong_or_missing_token(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-tokem').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+
+class FitTokenEstimatorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='fit')
+
+    def test_fits_each_script_without_cache_hits(self):
+        # tokens = 0.5 * chars + 100, plus cache hits recorded with 0 tokens
+        TokenUsage.objects.bulk_create(
+            [TokenUsage(user=self.user, tokens_used=chars // 2 + 100, input_chars=chars, script='latin') for chars in range(1000, 5000, 1000)]
+            + [TokenUsage(user=self.user, tokens_used=0, input_chars=chars, script='latin') for chars in (1000, 4000)]
+            + [TokenUsage(user=self.user, tokens_used=500, input_chars=1000, script='cyrillic')]
+        )
+
+        call_command('fit_token_estimator', min_samples=3, stdout=io.StringIO())
+
+        fit = TokenEstimatorFit.objects.get()
+        self.assertEqual((fit.script, fit.n_samples), ('latin', 4))
+        self.assertAlmostEqual(fit.per_char, 0.5)
+        self.assertAlmostEqual(fit.intercept, 100)
+        self.assertAlmostEqual(fit.margin, 0)
+
+        estimator = TokenEstimator(fallback=lambda text, n_calls: -1)
+        estimator.load()
+        self.assertEqual(estimator.estimate("a" * 2000), 1100)
+        self.assertEqual(estimator.estimate("б" * 2000), -1)
+
+
+class TokenUsageBucketTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='buckets')
+        self.now = timezone.now().replace(second=50, microsecond=0)
+
+    def record_at(self, when, tokens_used):
+        with mock.patch('django.utils.timezone.now', return_value=when):
+            TokenUsage.record(self.user, [{'tokens_used': tokens_used}])
+
+    def test_window_matches_the_raw_usage(self):
+        self.record_at(self.now - timedelta(hours=5), 1000)
+        self.record_at(self.now - timedelta(hours=1), 40)
+        # Two usages in one minute, then one in the next minute
+        self.record_at(self.now, 10)
+        self.record_at(self.now + timedelta(seconds=5), 20)
+        self.record_at(self.now + timedelta(seconds=15), 30)
+
+        with mock.patch('django.utils.timezone.now', return_value=self.now + timedelta(seconds=20)):
+            tokens_used, most_recent = TokenUsageBucket.get_window(self.user, 4)
+            self.assertEqual(tokens_used, TokenUsage.get_period_usage(self.user, 4))
+        self.assertEqual(tokens_used, 100)
+        self.assertEqual(most_recent, (self.now + timedelta(minutes=1)).replace(second=0))
+        self.assertEqual(TokenUsageBucket.objects.filter(user=self.user).count(), 4)
+
+    def test_buckets_past_the_retention_period_are_pruned(self):
+        self.record_at(self.now - timedelta(hours=25), 10)
+        self.record_at(self.now - timedelta(hours=23), 20)
+
+        self.record_at(self.now, 30)
+
+        self.assertEqual(sorted(TokenUsageBucket.objects.values_list('tokens_used', flat=True)), [20, 30])
+
+    def test_migration_backfills_the_last_day(self):
+        for hours_ago, tokens_used in ((30, 1000), (3, 10), (3, 20), (1, 40)):
+            row = TokenUsage.objects.create(user=self.user, tokens_used=tokens_used)
+            TokenUsage.objects.filter(pk=row.pk).update(timestamp=self.now - timedelta(hours=hours_ago))
+
+        importlib.import_module('flashcards.migrations.0028_tokenusagebucket').backfill_buckets(apps, None)
+
+        self.assertEqual(TokenUsageBucket.get_window(self.user, 4)[0], 70)
+        self.assertEqual(sorted(TokenUsageBucket.objects.values_list('tokens_used', flat=True)), [30, 40])
+
+
+class CompactTokenUsageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='compact')
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def usage(self, tokens_used, timestamp):
+        row = TokenUsage.objects.create(user=self.user, tokens_used=tokens_used)
+        TokenUsage.objects.filter(pk=row.pk).update(timestamp=timestamp)
+
+    def test_rollups_match_raw_usage_and_old_rows_are_deleted(self):
+        old_hour = self.hour - timedelta(days=40)
+        self.usage(30, old_hour + timedelta(minutes=5))
+        self.usage(20, self.hour - timedelta(hours=2, minutes=50))
+        self.usage(5, self.hour - timedelta(hours=2, minutes=10))
+        self.usage(7, self.hour - timedelta(minutes=1))
+        self.usage(100, self.hour + timedelta(seconds=1))
+
+        call_command('compact_token_usage', keep_days=30, stdout=io.StringIO())
+
+        rollups = TokenUsageHourly.objects.filter(user=self.user).order_by('hour').values_list('hour', 'tokens_used', 'calls')
+        self.assertEqual(list(rollups), [(old_hour, 30, 1), (self.hour - timedelta(hours=3), 25, 2), (self.hour - timedelta(hours=1), 7, 1)])
+        # The 40 days old row is deleted, the current hour's row is left for the next run
+        self.assertEqual(sorted(TokenUsage.objects.values_list('tokens_used', 'rolled_up')), [(5, True), (7, True), (20, True), (100, False)])
+
+    def test_folds_rows_once(self):
+        self.usage(20, self.hour - timedelta(hours=2))
+        TokenUsageHourly.compact(keep_days=30, batch_size=1)
+        self.usage(5, self.hour - timedelta(hours=2))
+
+        self.assertEqual(TokenUsageHourly.compact(keep_days=30, batch_size=1), (1, 0))
+
+        self.assertEqual(list(TokenUsageHourly.objects.values_list('tokens_used', 'calls')), [(25, 2)])
+
+
+class DatabaseCacheTierTests(TestCase):
+    def setUp(self):
+        self.tier = DatabaseCacheTier(ttl=3600, max_entries=2, trim_every=1)
+
+    def test_stores_and_reads_responses(self):
+        self.assertIsNone(self.tier.get("key"))
+
+        self.tier.set("key", ("response", 12))
+
+        self.assertEqual(self.tier.get("key"), ("response", 12))
+
+    def test_expired_responses_are_deleted(self):
+        self.tier.set("key", ("response", 12))
+        CachedLLMResponse.objects.filter(key="key").update(created_at=timezone.now() - timedelta(seconds=3601))
+
+        self.assertIsNone(self.tier.get("key"))
+        self.assertFalse(CachedLLMResponse.objects.exists())
+
+    def test_trims_least_recently_used_responses(self):
+        for idx, key in enumerate(("a", "b", "c")):
+            self.tier.set(key, (key, 1))
+            CachedLLMResponse.objects.filter(key=key).update(last_accessed=timezone.now() - timedelta(minutes=10 - idx))
+
+        self.tier.set("d", ("d", 1))
+
+        self.assertEqual(sorted(CachedLLMResponse.objects.values_list('key', flat=True)), ["c", "d"])
+
+
+class ExtractTextTests(TestCase):
+    def test_string_io(self):
+        self.assertEqual(extract_text(io.StringIO("Some text"), 'string'), "Some text")
+
+    def test_uploaded_text_file(self):
+        self.assertEqual(extract_text(SimpleUploadedFile("notes.txt", "Café".encode('utf-8')), '.txt'), "Café")
+
+    def test_unsupported_format(self):
+        with self.assertRaisesMessage(ValueError, "Unsupported content format"):
+            extract_text(SimpleUploadedFile("slides.pptx", b"data"), '.pptx')
+
+
+class BatchBoxMatchingReplayTests(ReplayTestCase):
+    def test_batch_matching_assigns_boxes_by_flashcard_index(self):
+        boxes = [{'text': text, 'x': 0, 'y': idx, 'width': 1, 'height': 1, 'page': 1}
+                 for idx, text in enumerate(["Enzymes", "lower", "activation", "energy", "unrelated"])]
+        flashcards = [
+            Flashcard(user=self.user, deck=self.deck, question="What do catalysts change?", answer="The barrier"),
+            Flashcard(user=self.user, deck=self.deck, question="Something else?", answer="Nothing"),
+        ]
+        prompt, system_message = build_batch_box_matching_prompt(flashcards, boxes)
+        self.record(system_message, prompt, "1: None\n0: 0, 1, 2, 3")
+
+        match_flashcards_to_text_batch(flashcards, None, boxes, llm_client=self.llm_client())
+
+        self.assertEqual(flashcards[0].bounding_box, boxes[:4])
+        self.assertEqual(flashcards[1].bounding_box, [])
+
+
+@override_settings(FLASHCARD_DEDUP_ACTION='flag')
+class StoreMatchedFlashcardsTests(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.document = UserDocument.objects.create(user=self.user, deck=self.deck, name='notes.pdf', file_type='pdf', s3_key='notes.pdf', file_size=1)
+        self.text = "The cell is the basic unit of life. Paris is the capital of France."
+        self.boxes = [{'text': word, 'x': idx, 'y': 0, 'width': 1, 'height': 1, 'page': 1} for idx, word in enumerate(self.text.split())]
+        generator = FlashcardGenerator(None)
+        prompt, system_message = generator.build_generation_prompt(self.text, "")
+        self.record(system_message, prompt, '"What is the cell?","The basic unit of life"\n"What is the capital of France?","Paris"')
+
+    def generate_into(self, name):
+        deck = Deck.objects.create(user=self.user, name=name)
+        Flashcard.objects.create(
+            user=self.user, deck=deck, document=self.document, question="What is the capital of France?", answer="Paris",
+            bounding_box=self.boxes[-2:]
+        )
+        flashcards, tokens = get_matched_flashcards_to_text(self.document.id, self.text, self.boxes, "", self.user, deck, llm_client=self.llm_client())
+        return deck, flashcards
+
+    def stored_rows(self, deck):
+        return sorted(
+            Flashcard.objects.filter(deck=deck)
+            .values_list('question', 'answer', 'user_id', 'document_id', 'bounding_box', 'accepted', 'due', 'ease_factor', 'history'),
+            key=str
+        )
+
+    def test_bulk_store_matches_per_card_saves(self):
+        def save_each(flashcards):
+            for flashcard in flashcards:
+                flashcard.save()
+            return flashcards
+
+        bulk_deck, bulk_flashcards = self.generate_into("bulk")
+        with mock.patch.object(Flashcard, 'bulk_store', side_effect=save_each):
+            saved_deck, saved_flashcards = self.generate_into("saved")
+
+        self.assertEqual(self.stored_rows(bulk_deck), self.stored_rows(saved_deck))
+        self.assertEqual(len(bulk_flashcards), 2)
+        self.assertTrue(all(flashcard.pk and flashcard.deck == bulk_deck for flashcard in bulk_flashcards))
+        new_card, flagged_card = bulk_flashcards
+        self.assertEqual(new_card.document, self.document)
+        self.assertEqual(new_card.bounding_box, self.boxes[3:8])
+        self.assertEqual((flagged_card.document, flagged_card.accepted, flagged_card.bounding_box), (self.document, False, self.boxes[-2:]))
+
+    def test_regeneration_updates_only_the_rewritten_cards(self):
+        deck, _ = self.generate_into("regenerate")
+        rows_before = {row[0]: row for row in Flashcard.objects.filter(deck=deck).values_list('id', 'question', 'answer', 'document_id', 'bounding_box', 'due')}
+        card_ids = list(rows_before)
+        flashcards, excerpts, _ = prepare_regeneration(self.user, card_ids, "Shorter answers")
+        prompt, system_message = FlashcardGenerator(None).build_regeneration_prompt(flashcards, "Shorter answers", excerpts)
+        self.record(system_message, prompt, '1,"Rewritten question?","Rewritten answer"')
+
+        updated, tokens = regenerate_flashcards(self.user, card_ids, "Shorter answers", llm_client=self.llm_client())
+
+        self.assertEqual(updated, [flashcards[1]])
+        rows_after = {row[0]: row for row in Flashcard.objects.filter(deck=deck).values_list('id', 'question', 'answer', 'document_id', 'bounding_box', 'due')}
+        rewritten = flashcards[1].id
+        self.assertEqual(rows_after[rewritten], (rewritten, "Rewritten question?", "Rewritten answer") + rows_before[rewritten][3:])
+        self.assertEqual({k: v for k, v in rows_after.items() if k != rewritten}, {k: v for k, v in rows_before.items() if k != rewritten})
+
+
+class ResponseRepairTests(TestCase):
+    """
+    Malformed CSV shapes must be repaired without leaving artifacts in the flashcards.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='repair')
+        self.deck = Deck.objects.create(user=self.user, name='repair')
+        self.generator = FlashcardGenerator(None)
+
+    def assertParses(self, response, method):
+        flashcards, used_method = self.generator.parse_response(response, self.user, self.deck)
+        self.assertEqual([(f.question, f.answer) for f in flashcards], [("Who was Mozart?", "A composer"), ("What is ice?", "Frozen water")])
+        self.assertEqual(used_method, method)
+
+    def test_well_formed(self):
+        self.assertParses('"Who was Mozart?","A composer"\n"What is ice?","Frozen water"', "first_try")
+
+    def test_smart_quotes(self):
+        self.assertParses('“Who was Mozart?”,“A composer”\n“What is ice?”,“Frozen water”', "normalize_quotes")
+
+    def test_code_fence(self):
+        self.assertParses('```csv\n"Who was Mozart?","A composer"\n"What is ice?","Frozen water"\n```', "first_try")
+
+    def test_numbered_rows(self):
+        self.assertParses('1. "Who was Mozart?","A composer"\n2. "What is ice?","Frozen water"', "strip_prefixes")
+
+    def test_numbered_rows_with_smart_quotes(self):
+        self.assertParses('1) “Who was Mozart?”,“A composer”\n2) “What is ice?”,“Frozen water”', "strip_prefixes")
+
+    def test_bulleted_rows(self):
+        self.assertParses('- "Who was Mozart?","A composer"\n- "What is ice?","Frozen water"', "strip_prefixes")
+
+    def test_partly_numbered_rows(self):
+        self.assertParses('"Who was Mozart?","A composer"\n2. "What is ice?","Frozen water"', "strip_prefixes")
+
+    def test_alternate_lines(self):
+        self.assertParses('"Who was Mozart?",\n"A composer"\n"What is ice?",\n"Frozen water"', "pair_fields")
+
+    def test_labelled_pairs(self):
+        self.assertParses('Question: Who was Mozart?\nAnswer: A composer\n\nQuestion: What is ice?\nAnswer: Frozen water', "pair_fields")
+
+    def test_guillemets_inside_fields_are_kept(self):
+        flashcards, method = self.generator.parse_response('"Qui a écrit «Les Misérables»?","Victor Hugo"', self.user, self.deck)
+        self.assertEqual((flashcards[0].question, method), ("Qui a écrit «Les Misérables»?", "first_try"))
+
+    def test_streamed_numbered_rows_are_repaired(self):
+        class StreamingClient:
+            async def astream_query(self, prompt, system_message, **kwargs):
+                for delta in ['"Who was Mozart?","A composer"\n', '2. "What is ice?",', '"Frozen water"\n']:
+                    yield (delta, None)
+                yield ("", 15)
+
+        async def collect():
+            generator = FlashcardGenerator(StreamingClient())
+            return [item async for item in generator.astream_csv_flashcards(self.user, self.deck, "text", "")]
+
+        events = asyncio.run(collect())
+        self.assertEqual(
+            [(payload.question, payload.answer) for event, payload in events if event == "flashcard"],
+            [("Who was Mozart?", "A composer"), ("What is ice?", "Frozen water")]
+        )
+        self.assertEqual(events[-1], ("tokens", 15))
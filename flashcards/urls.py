@@ -12,6 +12,11 @@ urlpatterns = [
     path('documents/delete/<uuid:document_id>/', views.delete_document, name='delete_document'),
     path('text-to-boxes/', views.text_to_boxes, name='text_to_boxes'),
     path('match-flashcards-to-text/', views.match_flashcards_to_text, name='match-flashcards-to-text'),
+    path('stream-flashcards-to-text/', views.stream_flashcards_to_text, name='stream-flashcards-to-text'),
+    path('generation-jobs/', views.enqueue_generation_job, name='enqueue_generation_job'),
+    path('generation-jobs/<uuid:job_id>/', views.generation_job_status, name='generation_job_status'),
+    path('regenerate-flashcards/', views.regenerate_flagged_flashcards, name='regenerate_flagged_flashcards'),
+    path('metrics/', views.metrics, name='metrics'),
     path('save-question-answer/', views.save_question_answer, name='save_question_answer'),
     path('set-text-placement/', views.set_text_placement, name='set_text_placement'),
     path('manage_cards/', views.manage_cards, name='manage_cards'),
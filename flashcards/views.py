@@ -3,18 +3,18 @@ from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.utils.text import slugify
 from datetime import timedelta
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse, HttpResponse
 from django.conf import settings
 from django.contrib.auth import login, authenticate, logout, update_session_auth_hash
 from django.contrib import messages
 from django.contrib.auth.forms import UserCreationForm, PasswordChangeForm
 from django.contrib.auth.models import User
 from django.core.mail import send_mail
-from flashcards.models import Flashcard, Deck, FailedFeedback, UserDocument
+from flashcards.models import Flashcard, Deck, FailedFeedback, UserDocument, GenerationJob
 from flashcards.forms import DocumentUploadForm
 from django.utils.translation import activate
 import json
-from .services import delete_document_from_s3, generate_flashcards, get_matched_flashcards_to_text, match_selected_text_to_word_boxes
+from .services import delete_document_from_s3, agenerate_flashcards, aget_matched_flashcards_to_text, match_selected_text_to_word_boxes, aassert_can_generate, astream_matched_flashcards_to_text, LLM_BUSY_MESSAGE, aregenerate_flashcards, out_of_tokens_message
 from .forms import CustomUserCreationForm
 from django.views.decorators.http import require_http_methods, require_POST
 from django.core.exceptions import ValidationError
@@ -23,7 +23,10 @@ import random
 import logging
 import io
 import os
-from src.backend.usage_limits import InsufficientTokensError
+import hmac
+from src.backend.usage_limits import InsufficientTokensError, MAX_DOCUMENT_LENGTH
+from src.backend.metrics import REGISTRY, S3_REQUEST_SECONDS
+from src.backend.llm_governor import LLMBusyError
 from django.contrib.sites.shortcuts import get_current_site
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -229,14 +232,15 @@ def get_document_url(request, document_id):
     )
     # Generate a presigned URL
     try:
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': settings.AWS_STORAGE_BUCKET_NAME,  # Use the bucket from settings
-                'Key': document.s3_key  # The S3 object key stored in the model
-            },
-            ExpiresIn=3600  # Link expires in 1 hour
-        )
+        with S3_REQUEST_SECONDS.time(operation='presign'):
+            presigned_url = s3_client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': settings.AWS_STORAGE_BUCKET_NAME,  # Use the bucket from settings
+                    'Key': document.s3_key  # The S3 object key stored in the model
+                },
+                ExpiresIn=3600  # Link expires in 1 hour
+            )
     except Exception as e:
         logger.error(f"Error generating presigned URL: {e}")
         return JsonResponse({'error': str(e)}, status=500)
@@ -253,6 +257,7 @@ def get_document_flashcards(request, document_id):
     """
     API endpoint that returns all flashcards associated with a specific document.
     Returns flashcard data including page numbers and bounding boxes.
+    Cards pre-generated after upload are included as suggestions (accepted=False).
     """
     try:
         # Ensure the document exists and belongs to the current user
@@ -273,8 +278,13 @@ def get_document_flashcards(request, document_id):
                     'answer': card.answer,
                     'accepted': card.accepted
                 })
+
+        # Suggestions still being generated in the background
+        pregenerating = GenerationJob.objects.filter(
+            document=document, kind=GenerationJob.DOCUMENT, status__in=[GenerationJob.PENDING, GenerationJob.RUNNING]
+        ).exists()
         
-        return JsonResponse({'flashcards': flashcard_data})
+        return JsonResponse({'flashcards': flashcard_data, 'pregenerating': pregenerating})
     
     except UserDocument.DoesNotExist:
         return JsonResponse({'error': 'Document not found'}, status=404)
@@ -340,19 +350,31 @@ def upload_document(request):
                 )
                 
                 logger.debug(f"S3 client created, uploading with key:\n{s3_key}")
-                s3_client.upload_fileobj(
-                    document,
-                    settings.AWS_STORAGE_BUCKET_NAME,
-                    s3_key,
-                    ExtraArgs={
-                        'ContentType': document.content_type,
-                        'ACL': 'private'
-                    }
-                )
+                with S3_REQUEST_SECONDS.time(operation='upload'):
+                    s3_client.upload_fileobj(
+                        document,
+                        settings.AWS_STORAGE_BUCKET_NAME,
+                        s3_key,
+                        ExtraArgs={
+                            'ContentType': document.content_type,
+                            'ACL': 'private'
+                        }
+                    )
                 # Save the document record
                 logger.debug(f"File uploaded. Saving user_document")
                 user_document.save()
 
+                # Word index for source linking, built by the pre-generation job when enabled
+                if file_type == 'pdf':
+                    job = GenerationJob.objects.create(
+                        user=request.user,
+                        deck=deck,
+                        document=user_document,
+                        kind=GenerationJob.DOCUMENT if settings.PREGENERATE_ON_UPLOAD else GenerationJob.INDEX,
+                        input_text=''
+                    )
+                    logger.debug(f"Queued {job.kind} job {job.id}")
+
                 logger.debug(f"user_document saved. Redirecting...")
                 return redirect('user_documents')  # Redirect to your documents list view
                 
@@ -476,36 +498,39 @@ def text_to_boxes(request):
 
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
-def match_flashcards_to_text(request):
+@login_required
+async def match_flashcards_to_text(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request method'}, status=400)
 
     try:
         data = json.loads(request.body)
-        user = request.user
+        user = await request.auser()
 
         # Obtain data
         selection_data = data.get("selection")
         boxes = data.get("boxes")
         deck_id = data.get("deck_id")
         aiContext = data.get("aiContext")
+        regenerate = bool(data.get("regenerate", False))
 
         if not selection_data or not boxes or not deck_id:
             return JsonResponse({'error': 'Missing required data'}, status=400)
 
         try:
-            deck = Deck.objects.get(id=deck_id)
+            deck = await Deck.objects.aget(id=deck_id)
         except Deck.DoesNotExist:
             return JsonResponse({'error': 'Deck not found'}, status=404)
 
         # Main logic that may raise InsufficientTokensError
-        get_matched_flashcards_to_text(
+        await aget_matched_flashcards_to_text(
             selection_data["doc_id"],
             selection_data["text"],
             boxes,
             aiContext,
             user,
-            deck
+            deck,
+            use_cache=not regenerate
         )
 
         return JsonResponse({'status': 'success'})
@@ -524,12 +549,217 @@ def match_flashcards_to_text(request):
             "error": f"You are out of tokens until {formatted_time}. Unlimited Pro version coming soon."
         }, status=400)
 
+    except LLMBusyError as e:
+        logger.warning(f"LLM governor gave up in match_flashcards_to_text: {e}")
+        return JsonResponse({"success": False, "error": LLM_BUSY_MESSAGE}, status=503)
 
     except Exception as e:
         logger.exception("Unexpected error in match_flashcards_to_text")
         return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
 
 
+def format_sse(event, data):
+    """
+    Format one server-sent event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@login_required
+async def stream_flashcards_to_text(request):
+    """
+    Streaming version of match_flashcards_to_text: cards are pushed to the
+    browser as server-sent events as soon as each one is generated.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+        user = await request.auser()
+
+        # Obtain data
+        selection_data = data.get("selection")
+        boxes = data.get("boxes")
+        deck_id = data.get("deck_id")
+        aiContext = data.get("aiContext")
+        regenerate = bool(data.get("regenerate", False))
+
+        if not selection_data or not boxes or not deck_id:
+            return JsonResponse({'error': 'Missing required data'}, status=400)
+
+        try:
+            deck = await Deck.objects.aget(id=deck_id)
+        except Deck.DoesNotExist:
+            return JsonResponse({'error': 'Deck not found'}, status=404)
+
+        # Checks run before streaming so that errors get a regular JSON response
+        await aassert_can_generate(user, selection_data["text"])
+
+    except InsufficientTokensError as e:
+        logger.error(f"InsufficientTokensError handled. Insufficient tokens: {str(e)}", exc_info=True)
+        return JsonResponse({"success": False, "error": out_of_tokens_message(e)}, status=400)
+
+    except Exception as e:
+        logger.exception("Unexpected error in stream_flashcards_to_text")
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+    async def event_stream():
+        try:
+            async for event, payload in astream_matched_flashcards_to_text(
+                selection_data["doc_id"],
+                selection_data["text"],
+                boxes,
+                aiContext,
+                user,
+                deck,
+                use_cache=not regenerate
+            ):
+                yield format_sse(event, payload)
+        except LLMBusyError as e:
+            logger.warning(f"LLM governor gave up while streaming flashcards: {e}")
+            yield format_sse("error", {"error": LLM_BUSY_MESSAGE})
+        except Exception as e:
+            logger.exception("Unexpected error while streaming flashcards")
+            yield format_sse("error", {"error": "There was an error while generating your cards. Please try again."})
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_POST
+def enqueue_generation_job(request):
+    """
+    Queue a flashcard generation job for the background worker and return its ID.
+
+    With a "selection" (document viewer), the cards are matched to the boxes and
+    saved to the deck. With "input_text", the cards are returned as proposals.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+
+    selection_data = data.get("selection")
+    use_cache = not data.get("regenerate", False)
+
+    if selection_data:
+        boxes = data.get("boxes")
+        deck_id = data.get("deck_id")
+        if not boxes or not deck_id:
+            return JsonResponse({'error': 'Missing required data'}, status=400)
+        try:
+            deck = Deck.objects.get(id=deck_id, user=request.user)
+            document = UserDocument.objects.get(id=selection_data.get("doc_id"), user=request.user)
+        except (Deck.DoesNotExist, UserDocument.DoesNotExist, ValidationError):
+            return JsonResponse({'error': 'Deck or document not found'}, status=404)
+
+        job = GenerationJob.objects.create(
+            user=request.user,
+            deck=deck,
+            document=document,
+            kind=GenerationJob.SELECTION,
+            input_text=selection_data.get("text", ""),
+            context=data.get("aiContext") or "",
+            boxes=boxes,
+            use_cache=use_cache
+        )
+    else:
+        input_text = data.get("input_text")
+        if not input_text:
+            return JsonResponse({'error': 'No text provided'}, status=400)
+        job = GenerationJob.objects.create(
+            user=request.user,
+            kind=GenerationJob.TEXT,
+            input_text=input_text,
+            context=data.get("context") or "",
+            use_cache=use_cache
+        )
+
+    logger.debug(f"Queued generation job {job.id}")
+    return JsonResponse({'job_id': str(job.id), 'status': job.status}, status=202)
+
+@login_required
+@require_POST
+async def regenerate_flagged_flashcards(request):
+    """
+    Rewrite the flashcards the user rejected according to their feedback, in place.
+    Expects {"card_ids": [...], "feedback": "...", "context": "..."}.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON data'}, status=400)
+
+    card_ids = data.get("card_ids") or []
+    feedback = (data.get("feedback") or "").strip()
+    if not card_ids or not feedback:
+        return JsonResponse({'error': 'Missing required data'}, status=400)
+    if len(card_ids) > settings.REGENERATION_MAX_CARDS:
+        return JsonResponse({'error': f'Select at most {settings.REGENERATION_MAX_CARDS} cards to regenerate'}, status=400)
+
+    try:
+        user = await request.auser()
+        flashcards, tokens = await aregenerate_flashcards(user, card_ids, feedback, data.get("context") or "")
+
+    except (ValueError, ValidationError) as e:
+        logger.info(f"Regeneration rejected: {e}")
+        return JsonResponse({'error': 'Cards not found or input too long'}, status=400)
+
+    except InsufficientTokensError as e:
+        return JsonResponse({"success": False, "error": out_of_tokens_message(e)}, status=400)
+
+    except LLMBusyError as e:
+        logger.warning(f"LLM governor gave up in regenerate_flagged_flashcards: {e}")
+        return JsonResponse({"success": False, "error": LLM_BUSY_MESSAGE}, status=503)
+
+    except Exception as e:
+        logger.exception("Unexpected error in regenerate_flagged_flashcards")
+        return JsonResponse({'error': 'An unexpected error occurred.'}, status=500)
+
+    return JsonResponse({'flashcards': [
+        {
+            "id": str(flashcard.id),
+            "bbox": flashcard.bounding_box,
+            "question": flashcard.question,
+            "answer": flashcard.answer,
+            "accepted": flashcard.accepted
+        }
+        for flashcard in flashcards
+    ]})
+
+@login_required
+def generation_job_status(request, job_id):
+    """
+    Poll the status of a generation job.
+    """
+    job = get_object_or_404(GenerationJob, id=job_id, user=request.user)
+    return JsonResponse({
+        'job_id': str(job.id),
+        'status': job.status,
+        'card_ids': job.result_card_ids,
+        'flashcards': job.result_cards,
+        'tokens_used': job.tokens_used,
+        'error': job.error,
+    })
+
+
+def metrics(request):
+    """
+    Prometheus text metrics of this worker process (see Metric: one worker per
+    scrape target). Staff only, or a scraper sending "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_authenticated and request.user.is_staff
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        authorized = True
+    if not authorized:
+        return HttpResponse(status=403)
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def user_decks(request):
 
@@ -752,7 +982,7 @@ def review_card(request):
 
 @login_required
 @require_http_methods(["POST"])
-def process_file_and_context(request):
+async def process_file_and_context(request):
     """
     View to handle file/text input and context submission for creating flashcards.
     """
@@ -760,7 +990,8 @@ def process_file_and_context(request):
 
     context = request.POST.get('context', '')
     input_type = request.POST.get('input_type')
-    user = request.user
+    regenerate = request.POST.get('regenerate', '').lower() in ('true', '1')
+    user = await request.auser()
     
     try:
         if input_type == 'file':
@@ -782,8 +1013,8 @@ def process_file_and_context(request):
 
         logger.debug(f"File is of type {content_format}")
 
-        # Call the service function - it can now handle either a file or StringIO object
-        flashcards = generate_flashcards(content, content_format, context, user)
+        # Call the service function - it extracts the text of the file or StringIO object
+        flashcards = await agenerate_flashcards(content, content_format, context, user, deck=None, use_cache=not regenerate)
         flashcards_data = [
             {"question": fc.question, "answer": fc.answer} for fc in flashcards
         ]
@@ -819,7 +1050,7 @@ def process_file_and_context(request):
         if isinstance(e, ValueError) and "exceeds maximum allowed length" in str(e):
             return JsonResponse({
                 "success": False, 
-                "error": "The input text is too long. Please reduce it to 30,000 characters or less. Unlimited Pro version coming soon."
+                "error": f"The input text is too long. Please reduce it to {MAX_DOCUMENT_LENGTH:,} characters or less. Unlimited Pro version coming soon."
             }, status=200)
 
         # Return an error message to the user
@@ -0,0 +1,72 @@
+import logging
+from collections import Counter
+from rapidfuzz import fuzz
+
+# Logger set up
+logger = logging.getLogger("src/backend/box_matcher.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+# How flashcards were matched to their source boxes, for this process.
+# Keys: "local" and "llm".
+BOX_MATCH_STATS = Counter()
+
+
+class BoxText:
+    """
+    Text of all the boxes joined by spaces, with the character span of every box,
+    so that a span of the joined text can be mapped back to box indices.
+    """
+    def __init__(self, boxes):
+        self.spans = []
+        parts, position = [], 0
+        for box in boxes:
+            text = box['text'].lower()
+            self.spans.append((position, position + len(text)))
+            parts.append(text)
+            position += len(text) + 1
+        self.text = ' '.join(parts)
+
+    def boxes_in(self, start, end):
+        """
+        Indices of the boxes overlapping the [start, end) span of the joined text.
+        """
+        return [idx for idx, (box_start, box_end) in enumerate(self.spans) if box_start < end and start < box_end]
+
+def align(text, box_text):
+    """
+    Best partial alignment of text inside the joined box text.
+
+    :return: (score, box_indices)
+    """
+    text = ' '.join(text.lower().split())
+    if not text or not box_text.text:
+        return (0.0, [])
+    alignment = fuzz.partial_ratio_alignment(text, box_text.text)
+    return (alignment.score, box_text.boxes_in(alignment.dest_start, alignment.dest_end))
+
+def match_boxes_locally(question, answer, box_text, threshold=80, min_answer_chars=12):
+    """
+    Locate a flashcard in the boxes by aligning its answer, and its question,
+    against the joined box text. Only alignments scoring at least threshold
+    contribute boxes.
+
+    Answers shorter than min_answer_chars are not matched locally (score 0):
+    a short text aligns well with many places of any document.
+
+    :param box_text: BoxText built from the boxes
+    :return: (best_score, box_indices)
+    """
+    if len(' '.join(answer.split())) < min_answer_chars:
+        return (0.0, [])
+    box_indices, best_score = set(), 0.0
+    for text in (answer, question):
+        score, indices = align(text, box_text)
+        best_score = max(best_score, score)
+        if score >= threshold:
+            box_indices.update(indices)
+    return (best_score, sorted(box_indices))
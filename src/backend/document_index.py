@@ -0,0 +1,113 @@
+import logging
+import re
+from collections import Counter
+
+# Logger set up
+logger = logging.getLogger("src/backend/document_index.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+# How flashcards were linked to their source by the index, for this process.
+# Keys: "linked" and "unmatched".
+SOURCE_LINK_STATS = Counter()
+
+# Tokens found in more than this share of the document (e.g. "the") are not used to locate text
+MAX_POSTING_SHARE = 0.01
+# ... unless they occur at most this many times, so short documents keep their words
+MIN_MAX_POSTING = 5
+# Positions a match may drift from the text's own word order (hyphenation, extra words)
+SLACK = 3
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+class DocumentIndex:
+    """
+    Positional inverted index over the word boxes of a document: every token
+    maps to its positions in the token sequence of all the boxes, in reading
+    order, and every position maps back to the box it came from.
+
+    Locating a text only reads the posting lists of its own tokens, so the cost
+    does not grow with the size of the document.
+    """
+    def __init__(self, boxes, postings=None):
+        self.boxes = boxes
+        self.token_boxes = []
+        for idx, box in enumerate(boxes):
+            self.token_boxes.extend([idx] * len(tokenize(box['text'])))
+        if postings is None:
+            postings = {}
+            position = 0
+            for box in boxes:
+                for token in tokenize(box['text']):
+                    postings.setdefault(token, []).append(position)
+                    position += 1
+        self.postings = postings
+        self.max_posting = max(MIN_MAX_POSTING, int(MAX_POSTING_SHARE * len(self.token_boxes)))
+
+    @classmethod
+    def from_pages(cls, pages):
+        """
+        Build the index from get_pdf_pages output.
+        """
+        return cls([box for page in pages for box in page['boxes']])
+
+    def to_dict(self):
+        return {'boxes': self.boxes, 'postings': self.postings}
+
+    def locate(self, text):
+        """
+        Find the span of the document that best matches text.
+
+        Every occurrence of a token of text votes for the position where text
+        would start; the start with the most votes nearby wins.
+
+        :return: (score, box_indices), score being the percentage of the
+            distinct tokens of text found in the span, not counting the
+            tokens too common in the document to be looked up
+        """
+        tokens = [
+            (offset, token) for offset, token in enumerate(tokenize(text))
+            if len(self.postings.get(token, [])) <= self.max_posting
+        ]
+        votes = Counter()
+        for offset, token in tokens:
+            for position in self.postings.get(token, []):
+                votes[position - offset] += 1
+        if not votes:
+            return (0.0, [])
+
+        def nearby_votes(start):
+            return sum(votes.get(start + shift, 0) for shift in range(-SLACK, SLACK + 1))
+        start = max(votes, key=nearby_votes)
+
+        wanted = {token for _, token in tokens}
+        found, matched = set(), []
+        for offset, token in tokens:
+            for position in self.postings.get(token, []):
+                if start - SLACK <= position - offset <= start + SLACK:
+                    found.add(token)
+                    matched.append(position)
+        first, last = min(matched), max(matched)
+        box_indices = sorted(set(self.token_boxes[first:last + 1]))
+        return (100.0 * len(found) / len(wanted), box_indices)
+
+def locate_flashcard(question, answer, index, threshold=60):
+    """
+    Locate a flashcard in the document by its answer, or by its question when
+    the answer is not found (e.g. short or paraphrased answers).
+
+    :return: (best_score, box_indices), box_indices empty when below threshold
+    """
+    best_score = 0.0
+    for text in (answer, question):
+        score, box_indices = index.locate(text)
+        if score >= threshold:
+            return (score, box_indices)
+        best_score = max(best_score, score)
+    return (best_score, [])
@@ -0,0 +1,60 @@
+import logging
+import numpy as np
+from rapidfuzz import process, fuzz, utils
+
+# Logger set up
+logger = logging.getLogger("src/backend/flashcard_dedup.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+def similarity_matrix(candidates, choices, question_weight=0.7):
+    """
+    Score every candidate (question, answer) pair against every choice in one
+    vectorized pass. Scores go from 0 to 100 and weight the question over the answer.
+
+    :return: numpy array of shape (len(candidates), len(choices))
+    """
+    question_scores = process.cdist(
+        [question for question, _ in candidates], [question for question, _ in choices],
+        scorer=fuzz.token_sort_ratio, processor=utils.default_process, dtype=np.float32, workers=-1
+    )
+    answer_scores = process.cdist(
+        [answer for _, answer in candidates], [answer for _, answer in choices],
+        scorer=fuzz.token_sort_ratio, processor=utils.default_process, dtype=np.float32, workers=-1
+    )
+    return question_weight * question_scores + (1 - question_weight) * answer_scores
+
+def find_duplicates(candidates, existing, threshold=90, question_weight=0.7):
+    """
+    Find which candidate pairs duplicate an existing pair or an earlier candidate.
+
+    :param candidates: list of (question, answer) pairs just generated
+    :param existing: list of (question, answer) pairs already stored
+    :param threshold: minimum similarity score (0-100) to consider a pair a duplicate
+    :return: list parallel to candidates, None for unique pairs, otherwise
+        (index, score) where index < len(existing) points into existing and
+        index >= len(existing) points to candidates[index - len(existing)]
+    """
+    if not candidates:
+        return []
+    choices = list(existing) + list(candidates)
+    scores = similarity_matrix(candidates, choices, question_weight)
+
+    # A candidate can only duplicate the existing pairs or candidates before it
+    n_existing = len(existing)
+    for i in range(len(candidates)):
+        scores[i, n_existing + i:] = -1
+
+    duplicates = []
+    for i, row in enumerate(scores):
+        best = int(row.argmax())
+        if row[best] >= threshold:
+            duplicates.append((best, float(row[best])))
+        else:
+            duplicates.append(None)
+    logger.debug(f"Found {sum(d is not None for d in duplicates)} duplicates among {len(candidates)} candidates")
+    return duplicates
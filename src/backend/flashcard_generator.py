@@ -1,14 +1,58 @@
 import csv
+import json
+import re
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+from django.db import close_old_connections, connections
 from flashcards.models import Flashcard
+from src.backend.usage_limits import estimate_input_tokens, MAX_INPUT_LENGTH
+from src.backend.llm_resilience import LLMBadRequestError
+from src.backend.llm_ledger import call_group
+from src.backend.llm_cache import deferred_cache_writes
+from src.backend.response_repair import repair_response, normalize_quotes, has_artifacts, REPAIR_STATS
 import logging
 
+# Structured output schema for the "json" output format
+FLASHCARDS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "flashcards",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "flashcards": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "question": {"type": "string"},
+                            "answer": {"type": "string"},
+                        },
+                        "required": ["question", "answer"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["flashcards"],
+            "additionalProperties": False,
+        },
+    },
+}
+
 class FlashcardGenerator:
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, output_format="csv"):
         """
         Initialize the FlashcardGenerator with an LLM client.
+
+        With output_format="json", generation asks for structured output following
+        FLASHCARDS_RESPONSE_FORMAT (the model must support it) and falls back to
+        the CSV prompt when that response cannot be used.
         """
         self.llm_client = llm_client
+        self.output_format = output_format
 
         # Logger set up
         self.logger = logging.getLogger("src/backend/flashcard_generator.py")
@@ -19,9 +63,9 @@ class FlashcardGenerator:
             console_handler.setFormatter(formatter)
             self.logger.addHandler(console_handler)
 
-    def generate_flashcards(self, user, deck, text_input, context, proposed_flashcards = [], feedback = ""):
+    def build_generation_prompt(self, text_input, context, proposed_flashcards = [], feedback = ""):
         """
-        Generate flashcards from the provided text input.
+        Build the (prompt, system_message) pair used to generate flashcards.
         """
         system_message = (
             "You are an expert in creating questions and answers out of study material."
@@ -65,29 +109,352 @@ class FlashcardGenerator:
         else:
             raise ValueError("Empty proposed flashcards or feedback")
 
+        return (prompt, system_message)
+
+    def build_json_generation_prompt(self, text_input, context):
+        """
+        Build the (prompt, system_message) pair used to generate flashcards as structured JSON output.
+        """
+        system_message = (
+            "You are an expert in creating questions and answers out of study material."
+            "You follow the guidelines precisely."
+        )
+        prompt = (
+            "Your task is to transform the study material below into questions and answers "
+            f"for studying.\n The rules you must follow are:\n"
+            " - Make sure the cards are in the same language of the text.\n"
+            " - Return a JSON object with a \"flashcards\" list of {\"question\", \"answer\"} objects.\n"
+            " - Additionally, the user has added the context below. Please follow it too."
+            f"\nUser context:\n{context}\n"
+            f"\nThe study material is:\n{text_input}"
+            )
+        return (prompt, system_message)
+
+    def parse_json_response(self, response, user, deck):
+        """
+        Turn a structured JSON response into flashcards.
+
+        :raises ValueError: if the response is not valid JSON or holds no valid flashcard
+        """
+        try:
+            items = json.loads(response)["flashcards"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise ValueError(f"Invalid JSON flashcards response: {e}")
+        flashcards = []
+        for item in items:
+            try:
+                flashcards.append(self.flashcard_from_row((item["question"], item["answer"]), user, deck))
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.error(f"Invalid JSON flashcard {item}: {e}")
+        if not flashcards:
+            raise ValueError("No valid flashcards in the JSON response.")
+        return flashcards
+
+    def generate_flashcards_json(self, user, deck, text_input, context, use_cache=True):
+        """
+        Generate flashcards with structured output, without any cleanup round trip.
+
+        :return: (flashcards, tokens), flashcards being None if the provider rejected
+                 the request or the response could not be used
+        """
+        prompt, system_message = self.build_json_generation_prompt(text_input, context)
+        with deferred_cache_writes() as cache_writes:
+            try:
+                response, tokens = self.llm_client.query(
+                    prompt, system_message, use_cache=use_cache, call_site="generation", response_format=FLASHCARDS_RESPONSE_FORMAT
+                )
+            except LLMBadRequestError as e:
+                return (self._json_rejected(e), 0)
+            flashcards = self._json_outcome(response, user, deck)
+            if flashcards is not None:
+                cache_writes.commit()
+        return (flashcards, tokens)
+
+    async def agenerate_flashcards_json(self, user, deck, text_input, context, use_cache=True):
+        """
+        Async version of generate_flashcards_json.
+        """
+        prompt, system_message = self.build_json_generation_prompt(text_input, context)
+        with deferred_cache_writes() as cache_writes:
+            try:
+                response, tokens = await self.llm_client.aquery(
+                    prompt, system_message, use_cache=use_cache, call_site="generation", response_format=FLASHCARDS_RESPONSE_FORMAT
+                )
+            except LLMBadRequestError as e:
+                return (self._json_rejected(e), 0)
+            flashcards = self._json_outcome(response, user, deck)
+            if flashcards is not None:
+                await cache_writes.acommit()
+        return (flashcards, tokens)
+
+    def _json_rejected(self, error):
+        # The provider refused the structured request itself (e.g. a model without json_schema support)
+        REPAIR_STATS["json_failed"] += 1
+        self.logger.warning(f"Structured output request rejected: {error}. Falling back to CSV generation.")
+        return None
+
+    def _json_outcome(self, response, user, deck):
+        try:
+            flashcards = self.parse_json_response(response, user, deck)
+        except ValueError as e:
+            REPAIR_STATS["json_failed"] += 1
+            self.logger.warning(f"JSON flashcard creation failed: {e}. Falling back to CSV generation.")
+            return None
+        REPAIR_STATS["json_first_try"] += 1
+        return flashcards
+
+    def generate_flashcards(self, user, deck, text_input, context, proposed_flashcards = [], feedback = "", use_cache=True):
+        """
+        Generate flashcards from the provided text input.
+        Pass use_cache=False to skip cached LLM responses when the user asks to regenerate.
+        The LLM responses are only cached once flashcards could be created from them.
+        """
+        with deferred_cache_writes() as cache_writes:
+            result = self._generate_flashcards(user, deck, text_input, context, proposed_flashcards, feedback, use_cache)
+            cache_writes.commit()
+        return result
+
+    def _generate_flashcards(self, user, deck, text_input, context, proposed_flashcards, feedback, use_cache):
+        json_tokens = 0
+        if self.output_format == "json" and not feedback:
+            flashcards, json_tokens = self.generate_flashcards_json(user, deck, text_input, context, use_cache=use_cache)
+            if flashcards is not None:
+                return (flashcards, json_tokens)
+
+        prompt, system_message = self.build_generation_prompt(text_input, context, proposed_flashcards, feedback)
+
         # Query LLM
-        response, tokens = self.llm_client.query(prompt, system_message)
+        response, tokens = self.llm_client.query(prompt, system_message, use_cache=use_cache, call_site="generation")
+        tokens += json_tokens
         
         try:
-            # Attempt to create flashcards directly from the LLM response
-            flashcards = self.create_flashcards_from_response(response, user, deck)
-            self.logger.info("Flashcards created on the first try")
+            # Attempt to create flashcards from the LLM response, repairing it locally if needed
+            flashcards, method = self.parse_response(response, user, deck)
         except Exception as e:
-            # If an error occurs, log it and attempt to enforce formatting on the response
-            self.logger.warning(f"Initial flashcard creation failed: {e}. Attempting to clean the response.")
+            # If local repairs fail, log it and ask the LLM to enforce formatting on the response
+            self.logger.warning(f"Local flashcard creation failed: {e}. Attempting to clean the response.")
             try:
-                clean_response, clean_tokens = self.enforce_format(response)
+                clean_response, clean_tokens = self.enforce_format(response, use_cache=use_cache)
                 tokens += clean_tokens
                 flashcards = self.create_flashcards_from_response(clean_response, user, deck)
+                method = "enforce_format"
                 self.logger.info("Flashcards created on the second try (after cleaning format)")
             except Exception as clean_error:
                 # If enforcing the format also fails, log the error and return an empty list
+                REPAIR_STATS["failed"] += 1
                 self.logger.error(f"Failed to create flashcards even after cleaning: {clean_error}")
-                raise ValueError("Failed to create flashcards in second attempt (after cleaning).")
+                raise self._generation_failed(tokens)
 
+        REPAIR_STATS[method] += 1
         return (flashcards, tokens)
 
-    def enforce_format(self, response):
+    async def agenerate_flashcards(self, user, deck, text_input, context, proposed_flashcards = [], feedback = "", use_cache=True):
+        """
+        Async version of generate_flashcards.
+        """
+        with deferred_cache_writes() as cache_writes:
+            result = await self._agenerate_flashcards(user, deck, text_input, context, proposed_flashcards, feedback, use_cache)
+            await cache_writes.acommit()
+        return result
+
+    async def _agenerate_flashcards(self, user, deck, text_input, context, proposed_flashcards, feedback, use_cache):
+        json_tokens = 0
+        if self.output_format == "json" and not feedback:
+            flashcards, json_tokens = await self.agenerate_flashcards_json(user, deck, text_input, context, use_cache=use_cache)
+            if flashcards is not None:
+                return (flashcards, json_tokens)
+
+        prompt, system_message = self.build_generation_prompt(text_input, context, proposed_flashcards, feedback)
+
+        # Query LLM
+        response, tokens = await self.llm_client.aquery(prompt, system_message, use_cache=use_cache, call_site="generation")
+        tokens += json_tokens
+
+        try:
+            flashcards, method = self.parse_response(response, user, deck)
+        except Exception as e:
+            self.logger.warning(f"Local flashcard creation failed: {e}. Attempting to clean the response.")
+            try:
+                clean_response, clean_tokens = await self.aenforce_format(response, use_cache=use_cache)
+                tokens += clean_tokens
+                flashcards = self.create_flashcards_from_response(clean_response, user, deck)
+                method = "enforce_format"
+                self.logger.info("Flashcards created on the second try (after cleaning format)")
+            except Exception as clean_error:
+                REPAIR_STATS["failed"] += 1
+                self.logger.error(f"Failed to create flashcards even after cleaning: {clean_error}")
+                raise self._generation_failed(tokens)
+
+        REPAIR_STATS[method] += 1
+        return (flashcards, tokens)
+
+    def _generation_failed(self, tokens):
+        error = ValueError("Failed to create flashcards in second attempt (after cleaning).")
+        # The unusable responses still cost tokens, which the caller records
+        error.tokens_used = tokens
+        return error
+
+    def parse_response(self, response, user, deck):
+        """
+        Turn an LLM response into flashcards, trying the local repair strategies
+        (see response_repair.py) before giving up.
+
+        :return: (flashcards, method), method being "first_try" or the name of the
+                 repair strategy that succeeded
+        :raises ValueError: if neither the response nor any local repair can be parsed
+        """
+        try:
+            flashcards = self.create_flashcards_from_response(response, user, deck)
+            self.logger.info("Flashcards created on the first try")
+            return (flashcards, "first_try")
+        except Exception as e:
+            self.logger.warning(f"Initial flashcard creation failed: {e}. Attempting local repairs.")
+
+        return repair_response(response, lambda text: self.create_flashcards_from_response(text, user, deck))
+
+    def split_into_chunks(self, text, max_chunk_tokens=3000, max_chunk_chars=MAX_INPUT_LENGTH):
+        """
+        Split text into chunks that fit a single generation call.
+
+        Chunks are packed greedily from paragraphs (blank-line separated, which
+        includes the page breaks produced by get_pdf). Paragraphs that are too
+        large on their own are split on lines, then on whitespace.
+        """
+        def fits(piece):
+            return len(piece) <= max_chunk_chars and estimate_input_tokens(piece) <= max_chunk_tokens
+
+        def split_piece(piece, separator):
+            # Greedily pack the parts of piece, keeping each part under budget
+            parts, current = [], ""
+            for part in piece.split(separator):
+                candidate = f"{current}{separator}{part}" if current else part
+                if fits(candidate):
+                    current = candidate
+                    continue
+                if current:
+                    parts.append(current)
+                if fits(part):
+                    current = part
+                elif separator == "\n":
+                    parts.extend(split_piece(part, " "))
+                    current = ""
+                else:
+                    # A single word longer than the budget: cut it
+                    parts.extend(part[i:i + max_chunk_chars] for i in range(0, len(part), max_chunk_chars))
+                    current = ""
+            if current:
+                parts.append(current)
+            return parts
+
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+        chunks, current = [], ""
+        for paragraph in paragraphs:
+            pieces = [paragraph] if fits(paragraph) else split_piece(paragraph, "\n")
+            for piece in pieces:
+                candidate = f"{current}\n\n{piece}" if current else piece
+                if fits(candidate):
+                    current = candidate
+                else:
+                    chunks.append(current)
+                    current = piece
+        if current:
+            chunks.append(current)
+
+        self.logger.info(f"Split text of {len(text)} characters into {len(chunks)} chunks")
+        return chunks
+
+    def merge_flashcards(self, flashcard_lists):
+        """
+        Merge the flashcards generated for each chunk, dropping cards whose
+        normalized question was already seen.
+        """
+        merged, seen_questions = [], set()
+        for flashcards in flashcard_lists:
+            for flashcard in flashcards:
+                key = re.sub(r"[\W_]+", " ", flashcard.question.lower()).strip()
+                if key in seen_questions:
+                    continue
+                seen_questions.add(key)
+                merged.append(flashcard)
+        return merged
+
+    def _collect_chunk_results(self, chunks, results):
+        """
+        Separate successful chunk results from failures. Fails only if every
+        chunk failed, with the usage of the chunks in the error's chunk_usage.
+        """
+        flashcard_lists, chunk_usage = [], []
+        for idx, (chunk, result) in enumerate(zip(chunks, results)):
+            if isinstance(result, Exception):
+                self.logger.error(f"Chunk {idx + 1}/{len(results)} failed: {result}")
+                # A chunk can fail after its LLM calls used tokens
+                tokens = getattr(result, 'tokens_used', 0)
+                if tokens:
+                    chunk_usage.append((chunk, tokens))
+                continue
+            flashcards, tokens = result
+            flashcard_lists.append(flashcards)
+            chunk_usage.append((chunk, tokens))
+
+        if not flashcard_lists:
+            error = ValueError("Failed to create flashcards for every chunk.")
+            error.chunk_usage = chunk_usage
+            raise error
+
+        flashcards = self.merge_flashcards(flashcard_lists)
+        self.logger.info(f"Merged {sum(len(f) for f in flashcard_lists)} flashcards from {len(flashcard_lists)} chunks into {len(flashcards)}")
+        return (flashcards, chunk_usage)
+
+    def generate_flashcards_chunked(self, user, deck, text_input, context, max_concurrency=4, use_cache=True, chunks=None):
+        """
+        Map-reduce generation for texts over the single-call limit: each chunk is
+        generated in a thread pool, then the cards are merged and de-duplicated.
+
+        Returns the flashcards and a (chunk_text, tokens_used) pair for each chunk
+        whose LLM calls used tokens, failed chunks included.
+        Pass chunks when the text was already split (e.g. to estimate token cost).
+        """
+        chunks = chunks or self.split_into_chunks(text_input)
+
+        def generate_chunk(chunk):
+            close_old_connections()
+            try:
+                with call_group(chunk):
+                    return self.generate_flashcards(user, deck, chunk, context, use_cache=use_cache)
+            except Exception as e:
+                return e
+            finally:
+                # The LLM cache or the token estimator may have opened a database
+                # connection in this thread, which ends with the pool
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            # Each chunk runs in a copy of the caller's context (e.g. its LLM ledger scope)
+            futures = [executor.submit(contextvars.copy_context().run, generate_chunk, chunk) for chunk in chunks]
+            results = [future.result() for future in futures]
+
+        return self._collect_chunk_results(chunks, results)
+
+    async def agenerate_flashcards_chunked(self, user, deck, text_input, context, max_concurrency=4, use_cache=True, chunks=None):
+        """
+        Async version of generate_flashcards_chunked, bounded by a semaphore.
+        """
+        chunks = chunks or self.split_into_chunks(text_input)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def generate_chunk(chunk):
+            async with semaphore:
+                with call_group(chunk):
+                    return await self.agenerate_flashcards(user, deck, chunk, context, use_cache=use_cache)
+
+        results = await asyncio.gather(*[generate_chunk(chunk) for chunk in chunks], return_exceptions=True)
+        return self._collect_chunk_results(chunks, results)
+
+    def build_enforce_format_prompt(self, response):
+        """
+        Build the (prompt, system_message) pair used to fix the format of a response.
+        """
         system_message = (
             "You are an expert in creating questions and answers out of study material, and in the same language."
         )
@@ -102,10 +469,261 @@ class FlashcardGenerator:
             "Return only the cleaned response. This is the original response to be cleaned: "
             f"[[[{response}]]]"
             )
+        return (prompt, system_message)
 
-        clean_response, tokens = self.llm_client.query(prompt, system_message)
+    def enforce_format(self, response, use_cache=True):
+        prompt, system_message = self.build_enforce_format_prompt(response)
+        clean_response, tokens = self.llm_client.query(prompt, system_message, use_cache=use_cache, call_site="enforce_format")
         return (clean_response, tokens)
-        
+
+    async def aenforce_format(self, response, use_cache=True):
+        prompt, system_message = self.build_enforce_format_prompt(response)
+        clean_response, tokens = await self.llm_client.aquery(prompt, system_message, use_cache=use_cache, call_site="enforce_format")
+        return (clean_response, tokens)
+
+    def build_regeneration_prompt(self, flashcards, feedback, excerpts, context=""):
+        """
+        Build the (prompt, system_message) pair used to rewrite only the given
+        flashcards, each with a short excerpt of its source instead of the whole text.
+        """
+        system_message = (
+            "You are an expert in creating questions and answers out of study material."
+            "You follow the guidelines precisely."
+        )
+        cards_string = "\n".join(
+            f"{idx}. Question: {flashcard.question} | Answer: {flashcard.answer} | Source: {excerpt or 'unknown'}"
+            for idx, (flashcard, excerpt) in enumerate(zip(flashcards, excerpts))
+        )
+        prompt = (
+            "A student rejected the following flashcards. Rewrite each of them according to the feedback, "
+            "staying faithful to its source and in the same language.\n"
+            f"Flashcards, in the format of idx. Question | Answer | Source:\n{cards_string}\n"
+            f"Feedback: [{feedback}]\n"
+            f"User context:\n{context}\n"
+            f"Return exactly {len(flashcards)} lines, one per flashcard, each starting with the idx of the flashcard it rewrites, "
+            "in purely CSV format without title or prefaces, like this: "
+            "0,\"Who was Mozart?\",\"A classical composer\"\n"
+            "Questions and answers must each be surrounded by quotes. The idx, question and answer must be separated with commas. "
+            "Do not add 'Question: ' or 'Answer: ' in the response."
+            )
+        return (prompt, system_message)
+
+    def regenerate_flashcards(self, flashcards, feedback, excerpts, context="", use_cache=False):
+        """
+        Rewrite the given flashcards according to the feedback.
+
+        :param excerpts: bounded source text of each flashcard, same order as flashcards
+        :return: (regenerated, tokens), regenerated mapping the position of a card in
+                 flashcards to its unsaved rewrite. Cards the LLM skipped or returned
+                 malformed are missing from it.
+        """
+        if not flashcards or not feedback:
+            raise ValueError("Empty flashcards or feedback")
+        prompt, system_message = self.build_regeneration_prompt(flashcards, feedback, excerpts, context)
+        with deferred_cache_writes() as cache_writes:
+            response, tokens = self.llm_client.query(prompt, system_message, use_cache=use_cache, call_site="regeneration")
+            regenerated = self.parse_regenerated_response(response, flashcards[0].user, flashcards[0].deck, len(flashcards))
+            if regenerated:
+                cache_writes.commit()
+        REPAIR_STATS["first_try" if len(regenerated) == len(flashcards) else "failed"] += 1
+        if len(regenerated) != len(flashcards):
+            self.logger.warning(f"Asked to regenerate {len(flashcards)} flashcards, got {len(regenerated)} usable ones")
+        return (regenerated, tokens)
+
+    async def aregenerate_flashcards(self, flashcards, feedback, excerpts, context="", use_cache=False):
+        """
+        Async version of regenerate_flashcards.
+        """
+        if not flashcards or not feedback:
+            raise ValueError("Empty flashcards or feedback")
+        prompt, system_message = self.build_regeneration_prompt(flashcards, feedback, excerpts, context)
+        with deferred_cache_writes() as cache_writes:
+            response, tokens = await self.llm_client.aquery(prompt, system_message, use_cache=use_cache, call_site="regeneration")
+            regenerated = self.parse_regenerated_response(response, flashcards[0].user, flashcards[0].deck, len(flashcards))
+            if regenerated:
+                await cache_writes.acommit()
+        REPAIR_STATS["first_try" if len(regenerated) == len(flashcards) else "failed"] += 1
+        if len(regenerated) != len(flashcards):
+            self.logger.warning(f"Asked to regenerate {len(flashcards)} flashcards, got {len(regenerated)} usable ones")
+        return (regenerated, tokens)
+
+    def parse_regenerated_response(self, response, user, deck, n_flashcards):
+        """
+        Parse 'idx,"Question","Answer"' lines into {idx: Flashcard}. Lines that are
+        malformed, out of range or repeat an idx are skipped, so a rewrite is never
+        paired with the wrong card.
+        """
+        reader = csv.reader(StringIO(normalize_quotes(response).strip() + "\n"), quotechar='"', escapechar='\\', skipinitialspace=True)
+        regenerated = {}
+        for row in reader:
+            if len(row) != 3:
+                continue
+            try:
+                idx = int(row[0].strip().rstrip('.:'))
+                flashcard = self.flashcard_from_row(row[1:], user, deck)
+            except ValueError as e:
+                self.logger.debug(f"Skipping regenerated row {row}: {e}")
+                continue
+            if 0 <= idx < n_flashcards and idx not in regenerated:
+                regenerated[idx] = flashcard
+        return regenerated
+
+
+    def flashcard_from_row(self, row, user, deck):
+        """
+        Build an unsaved Flashcard from a parsed CSV row.
+
+        :raises ValueError: if the row does not hold exactly a non-empty question and answer
+        """
+        # Attempt to unpack the row into question and answer
+        question, answer = row # this may already raise a ValueError if there aren't exactly 2 items to unpack
+        len_question, len_answer = len(question), len(answer)
+        if len_question==0 or len_answer==0: # when 2 items were unpacked, but some of them are empty
+            raise ValueError(f"Question length: {len_question}. Answer length: {len_answer}")
+
+        return Flashcard(
+            question=question.strip(), 
+            answer=answer.strip(), 
+            user=user,
+            deck=deck,
+            accepted=False
+        )
+
+    async def astream_flashcards(self, user, deck, text_input, context, use_cache=True):
+        """
+        Generate flashcards from a streamed completion.
+
+        Yields ("flashcard", Flashcard) as soon as each card is complete, and a
+        final ("tokens", total_tokens). In the "json" output format, a stream with
+        no usable card is followed by a CSV stream, whose cards are yielded instead.
+        """
+        json_tokens = 0
+        if self.output_format == "json":
+            n_flashcards = 0
+            try:
+                async for event, payload in self.astream_json_flashcards(user, deck, text_input, context, use_cache):
+                    if event == "tokens":
+                        json_tokens = payload
+                        continue
+                    n_flashcards += 1
+                    yield (event, payload)
+            except LLMBadRequestError as e:
+                # Rejected when the stream is opened, before any card
+                self.logger.warning(f"Structured output request rejected: {e}. Falling back to CSV generation.")
+            if n_flashcards:
+                REPAIR_STATS["json_first_try"] += 1
+                yield ("tokens", json_tokens)
+                return
+            REPAIR_STATS["json_failed"] += 1
+            self.logger.warning("No flashcards parsed from the JSON stream. Falling back to CSV generation.")
+
+        async for event, payload in self.astream_csv_flashcards(user, deck, text_input, context, use_cache):
+            if event == "tokens":
+                payload += json_tokens
+            yield (event, payload)
+
+    async def astream_json_flashcards(self, user, deck, text_input, context, use_cache=True):
+        """
+        Stream structured JSON output, yielding ("flashcard", Flashcard) as soon as
+        each card object is closed, and a final ("tokens", total_tokens).
+        """
+        prompt, system_message = self.build_json_generation_prompt(text_input, context)
+        parser = IncrementalJSONParser()
+        tokens = 0
+        n_flashcards = 0
+        with deferred_cache_writes() as cache_writes:
+            async for delta, total_tokens in self.llm_client.astream_query(
+                prompt, system_message, use_cache=use_cache, call_site="generation", response_format=FLASHCARDS_RESPONSE_FORMAT
+            ):
+                if total_tokens is not None:
+                    tokens = total_tokens
+                    continue
+                for item in parser.feed(delta):
+                    try:
+                        flashcard = self.flashcard_from_row((item["question"], item["answer"]), user, deck)
+                    except (ValueError, KeyError, TypeError) as e:
+                        self.logger.error(f"Streamed JSON flashcard is invalid: {item}. Error: {e}")
+                        continue
+                    n_flashcards += 1
+                    yield ("flashcard", flashcard)
+            # A stream without a usable card is not cached, so the next try asks the provider again
+            if n_flashcards:
+                await cache_writes.acommit()
+        yield ("tokens", tokens)
+
+    async def astream_csv_flashcards(self, user, deck, text_input, context, use_cache=True):
+        """
+        Stream a CSV completion, yielding ("flashcard", Flashcard) as soon as each
+        row is complete and a final ("tokens", total_tokens). If no row of the
+        stream can be parsed, the full response goes through the local repairs and
+        then enforce_format, and those cards are yielded instead. Rows holding
+        typographic quotes or list numbering are held back and repaired at the end.
+        """
+        prompt, system_message = self.build_generation_prompt(text_input, context)
+        parser = IncrementalCSVParser()
+        response_parts = []
+        # Rows with typographic quotes or list numbering, repaired once the stream ends
+        held_lines = []
+        tokens = 0
+        n_flashcards = 0
+
+        def parse_lines(lines):
+            flashcards = []
+            for line in lines:
+                row = next(csv.reader([line], quotechar='"', escapechar='\\'), [])
+                if has_artifacts(row):
+                    held_lines.append(line)
+                    continue
+                try:
+                    flashcards.append(self.flashcard_from_row(row, user, deck))
+                except ValueError as ve:
+                    self.logger.error(f"Streamed row is invalid or malformed: {row}. Error: {ve}")
+            return flashcards
+
+        with deferred_cache_writes() as cache_writes:
+            async for delta, total_tokens in self.llm_client.astream_query(prompt, system_message, use_cache=use_cache, call_site="generation"):
+                if total_tokens is not None:
+                    tokens = total_tokens
+                    continue
+                response_parts.append(delta)
+                for flashcard in parse_lines(parser.feed(delta)):
+                    n_flashcards += 1
+                    yield ("flashcard", flashcard)
+
+            for flashcard in parse_lines(parser.flush()):
+                n_flashcards += 1
+                yield ("flashcard", flashcard)
+
+            if n_flashcards == 0:
+                self.logger.warning("No flashcards parsed from the stream. Attempting to repair the response.")
+                response = "".join(response_parts)
+                try:
+                    flashcards, method = repair_response(response, lambda text: self.create_flashcards_from_response(text, user, deck))
+                except ValueError:
+                    try:
+                        clean_response, clean_tokens = await self.aenforce_format(response, use_cache=use_cache)
+                        tokens += clean_tokens
+                        flashcards = self.create_flashcards_from_response(clean_response, user, deck)
+                        method = "enforce_format"
+                    except Exception:
+                        REPAIR_STATS["failed"] += 1
+                        raise
+                REPAIR_STATS[method] += 1
+                for flashcard in flashcards:
+                    yield ("flashcard", flashcard)
+            else:
+                REPAIR_STATS["first_try"] += 1
+                if held_lines:
+                    try:
+                        flashcards, method = repair_response("\n".join(held_lines), lambda text: self.create_flashcards_from_response(text, user, deck))
+                    except ValueError as e:
+                        self.logger.error(f"Dropped {len(held_lines)} streamed rows that could not be repaired: {e}")
+                        flashcards = []
+                    for flashcard in flashcards:
+                        yield ("flashcard", flashcard)
+
+            await cache_writes.acommit()
+        yield ("tokens", tokens)
 
     def create_flashcards_from_response(self, response, user, deck):
         """
@@ -137,26 +755,18 @@ class FlashcardGenerator:
         # Use StringIO to treat the response as a file-like object for the CSV reader
         response_io = StringIO(response)
         reader = csv.reader(response_io, quotechar='"', escapechar='\\')
+        rows = list(reader)
+
+        # Typographic quotes or list numbering would end up inside the flashcards: leave them to the repairs
+        if any(has_artifacts(row) for row in rows):
+            raise ValueError("Rows still hold typographic quotes or list numbering")
 
         flashcards = []
         flashcard_errors = 0
         # Iterate over each row in the CSV response
-        for idx, row in enumerate(reader):
+        for idx, row in enumerate(rows):
             try:
-                # Attempt to unpack the row into question and answer
-                question, answer = row # this may already raise a ValueError if there aren't exactly 2 items to unpack
-                len_question, len_answer = len(question), len(answer)
-                if len_question==0 or len_answer==0: # when 2 items were unpacked, but some of them are empty
-                    raise ValueError(f"Question length: {len_question}. Answer length: {len_answer}")
-
-                # Create and append the flashcard
-                card_i = Flashcard(
-                    question=question.strip(), 
-                    answer=answer.strip(), 
-                    user=user,
-                    deck=deck,
-                    accepted=False
-                )
+                card_i = self.flashcard_from_row(row, user, deck)
                 flashcards.append(card_i)
             except ValueError as ve:
                 flashcard_errors += 1
@@ -177,3 +787,101 @@ class FlashcardGenerator:
 
         self.logger.info("Flashcards were created")
         return flashcards
+
+
+class IncrementalCSVParser:
+    """
+    Accumulates streamed CSV text and hands back each line once it is complete,
+    i.e. once a newline appears outside of a quoted field.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.in_quotes = False
+
+    def feed(self, text):
+        """
+        Add text to the buffer and return the list of lines completed by it.
+        """
+        self.buffer += text
+        lines = []
+        i = self.position
+        while i < len(self.buffer):
+            char = self.buffer[i]
+            if char == '\\':
+                # Escaped character, never a delimiter
+                i += 2
+                continue
+            if char == '"':
+                self.in_quotes = not self.in_quotes
+            elif char == '\n' and not self.in_quotes:
+                line = self.buffer[:i]
+                self.buffer = self.buffer[i + 1:]
+                i = 0
+                if line.strip():
+                    lines.append(line)
+                continue
+            i += 1
+        self.position = i
+        return lines
+
+    def flush(self):
+        """
+        Return the last, unterminated line, if any.
+        """
+        line, self.buffer, self.position, self.in_quotes = self.buffer, "", 0, False
+        return [line] if line.strip() else []
+
+
+class IncrementalJSONParser:
+    """
+    Scans streamed JSON of the form {"flashcards": [{...}, {...}]} and hands back
+    each card object as soon as its closing brace arrives.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+
+    def feed(self, text):
+        """
+        Add text to the buffer and return the list of card dicts completed by it.
+        """
+        self.buffer += text
+        items = []
+        for i in range(self.position, len(self.buffer)):
+            char = self.buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+                if self.depth == 2:
+                    self.object_start = i
+            elif char == '}':
+                if self.depth == 2 and self.object_start is not None:
+                    try:
+                        items.append(json.loads(self.buffer[self.object_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self.object_start = None
+                self.depth -= 1
+        self.position = len(self.buffer)
+
+        # Drop the text before the card being read, it will not be needed again
+        keep_from = self.object_start if self.object_start is not None else self.position
+        self.buffer = self.buffer[keep_from:]
+        self.position -= keep_from
+        if self.object_start is not None:
+            self.object_start = 0
+        return items
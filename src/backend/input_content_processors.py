@@ -1,4 +1,6 @@
 import logging
+import re
+from collections import Counter
 logger = logging.getLogger("src/backend/input_content_processors.py")
 logger.setLevel(logging.DEBUG)
 console_handler = logging.StreamHandler()
@@ -28,11 +30,63 @@ def get_docx(content):
     full_text = "  ".join(full_text)
     return full_text
 
-def get_pdf(content):
+# A line is boilerplate when found on at least this share of the pages (and on 3 pages or more)
+REPEATED_LINE_MIN_SHARE = 0.5
+REPEATED_LINE_MIN_PAGES = 3
+# Lines at the top and bottom of a page where headers, footers and page numbers sit
+EDGE_LINES = 2
+# Longer lines are content, even when repeated
+MAX_REPEATED_LINE_CHARS = 120
+
+def line_keys(lines):
+    """
+    Key under which each line is compared across pages: lowercase with single spaces.
+    At the page edges digit runs are masked too, so "Page 3 of 40" matches "Page 4 of 40";
+    elsewhere numbered content ("Step 3: ...") must repeat exactly to be removed.
+    """
+    non_empty = [idx for idx, line in enumerate(lines) if line.strip()]
+    n_edge = EDGE_LINES if len(non_empty) > 2 * EDGE_LINES else 1
+    edges = set(non_empty[:n_edge] + non_empty[-n_edge:])
+    keys = []
+    for idx, line in enumerate(lines):
+        key = ' '.join(line.lower().split())
+        keys.append(('edge', re.sub(r'\d+', '#', key)) if idx in edges else ('body', key))
+    return keys
+
+def strip_repeated_lines(pages, min_share=REPEATED_LINE_MIN_SHARE, min_pages=REPEATED_LINE_MIN_PAGES):
+    """
+    Remove running headers, footers, page numbers and watermarks from the text of each page.
+    Args:
+        pages: Text of each page
+    Returns:
+        tuple: (cleaned pages, number of characters removed)
+    """
+    page_lines = [text.splitlines() for text in pages]
+    page_keys = [line_keys(lines) for lines in page_lines]
+    # Pages each line appears on, counted once per page
+    line_pages = Counter()
+    for lines, keys in zip(page_lines, page_keys):
+        line_pages.update({key for line, key in zip(lines, keys) if line.strip() and len(line) <= MAX_REPEATED_LINE_CHARS})
+
+    threshold = max(min_pages, min_share * len(pages))
+    repeated = {key for key, count in line_pages.items() if count >= threshold}
+    if not repeated:
+        return list(pages), 0
+
+    cleaned_pages, removed_chars = [], 0
+    for text, lines, keys in zip(pages, page_lines, page_keys):
+        kept = [line for line, key in zip(lines, keys) if not line.strip() or key not in repeated]
+        cleaned = '\n'.join(kept).strip()
+        removed_chars += len(text) - len(cleaned)
+        cleaned_pages.append(cleaned)
+    return cleaned_pages, removed_chars
+
+def get_pdf(content, strip_boilerplate=True):
     """
     Extract text and tables from a PDF using pdfplumber.
     Args:
         content: File content (bytes) or file path (str)
+        strip_boilerplate: Remove lines repeated across pages (headers, footers, page numbers)
     Returns:
         str: Extracted text with preserved structure
     """
@@ -43,19 +97,17 @@ def get_pdf(content):
         logger.debug("Reading content from file...")
         pdf = pdfplumber.open(content)
 
-        document_content = []
+        page_texts = []
+        page_tables = []
         
         # Process each page
         for page in pdf.pages:
-            page_content = []
-            
             # Extract text from the page
-            text = page.extract_text()
-            if text:
-                page_content.append(text)
+            page_texts.append(page.extract_text() or '')
 
             # Extract tables from the page
             tables = page.extract_tables()
+            table_strs = []
             
             if tables:
                 # Process each table
@@ -72,8 +124,24 @@ def get_pdf(content):
                         if any(cell for cell in row)  # Skip empty rows
                     )
                     if table_str:
-                        page_content.append(f"[TABLE]\n{table_str}\n[/TABLE]")
-            
+                        table_strs.append(f"[TABLE]\n{table_str}\n[/TABLE]")
+            page_tables.append(table_strs)
+
+        if strip_boilerplate:
+            cleaned_texts, removed_chars = strip_repeated_lines(page_texts)
+            if removed_chars:
+                # Imported here: usage_limits needs Django, this module does not
+                from src.backend.usage_limits import estimate_tokens
+                saved_tokens = estimate_tokens('\n'.join(page_texts)) - estimate_tokens('\n'.join(cleaned_texts))
+                logger.info(
+                    f"Removed repeated headers/footers from {len(page_texts)} pages: "
+                    f"{removed_chars} characters, ~{saved_tokens} tokens saved"
+                )
+            page_texts = cleaned_texts
+
+        document_content = []
+        for text, table_strs in zip(page_texts, page_tables):
+            page_content = ([text] if text else []) + table_strs
             # Add non-empty page content
             if page_content:
                 document_content.append('\n\n'.join(page_content))
@@ -82,4 +150,46 @@ def get_pdf(content):
         return '\n\n'.join(document_content)
     
     except Exception as e:
-        raise Exception(f"Error extracting PDF content: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error extracting PDF content: {str(e)}")
+
+
+def get_pdf_pages(content, strip_boilerplate=True):
+    """
+    Extract the text and word boxes of each page of a PDF using pdfplumber.
+    Args:
+        content: File content (file-like object) or file path (str)
+        strip_boilerplate: Remove lines repeated across pages (headers, footers, page numbers)
+    Returns:
+        list: One dict per page with 'page' (1-based), 'text' and 'boxes'. Boxes use
+        the viewer's format (text, x, y from the bottom, width, height, page) in PDF
+        points, i.e. a viewer at 100% zoom.
+    """
+    import pdfplumber
+
+    try:
+        logger.debug("Reading pages from file...")
+        with pdfplumber.open(content) as pdf:
+            pages = []
+            for number, page in enumerate(pdf.pages, start=1):
+                boxes = [
+                    {
+                        'text': word['text'],
+                        'x': word['x0'],
+                        'y': page.height - word['bottom'],
+                        'width': word['x1'] - word['x0'],
+                        'height': word['bottom'] - word['top'],
+                        'page': number
+                    }
+                    for word in page.extract_words()
+                ]
+                pages.append({'page': number, 'text': page.extract_text() or '', 'boxes': boxes})
+
+        if strip_boilerplate:
+            texts, removed_chars = strip_repeated_lines([page['text'] for page in pages])
+            for page, text in zip(pages, texts):
+                page['text'] = text
+            logger.debug(f"Removed {removed_chars} characters of repeated headers/footers")
+        return pages
+
+    except Exception as e:
+        raise Exception(f"Error extracting PDF pages: {str(e)}")
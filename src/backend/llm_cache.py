@@ -0,0 +1,238 @@
+import contextvars
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+
+# Logger set up
+logger = logging.getLogger("src/backend/llm_cache.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+def make_cache_key(model, system_message, prompt):
+    """
+    Content-addressed key for an LLM call: sha256 of (model, system_message, prompt).
+    """
+    digest = hashlib.sha256()
+    for part in (model, system_message, prompt):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+# Cache writes held back by the current deferred_cache_writes(), if any
+_pending_writes = contextvars.ContextVar("llm_cache_pending_writes", default=None)
+
+
+class PendingCacheWrites:
+    """
+    Responses received within deferred_cache_writes(), written to their cache
+    only once commit() confirms the caller could use them.
+    """
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.entries = []  # (cache, key, value)
+
+    def add(self, cache, key, value):
+        self.entries.append((cache, key, value))
+
+    def commit(self):
+        """
+        Write the held responses, or hand them to the enclosing block, which commits them with its own.
+        """
+        entries, self.entries = self.entries, []
+        if self.parent is not None:
+            self.parent.entries.extend(entries)
+            return
+        for cache, key, value in entries:
+            cache.set(key, value)
+
+    async def acommit(self):
+        """
+        Async version of commit.
+        """
+        if self.parent is not None:
+            self.commit()
+            return
+        entries, self.entries = self.entries, []
+        for cache, key, value in entries:
+            await cache.aset(key, value)
+
+
+@contextmanager
+def deferred_cache_writes():
+    """
+    Hold the cache writes of the LLM calls made in the block (also from tasks and
+    threads started with a copy of the context) until commit() is called on the
+    yielded PendingCacheWrites. Writes left uncommitted when the block ends, e.g.
+    of a response that could not be parsed, are dropped.
+    """
+    pending = PendingCacheWrites(parent=_pending_writes.get())
+    _pending_writes.set(pending)
+    try:
+        yield pending
+    finally:
+        # set() rather than reset(): async generators may exit in another context
+        _pending_writes.set(pending.parent)
+
+def pending_cache_writes():
+    """
+    PendingCacheWrites of the current deferred_cache_writes() block, or None.
+    """
+    return _pending_writes.get()
+
+
+class DatabaseCacheTier:
+    """
+    Persistent cache tier stored in the llm_response_cache table, shared by
+    every worker using the same database.
+    """
+    def __init__(self, ttl, max_entries, trim_every=100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.trim_every = trim_every
+        self._writes = 0
+
+    def get(self, key):
+        from flashcards.models import CachedLLMResponse
+        from django.utils import timezone
+
+        entry = CachedLLMResponse.objects.filter(key=key).first()
+        if entry is None:
+            return None
+        if entry.created_at < timezone.now() - timedelta(seconds=self.ttl):
+            entry.delete()
+            return None
+        CachedLLMResponse.objects.filter(key=key).update(last_accessed=timezone.now())
+        return (entry.response, entry.total_tokens)
+
+    def set(self, key, value):
+        from flashcards.models import CachedLLMResponse
+
+        response, total_tokens = value
+        CachedLLMResponse.objects.update_or_create(
+            key=key,
+            defaults={'response': response, 'total_tokens': total_tokens}
+        )
+        self._writes += 1
+        if self._writes % self.trim_every == 0:
+            CachedLLMResponse.evict(self.ttl, self.max_entries)
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for LLM responses.
+
+    The in-memory tier is a per-process LRU with a TTL. The optional persistent
+    tier is consulted on a memory miss and filled on every write.
+    """
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=1000, persistent_tier=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persistent_tier = persistent_tier
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the cached (response, total_tokens) for key, or None on a miss.
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        return self._get_persistent(key)
+
+    async def aget(self, key):
+        """
+        Async version of get. Only a lookup in the persistent tier, which uses
+        the ORM, runs off the event loop.
+        """
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        if self.persistent_tier is None:
+            # Only counts the miss
+            return self._get_persistent(key)
+        return await sync_to_async(self._get_persistent)(key)
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            return None
+
+    def _get_persistent(self, key):
+        value = None
+        if self.persistent_tier is not None:
+            try:
+                value = self.persistent_tier.get(key)
+            except Exception as e:
+                logger.error(f"Error reading persistent LLM cache: {e}")
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, value)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        if self.persistent_tier is not None:
+            self._set_persistent(key, value)
+
+    async def aset(self, key, value):
+        """
+        Async version of set, writing the persistent tier off the event loop.
+        """
+        with self._lock:
+            self._store(key, value)
+        if self.persistent_tier is not None:
+            await sync_to_async(self._set_persistent)(key, value)
+
+    def _set_persistent(self, key, value):
+        try:
+            self.persistent_tier.set(key, value)
+        except Exception as e:
+            logger.error(f"Error writing persistent LLM cache: {e}")
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for this process.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+            }
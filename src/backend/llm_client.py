@@ -1,14 +1,82 @@
 import openai  # Or any other library you're using
+import httpx
+import asyncio
 import logging
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+from src.backend.llm_cache import make_cache_key, pending_cache_writes
+from src.backend.llm_resilience import CircuitBreaker, CircuitOpenError, LLMBadRequestError, LatencyTracker, is_retryable, backoff_delay
+from src.backend.metrics import LLM_REQUEST_SECONDS, LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS, LLM_ERRORS
+from src.backend.llm_governor import LLMBusyError, Reservation
+from src.backend.llm_ledger import LedgerEntry
+
+# Threads running the second attempt of hedged sync calls
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
 
 class LLMClient:
-    def __init__(self, api_key, model="gpt-3.5-turbo"):
+    def __init__(self, api_key, model="gpt-3.5-turbo", timeout=60.0, connect_timeout=5.0,
+                 max_connections=20, max_keepalive_connections=10, http_client=None, cache=None,
+                 base_url=None, max_retries=2, retry_backoff=0.5, hedge=False,
+                 circuit_failure_threshold=5, circuit_reset_seconds=30.0, governor=None, backend=None, models=None, ledger=None):
         """
         Initialize the LLMClient with API key and model.
+
+        models maps call sites (generation, enforce_format, box_matching...) to the
+        model serving them; call sites without an entry use model.
+
+        The client owns a keep-alive httpx connection pool, so it is meant to be
+        created once per worker (see get_shared_client) and reused across requests.
+        An optional LLMResponseCache serves repeated (model, system_message, prompt)
+        calls without querying the provider.
+
+        Failed calls are retried up to max_retries times with jittered backoff
+        when the error is retryable. With hedge=True, a second attempt starts once
+        a call has run longer than the recent p95 latency and the first answer wins;
+        the losing attempt still consumes tokens. A circuit breaker shared by all
+        calls of this client fails fast while the provider keeps failing.
+        base_url points the client at another OpenAI-compatible server, e.g. a local stub.
+        An optional LLMGovernor queues calls to stay under the provider rate limits.
+        An optional backend from llm_replay records the provider calls or replays
+        them offline in place of the provider.
+        An optional LLMLedger receives one LedgerEntry per provider call.
         """
         self.api_key = api_key
         self.model = model
-        openai.api_key = api_key
+        self.models = models or {}
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.cache = cache
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.hedge = hedge
+        self.circuit_breaker = CircuitBreaker(circuit_failure_threshold, circuit_reset_seconds)
+        self.latency = LatencyTracker()
+        self.governor = governor
+        self.backend = backend
+        self.ledger = ledger
+        self.http_timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.http_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+
+        if http_client is None:
+            http_client = httpx.Client(timeout=self.http_timeout, limits=self.http_limits)
+        self.http_client = http_client
+        if backend is not None and backend.replaces_provider:
+            self.client = backend.sync_client(None)
+        else:
+            # Retries are handled by _call_with_retries, not by the SDK
+            self.client = openai.OpenAI(api_key=api_key, http_client=http_client, base_url=base_url, max_retries=0)
+            if backend is not None:
+                self.client = backend.sync_client(self.client)
+
+        # The async client is created lazily, inside the event loop that first uses it
+        self.async_http_client = None
+        self.async_client = None
 
         # Logger set up
         self.logger = logging.getLogger("src/backend/llm_client.py")
@@ -19,25 +87,416 @@ class LLMClient:
             console_handler.setFormatter(formatter)
             self.logger.addHandler(console_handler)
 
-    def query(self, prompt, system_message):
+    def query(self, prompt, system_message, timeout=None, use_cache=True, call_site="other", response_format=None):
         """
         Send a prompt to the LLM and return the response content.
+
+        Within llm_cache.deferred_cache_writes(), a fresh response is only cached
+        once the caller commits it, i.e. after it could be parsed.
+
+        :param timeout: Optional per-call timeout in seconds, overriding the client default
+        :param use_cache: Set to False to bypass the response cache (e.g. explicit regeneration)
+        :param call_site: Label of the caller in the metrics (generation, enforce_format, box_matching...)
+        :param response_format: Optional provider response_format, e.g. a JSON schema for structured output
         """
+        model = self.model_for(call_site)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key(model, system_message, prompt)
+            if use_cache:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self.logger.debug("LLM response served from cache")
+                    return (cached[0], 0)
+
         self.logger.debug("Starting call to LLM...")
+        def request(call_timeout):
+            return self.client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format=response_format if response_format is not None else openai.NOT_GIVEN,
+                timeout=call_timeout
+                )
+        entry = self._ledger_entry(call_site, model, cache_key, system_message, prompt)
         try:
-            completion = openai.chat.completions.create(
-                model="gpt-3.5-turbo",
+            with self._reserve(system_message + prompt) as reservation:
+                with LLM_REQUEST_SECONDS.time(call_site=call_site, model=model):
+                    completion = self._call_with_retries(request, self._request_timeout(timeout), entry=entry)
+                reservation.actual_tokens = completion.usage.total_tokens
+            response = completion.choices[0].message.content
+            total_tokens = completion.usage.total_tokens
+            record_usage(call_site, model, completion.usage)
+            self._record_call(entry, completion.usage)
+
+        except (CircuitOpenError, LLMBusyError):
+            LLM_ERRORS.inc(call_site=call_site, model=model)
+            self._record_call(entry, failed=True)
+            raise
+        except Exception as e:
+            LLM_ERRORS.inc(call_site=call_site, model=model)
+            self._record_call(entry, failed=True)
+            raise query_error(e)
+
+        self.logger.debug(f"System message:\n{repr(system_message)}\nPrompt:\n{repr(prompt)}")
+        self.logger.debug(f"Response from the LLM ({model}, {call_site}):\n{repr(response)}\n")
+        self._cache_response(cache_key, response, total_tokens)
+        return (response, total_tokens)
+
+    async def aquery(self, prompt, system_message, timeout=None, use_cache=True, call_site="other", response_format=None):
+        """
+        Async version of query, so an ASGI worker can keep many LLM calls in flight.
+        """
+        model = self.model_for(call_site)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key(model, system_message, prompt)
+            if use_cache:
+                cached = await self.cache.aget(cache_key)
+                if cached is not None:
+                    self.logger.debug("LLM response served from cache")
+                    return (cached[0], 0)
+
+        self._ensure_async_client()
+        self.logger.debug("Starting async call to LLM...")
+        def request(call_timeout):
+            return self.async_client.chat.completions.create(
+                model=model,
                 messages=[
                     {"role": "system", "content": system_message},
                     {"role": "user", "content": prompt}
-                ]
+                ],
+                response_format=response_format if response_format is not None else openai.NOT_GIVEN,
+                timeout=call_timeout
                 )
+        entry = self._ledger_entry(call_site, model, cache_key, system_message, prompt)
+        try:
+            async with self._areserve(system_message + prompt) as reservation:
+                with LLM_REQUEST_SECONDS.time(call_site=call_site, model=model):
+                    completion = await self._acall_with_retries(request, self._request_timeout(timeout), entry=entry)
+                reservation.actual_tokens = completion.usage.total_tokens
             response = completion.choices[0].message.content
             total_tokens = completion.usage.total_tokens
+            record_usage(call_site, model, completion.usage)
+            self._record_call(entry, completion.usage)
+
+        except (CircuitOpenError, LLMBusyError):
+            LLM_ERRORS.inc(call_site=call_site, model=model)
+            self._record_call(entry, failed=True)
+            raise
+        except Exception as e:
+            LLM_ERRORS.inc(call_site=call_site, model=model)
+            self._record_call(entry, failed=True)
+            raise query_error(e)
+
+        self.logger.debug(f"System message:\n{repr(system_message)}\nPrompt:\n{repr(prompt)}")
+        self.logger.debug(f"Response from the LLM ({model}, {call_site}):\n{repr(response)}\n")
+        await self._acache_response(cache_key, response, total_tokens)
+        return (response, total_tokens)
+
+    async def astream_query(self, prompt, system_message, timeout=None, use_cache=True, call_site="other", response_format=None):
+        """
+        Stream a completion. Yields (text_delta, None) while the response arrives
+        and a final (None, total_tokens) once the provider reports usage.
+        """
+        model = self.model_for(call_site)
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_cache_key(model, system_message, prompt)
+            if use_cache:
+                cached = await self.cache.aget(cache_key)
+                if cached is not None:
+                    self.logger.debug("LLM response served from cache")
+                    yield (cached[0], None)
+                    yield (None, 0)
+                    return
 
+        self._ensure_async_client()
+        self.logger.debug("Starting streamed call to LLM...")
+        response_parts = []
+        total_tokens = 0
+        usage = None
+        def request(call_timeout):
+            return self.async_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": prompt}
+                ],
+                stream=True,
+                stream_options={"include_usage": True},
+                response_format=response_format if response_format is not None else openai.NOT_GIVEN,
+                timeout=call_timeout
+                )
+        entry = self._ledger_entry(call_site, model, cache_key, system_message, prompt)
+        try:
+            async with self._areserve(system_message + prompt) as reservation:
+                with LLM_REQUEST_SECONDS.time(call_site=call_site, model=model):
+                    # Only opening the stream is retried; it is never hedged since partial output is already yielded
+                    stream = await self._acall_with_retries(request, self._request_timeout(timeout), hedge=False, record_latency=False, entry=entry)
+                    async for chunk in stream:
+                        if chunk.usage is not None:
+                            total_tokens = chunk.usage.total_tokens
+                            reservation.actual_tokens = total_tokens
+                            record_usage(call_site, model, chunk.usage)
+                            usage = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            delta = chunk.choices[0].delta.content
+                            response_parts.append(delta)
+                            yield (delta, None)
+            self._record_call(entry, usage)
+
+        except (CircuitOpenError, LLMBusyError):
+            LLM_ERRORS.inc(call_site=call_site, model=model)
+            self._record_call(entry, failed=True)
+            raise
         except Exception as e:
-            raise RuntimeError(f"Error querying the LLM: {e}")
-       
+            LLM_ERRORS.inc(call_site=call_site, model=model)
+            self._record_call(entry, failed=True)
+            if is_retryable(e):
+                self.circuit_breaker.record_failure()
+            raise query_error(e)
+
+        response = "".join(response_parts)
         self.logger.debug(f"System message:\n{repr(system_message)}\nPrompt:\n{repr(prompt)}")
-        self.logger.debug(f"Response from the LLM:\n{repr(response)}\n")
-        return (response, total_tokens)
\ No newline at end of file
+        self.logger.debug(f"Streamed response from the LLM ({model}, {call_site}):\n{repr(response)}\n")
+        await self._acache_response(cache_key, response, total_tokens)
+        yield (None, total_tokens)
+
+    def model_for(self, call_site):
+        """
+        Model serving the given call site.
+        """
+        return self.models.get(call_site, self.model)
+
+    def _cache_response(self, cache_key, response, total_tokens):
+        """
+        Store a fresh response, or hold it back until the enclosing
+        deferred_cache_writes() block commits it.
+        """
+        if cache_key is None:
+            return
+        pending = pending_cache_writes()
+        if pending is not None:
+            pending.add(self.cache, cache_key, (response, total_tokens))
+            return
+        self.cache.set(cache_key, (response, total_tokens))
+
+    async def _acache_response(self, cache_key, response, total_tokens):
+        if cache_key is None:
+            return
+        if pending_cache_writes() is not None:
+            self._cache_response(cache_key, response, total_tokens)
+            return
+        await self.cache.aset(cache_key, (response, total_tokens))
+
+    def _ledger_entry(self, call_site, model, cache_key, system_message, prompt):
+        if self.ledger is None:
+            return None
+        return LedgerEntry(call_site, model, cache_key or make_cache_key(model, system_message, prompt))
+
+    def _record_call(self, entry, usage=None, failed=False):
+        """
+        Send the entry of a call that reached the provider to the ledger.
+        """
+        if entry is None or not entry.started:
+            return
+        entry.finish(usage, failed)
+        self.ledger.record(entry)
+
+    def _request_timeout(self, timeout):
+        """
+        Timeout of one request: the client default, or the per-call override with
+        the client's connect timeout, since a bare number would also replace the latter.
+        """
+        if timeout is None:
+            return self.http_timeout
+        return httpx.Timeout(timeout, connect=self.connect_timeout)
+
+    def _reserve(self, text):
+        if self.governor is None:
+            return nullcontext(Reservation(0))
+        return self.governor.reserve(text)
+
+    def _areserve(self, text):
+        if self.governor is None:
+            return nullcontext(Reservation(0))
+        return self.governor.areserve(text)
+
+    def _ensure_async_client(self):
+        if self.async_client is not None:
+            return
+        if self.backend is not None and self.backend.replaces_provider:
+            self.async_client = self.backend.async_client(None)
+            return
+        self.async_http_client = httpx.AsyncClient(timeout=self.http_timeout, limits=self.http_limits)
+        self.async_client = openai.AsyncOpenAI(
+            api_key=self.api_key, http_client=self.async_http_client, base_url=self.base_url, max_retries=0
+        )
+        if self.backend is not None:
+            self.async_client = self.backend.async_client(self.async_client)
+
+    def _call_with_retries(self, request, timeout, hedge=None, entry=None):
+        """
+        Run request(timeout) through the circuit breaker, retrying retryable errors.
+        The ledger entry, if any, gets the start time and the number of retries.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        for attempt in range(self.max_retries + 1):
+            self.circuit_breaker.before_call()
+            if entry is not None:
+                entry.start()
+                entry.retries = attempt
+            try:
+                result = self._hedged_call(request, timeout) if hedge else self._timed_call(request, timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.circuit_breaker.record_neutral()
+                    raise
+                self.circuit_breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.retry_backoff)
+                self.logger.warning(f"LLM call failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            self.circuit_breaker.record_success()
+            return result
+
+    def _timed_call(self, request, timeout):
+        start = time.monotonic()
+        result = request(timeout)
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    def _hedged_call(self, request, timeout):
+        delay = self.latency.hedge_delay()
+        if delay is None:
+            return self._timed_call(request, timeout)
+
+        first = _hedge_executor.submit(self._timed_call, request, timeout)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        self.logger.debug(f"LLM call slower than p95 ({delay:.2f}s), hedging")
+        pending = {first, _hedge_executor.submit(self._timed_call, request, timeout)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _acall_with_retries(self, request, timeout, hedge=None, record_latency=True, entry=None):
+        """
+        Async version of _call_with_retries. Set record_latency=False for calls
+        whose duration is not comparable to a full completion (e.g. opening a stream).
+        """
+        hedge = self.hedge if hedge is None else hedge
+        for attempt in range(self.max_retries + 1):
+            self.circuit_breaker.before_call()
+            if entry is not None:
+                entry.start()
+                entry.retries = attempt
+            try:
+                if hedge:
+                    result = await self._ahedged_call(request, timeout)
+                else:
+                    result = await self._atimed_call(request, timeout, record=record_latency)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.circuit_breaker.record_neutral()
+                    raise
+                self.circuit_breaker.record_failure()
+                if attempt == self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, self.retry_backoff)
+                self.logger.warning(f"LLM call failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.circuit_breaker.record_success()
+            return result
+
+    async def _atimed_call(self, request, timeout, record=True):
+        start = time.monotonic()
+        result = await request(timeout)
+        if record:
+            self.latency.record(time.monotonic() - start)
+        return result
+
+    async def _ahedged_call(self, request, timeout):
+        delay = self.latency.hedge_delay()
+        if delay is None:
+            return await self._atimed_call(request, timeout)
+
+        pending = {asyncio.ensure_future(self._atimed_call(request, timeout))}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return done.pop().result()
+            self.logger.debug(f"LLM call slower than p95 ({delay:.2f}s), hedging")
+            pending.add(asyncio.ensure_future(self._atimed_call(request, timeout)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        """
+        Close the underlying connection pool.
+        """
+        self.http_client.close()
+
+    async def aclose(self):
+        """
+        Close the async connection pool, if it was ever opened.
+        """
+        if self.async_http_client is not None:
+            await self.async_http_client.aclose()
+
+
+def record_usage(call_site, model, usage):
+    """
+    Add the prompt and completion tokens reported by the provider to the metrics.
+    """
+    LLM_PROMPT_TOKENS.inc(usage.prompt_tokens, call_site=call_site, model=model)
+    LLM_COMPLETION_TOKENS.inc(usage.completion_tokens, call_site=call_site, model=model)
+
+
+def query_error(error):
+    """
+    Exception raised by LLMClient for a failed provider call.
+    """
+    if isinstance(error, openai.BadRequestError):
+        return LLMBadRequestError(f"Error querying the LLM: {error}")
+    return RuntimeError(f"Error querying the LLM: {error}")
+
+# Process-wide client, shared by every request handled by this worker
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_shared_client(factory):
+    """
+    Return the process-wide LLMClient, creating it on first use.
+
+    :param factory: callable returning a new LLMClient, only called when the
+        client is first created
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = factory()
+    return _shared_client
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from src.backend.metrics import REGISTRY
+
+# Logger set up
+logger = logging.getLogger("src/backend/llm_governor.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+LLM_QUEUE_SECONDS = REGISTRY.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited in the governor before being sent."
+)
+LLM_REJECTED = REGISTRY.counter(
+    "llm_governor_rejected_total", "LLM calls that could not be sent before the governor deadline."
+)
+
+# How often to re-check for a free concurrency slot
+POLL_INTERVAL = 0.05
+
+
+class LLMBusyError(RuntimeError):
+    """
+    Raised when a call could not get a concurrency slot and rate budget before its deadline.
+    """
+    pass
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute, holding at most one
+    minute of budget. The level can go negative when a call uses more than it
+    reserved; later calls then wait for the debt to be refilled.
+    """
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.level = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until amount can be taken. Amounts above the capacity only need a full bucket.
+        """
+        self._refill()
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.actual_tokens = None
+
+
+class LLMGovernor:
+    """
+    Process-wide limiter in front of the LLM provider: at most max_concurrency
+    calls in flight, plus token buckets on requests and tokens per minute
+    (0 disables a limit). Limits apply per worker process.
+
+    A call reserves its estimated tokens up front. Once the provider reports the
+    actual usage, the difference is given back or taken from the bucket. Calls
+    wait up to max_wait seconds for capacity, then raise LLMBusyError.
+    """
+    def __init__(self, max_concurrency=8, requests_per_minute=0, tokens_per_minute=0, max_wait=30.0, estimate=None):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_wait = max_wait
+        self.estimate = estimate or (lambda text: len(text) // 4)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens):
+        """
+        Take a slot and the budget for one call, or return how long to wait before retrying.
+        """
+        with self._lock:
+            if self.in_flight >= self.max_concurrency:
+                return POLL_INTERVAL
+            wait = 0.0
+            if self.requests is not None:
+                wait = max(wait, self.requests.wait_time(1))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def _release(self, reservation):
+        with self._lock:
+            self.in_flight -= 1
+            if self.tokens is not None and reservation.actual_tokens is not None:
+                self.tokens.give_back(reservation.tokens - reservation.actual_tokens)
+
+    def _next_wait(self, wait, deadline, start):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            LLM_REJECTED.inc()
+            raise LLMBusyError(f"LLM governor: no capacity after waiting {time.monotonic() - start:.1f}s")
+        return min(wait, remaining)
+
+    @contextmanager
+    def reserve(self, text):
+        """
+        Hold a slot for one call on text. Set reservation.actual_tokens once known.
+        """
+        reservation = Reservation(self.estimate(text))
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        while (wait := self._try_acquire(reservation.tokens)) > 0:
+            time.sleep(self._next_wait(wait, deadline, start))
+        self._observe_wait(start)
+        try:
+            yield reservation
+        finally:
+            self._release(reservation)
+
+    @asynccontextmanager
+    async def areserve(self, text):
+        """
+        Async version of reserve, waiting without blocking the event loop.
+        """
+        reservation = Reservation(self.estimate(text))
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        while (wait := self._try_acquire(reservation.tokens)) > 0:
+            await asyncio.sleep(self._next_wait(wait, deadline, start))
+        self._observe_wait(start)
+        try:
+            yield reservation
+        finally:
+            self._release(reservation)
+
+    def _observe_wait(self, start):
+        waited = time.monotonic() - start
+        LLM_QUEUE_SECONDS.observe(waited)
+        if waited > 1:
+            logger.info(f"LLM call queued for {waited:.1f}s by the governor")
@@ -0,0 +1,184 @@
+import atexit
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Logger set up
+logger = logging.getLogger("src/backend/llm_ledger.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+# Entries of the calls made inside the current LLMLedger.scope(), if any
+_scope_entries = contextvars.ContextVar("llm_ledger_scope", default=None)
+# Key of the current call_group(), if any
+_call_group = contextvars.ContextVar("llm_ledger_call_group", default=None)
+
+
+@contextmanager
+def call_group(key):
+    """
+    Tag the calls made in the block with key, e.g. the chunk of a document they
+    generate from, so LedgerScope.link can point them to that chunk's usage row.
+    """
+    token = _call_group.set(key)
+    try:
+        yield
+    finally:
+        _call_group.reset(token)
+
+
+class LedgerEntry:
+    """
+    One provider call as written to the ledger. Filled in by LLMClient while the call runs.
+    """
+    def __init__(self, call_site, model, prompt_hash):
+        self.call_site = call_site
+        self.model = model
+        self.prompt_hash = prompt_hash
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = 0.0
+        self.retries = 0
+        self.failed = False
+        self.token_usage_id = None
+        self.group = _call_group.get()
+        self.started = None
+
+    def start(self):
+        """
+        Mark the first attempt reaching the provider; later attempts keep this start.
+        """
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def finish(self, usage=None, failed=False):
+        if self.started is not None:
+            self.latency = time.monotonic() - self.started
+        if usage is not None:
+            self.prompt_tokens = usage.prompt_tokens
+            self.completion_tokens = usage.completion_tokens
+        self.failed = failed
+
+    def as_dict(self):
+        return {
+            'call_site': self.call_site,
+            'model': self.model,
+            'prompt_hash': self.prompt_hash,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'latency': round(self.latency, 3),
+            'retries': self.retries,
+            'failed': self.failed,
+            'token_usage_id': self.token_usage_id,
+        }
+
+
+class LedgerScope:
+    """
+    Calls made within LLMLedger.scope(), held back until the token usage rows
+    they count toward are known.
+    """
+    def __init__(self):
+        self.entries = []
+
+    def link(self, token_usage_ids, groups=None):
+        """
+        Point the calls of the scope to their TokenUsage rows. With groups (a
+        document generated in chunks), token_usage_ids[i] is the row of the calls
+        made in call_group(groups[i]); calls of other groups are left unlinked.
+        Without groups, the calls all point to the first row.
+        """
+        if not token_usage_ids:
+            return
+        if groups is None:
+            for entry in self.entries:
+                entry.token_usage_id = token_usage_ids[0]
+            return
+        by_group = dict(zip(groups, token_usage_ids))
+        for entry in self.entries:
+            entry.token_usage_id = by_group.get(entry.group)
+
+
+class LLMLedger:
+    """
+    Buffered writer of LedgerEntry records. Calls only append to an in-memory
+    buffer; a background thread hands batches to writer every flush_interval
+    seconds, or as soon as batch_size entries are waiting. Entries beyond
+    max_buffer (e.g. while the database is down) are dropped.
+    """
+    def __init__(self, writer, batch_size=100, flush_interval=5.0, max_buffer=10000):
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def record(self, entry):
+        scope_entries = _scope_entries.get()
+        if scope_entries is not None:
+            scope_entries.append(entry)
+            return
+        self._submit([entry])
+
+    def _submit(self, entries):
+        with self._lock:
+            room = self.max_buffer - len(self.buffer)
+            if room < len(entries):
+                self.dropped += len(entries) - room
+                logger.warning(f"LLM ledger buffer full, dropped {self.dropped} entries so far")
+            self.buffer.extend(entries[:max(room, 0)])
+            full = len(self.buffer) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="llm-ledger", daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    @contextmanager
+    def scope(self):
+        """
+        Hold the entries of the calls made in the block (also from tasks and
+        threads started with a copy of the context) until the block ends.
+        """
+        scope = LedgerScope()
+        previous = _scope_entries.get()
+        _scope_entries.set(scope.entries)
+        try:
+            yield scope
+        finally:
+            # set() rather than reset(): async generators may exit in another context
+            _scope_entries.set(previous)
+            if previous is not None:
+                previous.extend(scope.entries)
+            elif scope.entries:
+                self._submit(scope.entries)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                entries, self.buffer = self.buffer, []
+            if not entries:
+                return
+            try:
+                self.writer(entries)
+                logger.debug(f"Wrote {len(entries)} LLM ledger entries")
+            except Exception as e:
+                logger.error(f"Failed to write {len(entries)} LLM ledger entries: {e}")
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import httpx
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from src.backend.llm_cache import make_cache_key
+
+# Logger set up
+logger = logging.getLogger("src/backend/llm_replay.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+def split_messages(messages):
+    """
+    Return the (system_message, prompt) of a chat completion request.
+    """
+    system_message = next((m['content'] for m in messages if m['role'] == 'system'), "")
+    prompt = next((m['content'] for m in messages if m['role'] == 'user'), "")
+    return system_message, prompt
+
+
+class RecordingStore:
+    """
+    LLM calls recorded to a JSON lines file, one object per call with model,
+    system_message, prompt, response, prompt/completion tokens and latency.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.by_key = {}
+        self.by_system_message = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as recordings:
+                for line in recordings:
+                    if line.strip():
+                        self._index(json.loads(line))
+        logger.info(f"Loaded {len(self.by_key)} LLM recordings from {path}")
+
+    def _index(self, record):
+        self.by_key[make_cache_key(record['model'], record['system_message'], record['prompt'])] = record
+        self.by_system_message.setdefault(record['system_message'], []).append(record)
+
+    def add(self, record):
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as recordings:
+                recordings.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._index(record)
+
+    def find(self, model, system_message, prompt):
+        """
+        The recording of this exact call or, for prompts never recorded, a
+        recording with the same system message (picked deterministically from
+        the prompt), so load tests can use new texts. None if neither exists.
+        """
+        record = self.by_key.get(make_cache_key(model, system_message, prompt))
+        if record is not None:
+            return record
+        candidates = self.by_system_message.get(system_message)
+        if not candidates:
+            return None
+        return candidates[int(make_cache_key(model, system_message, prompt)[:8], 16) % len(candidates)]
+
+
+def build_completion(model, record):
+    return ChatCompletion.model_validate({
+        "id": "replay",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": record['response']},
+        }],
+        "usage": {
+            "prompt_tokens": record['prompt_tokens'],
+            "completion_tokens": record['completion_tokens'],
+            "total_tokens": record['prompt_tokens'] + record['completion_tokens'],
+        },
+    })
+
+def build_chunks(model, record, n_chunks=20):
+    """
+    Split a recorded response into stream chunks, the last one carrying the usage.
+    """
+    response = record['response']
+    size = max(1, len(response) // n_chunks)
+    chunks = []
+    for start in range(0, len(response), size):
+        chunks.append(ChatCompletionChunk.model_validate({
+            "id": "replay", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "delta": {"content": response[start:start + size]}, "finish_reason": None}],
+        }))
+    chunks.append(ChatCompletionChunk.model_validate({
+        "id": "replay", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [],
+        "usage": {
+            "prompt_tokens": record['prompt_tokens'],
+            "completion_tokens": record['completion_tokens'],
+            "total_tokens": record['prompt_tokens'] + record['completion_tokens'],
+        },
+    }))
+    return chunks
+
+
+class ReplayCompletions:
+    """
+    Stand-in for client.chat.completions serving recorded responses.
+
+    Each call sleeps for its recorded latency times latency_scale, or for
+    latency seconds when set, and fails with a timeout error with probability
+    error_rate.
+    """
+    def __init__(self, store, latency=None, latency_scale=1.0, error_rate=0.0, is_async=False):
+        self.store = store
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.is_async = is_async
+
+    def _prepare(self, model, messages):
+        system_message, prompt = split_messages(messages)
+        record = self.store.find(model, system_message, prompt)
+        if record is None:
+            raise LookupError(f"No LLM recording for this system message in {self.store.path}")
+        delay = self.latency if self.latency is not None else record['latency'] * self.latency_scale
+        failed = random.random() < self.error_rate
+        return record, delay, failed
+
+    def _error(self):
+        return openai.APITimeoutError(request=httpx.Request("POST", "http://replay/chat/completions"))
+
+    def create(self, model, messages, stream=False, **kwargs):
+        if self.is_async:
+            return self._acreate(model, messages, stream)
+        record, delay, failed = self._prepare(model, messages)
+        time.sleep(delay)
+        if failed:
+            raise self._error()
+        if stream:
+            return iter(build_chunks(model, record))
+        return build_completion(model, record)
+
+    async def _acreate(self, model, messages, stream):
+        record, delay, failed = self._prepare(model, messages)
+        if stream:
+            # Time to first chunk is a fraction of the latency, the rest is spread over the chunks
+            await asyncio.sleep(delay * 0.2)
+            if failed:
+                raise self._error()
+            return self._astream(build_chunks(model, record), delay * 0.8)
+        await asyncio.sleep(delay)
+        if failed:
+            raise self._error()
+        return build_completion(model, record)
+
+    async def _astream(self, chunks, duration):
+        for chunk in chunks:
+            await asyncio.sleep(duration / len(chunks))
+            yield chunk
+
+
+class RecordingCompletions:
+    """
+    Wrapper of a real client.chat.completions saving every call to a RecordingStore.
+    """
+    def __init__(self, completions, store, is_async=False):
+        self.completions = completions
+        self.store = store
+        self.is_async = is_async
+
+    def _record(self, model, messages, response, usage, latency):
+        system_message, prompt = split_messages(messages)
+        self.store.add({
+            'model': model,
+            'system_message': system_message,
+            'prompt': prompt,
+            'response': response,
+            'prompt_tokens': usage.prompt_tokens if usage else 0,
+            'completion_tokens': usage.completion_tokens if usage else 0,
+            'latency': round(latency, 3),
+        })
+
+    def create(self, model, messages, stream=False, **kwargs):
+        if self.is_async:
+            return self._acreate(model, messages, stream, **kwargs)
+        start = time.monotonic()
+        completion = self.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if stream:
+            return self._record_stream(completion, model, messages, start)
+        self._record(model, messages, completion.choices[0].message.content, completion.usage, time.monotonic() - start)
+        return completion
+
+    async def _acreate(self, model, messages, stream, **kwargs):
+        start = time.monotonic()
+        completion = await self.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if stream:
+            return self._arecord_stream(completion, model, messages, start)
+        self._record(model, messages, completion.choices[0].message.content, completion.usage, time.monotonic() - start)
+        return completion
+
+    def _record_stream(self, stream, model, messages, start):
+        parts, usage = [], None
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(model, messages, "".join(parts), usage, time.monotonic() - start)
+
+    async def _arecord_stream(self, stream, model, messages, start):
+        parts, usage = [], None
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(model, messages, "".join(parts), usage, time.monotonic() - start)
+
+
+class _Chat:
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class ChatClient:
+    """
+    Minimal object with the client.chat.completions.create interface used by LLMClient.
+    """
+    def __init__(self, completions):
+        self.chat = _Chat(completions)
+
+
+class ReplayBackend:
+    """
+    LLMClient backend answering every call from recordings, without the provider.
+    """
+    replaces_provider = True
+
+    def __init__(self, path, latency=None, latency_scale=1.0, error_rate=0.0):
+        self.store = RecordingStore(path)
+        self.options = {'latency': latency, 'latency_scale': latency_scale, 'error_rate': error_rate}
+
+    def sync_client(self, client):
+        return ChatClient(ReplayCompletions(self.store, **self.options))
+
+    def async_client(self, client):
+        return ChatClient(ReplayCompletions(self.store, is_async=True, **self.options))
+
+
+class RecordBackend:
+    """
+    LLMClient backend calling the provider and recording every call.
+    """
+    replaces_provider = False
+
+    def __init__(self, path):
+        self.store = RecordingStore(path)
+
+    def sync_client(self, client):
+        return ChatClient(RecordingCompletions(client.chat.completions, self.store))
+
+    def async_client(self, client):
+        return ChatClient(RecordingCompletions(client.chat.completions, self.store, is_async=True))
+
+def build_backend(mode, path, latency=None, latency_scale=1.0, error_rate=0.0):
+    """
+    Backend for the LLM_BACKEND setting: 'openai' (None), 'record' or 'replay'.
+    """
+    if mode == 'record':
+        return RecordBackend(path)
+    if mode == 'replay':
+        return ReplayBackend(path, latency=latency, latency_scale=latency_scale, error_rate=error_rate)
+    if mode not in (None, '', 'openai'):
+        raise ValueError(f"Unknown LLM backend: {mode}")
+    return None
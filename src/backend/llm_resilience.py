@@ -0,0 +1,139 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+import httpx
+import openai
+
+# Logger set up
+logger = logging.getLogger("src/backend/llm_resilience.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+# Errors worth another attempt: the provider was slow, unreachable, overloaded or failed
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TimeoutException,
+    httpx.TransportError,
+)
+
+def is_retryable(error):
+    return isinstance(error, RETRYABLE_ERRORS)
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """
+    Full-jitter exponential backoff: a random delay in [0, min(cap, base * 2**attempt)].
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling the provider while the circuit breaker is open.
+    """
+    pass
+
+
+class LLMBadRequestError(RuntimeError):
+    """
+    Raised when the provider rejects a request as invalid (HTTP 400), e.g. a
+    response_format the model does not support. Sending it again cannot help.
+    """
+    pass
+
+
+class CircuitBreaker:
+    """
+    Per-process circuit breaker around the LLM provider.
+
+    After failure_threshold consecutive failures the circuit opens and calls fail
+    fast for reset_seconds. Then a single trial call is let through (half-open):
+    its success closes the circuit, its failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if the call must not reach the provider.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    raise CircuitOpenError("LLM provider circuit is open, failing fast")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                raise CircuitOpenError("LLM provider circuit is half-open, trial call in flight")
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("LLM provider circuit closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_neutral(self):
+        """
+        End a call whose error says nothing about the provider's health (e.g. a
+        bad request): the failure count is kept and a half-open trial is released.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"LLM provider circuit opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Rolling window of successful call latencies, used to decide when to hedge.
+    """
+    def __init__(self, window=200, min_samples=20, quantile=0.95):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self):
+        """
+        Latency quantile of recent calls, or None until there are enough samples.
+        """
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
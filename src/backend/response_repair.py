@@ -0,0 +1,134 @@
+import csv
+import re
+import logging
+from collections import Counter
+from io import StringIO
+
+# Logger set up
+logger = logging.getLogger("src/backend/response_repair.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+# How flashcards were obtained from each LLM response, for this process.
+# Keys: "first_try", one key per repair strategy, "enforce_format" and "failed" for CSV
+# responses, "json_first_try" and "json_failed" for structured JSON output.
+REPAIR_STATS = Counter()
+
+SMART_QUOTES = str.maketrans({
+    '“': '"', '”': '"', '„': '"', '‟': '"',
+    '«': '"', '»': '"', '＂': '"',
+})
+CODE_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*$", re.MULTILINE)
+LINE_PREFIX = re.compile(r"^\s*(?:\d+\s*[.):-]|[-*•])\s*", re.MULTILINE)
+# Fields the CSV reader accepts but that still carry the artifacts above, e.g. the
+# fields of “Q”,“A” or the question of 1. "Q","A"
+SMART_QUOTED_FIELD = re.compile(r'^\s*[“„‟＂].*[”‟＂]\s*$', re.DOTALL)
+PREFIXED_FIELD = re.compile(r'^\s*(?:\d+\s*[.):-]|[-*•])\s*"')
+QUESTION_LABEL = re.compile(r"^\s*(?:q|question|pregunta)\s*\d*\s*[:.-]\s*", re.IGNORECASE)
+ANSWER_LABEL = re.compile(r"^\s*(?:a|answer|respuesta)\s*\d*\s*[:.-]\s*", re.IGNORECASE)
+
+
+def has_artifacts(row):
+    """
+    Whether a parsed CSV row kept typographic quotes or list numbering as part of
+    its text, i.e. the response parsed but needs normalize_quotes or strip_prefixes.
+    """
+    return any(SMART_QUOTED_FIELD.match(field) for field in row) or bool(row and PREFIXED_FIELD.match(row[0]))
+
+def to_csv(pairs):
+    """
+    Write (question, answer) pairs in the CSV format expected by the parser.
+    """
+    output = StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    writer.writerows(pairs)
+    return output.getvalue()
+
+def normalize_quotes(response):
+    """
+    Replace typographic quotes with plain double quotes and drop markdown code fences.
+    """
+    response = response.translate(SMART_QUOTES)
+    return CODE_FENCE.sub("", response)
+
+def strip_prefixes(response):
+    """
+    Remove list numbering and bullets at the start of lines, e.g. '1. "Q","A"'.
+    """
+    response = normalize_quotes(response)
+    response = LINE_PREFIX.sub("", response)
+    lines = [ANSWER_LABEL.sub("", QUESTION_LABEL.sub("", line)) for line in response.splitlines()]
+    return "\n".join(lines)
+
+def pair_fields(response):
+    """
+    Handle questions and answers on alternate lines and trailing commas, e.g.
+    '"Q?",\n"A."'. Every non-empty field is collected in order and paired up.
+    """
+    response = strip_prefixes(response)
+    reader = csv.reader(StringIO(response), quotechar='"', escapechar='\\', skipinitialspace=True)
+    fields = []
+    for row in reader:
+        row_fields = [field.strip() for field in row if field.strip()]
+        if len(row_fields) > 2:
+            raise ValueError(f"Row with {len(row_fields)} fields cannot be paired: {row}")
+        fields.extend(row_fields)
+    if not fields or len(fields) % 2:
+        raise ValueError(f"Cannot pair an odd number of fields ({len(fields)})")
+    return to_csv(zip(fields[0::2], fields[1::2]))
+
+def labelled_pairs(response):
+    """
+    Handle 'Question: ... / Answer: ...' blocks, possibly spanning several lines.
+    """
+    response = LINE_PREFIX.sub("", normalize_quotes(response))
+    pairs, question, answer, current = [], None, None, None
+    for line in response.splitlines():
+        if QUESTION_LABEL.match(line):
+            if question and answer:
+                pairs.append((question, answer))
+            question, answer, current = QUESTION_LABEL.sub("", line).strip(), None, "question"
+        elif ANSWER_LABEL.match(line) and question:
+            answer, current = ANSWER_LABEL.sub("", line).strip(), "answer"
+        elif line.strip() and current == "question":
+            question = f"{question} {line.strip()}"
+        elif line.strip() and current == "answer":
+            answer = f"{answer} {line.strip()}"
+    if question and answer:
+        pairs.append((question, answer))
+    if not pairs:
+        raise ValueError("No labelled question/answer pairs found")
+    pairs = [(q.strip('"'), a.strip('"')) for q, a in pairs]
+    return to_csv(pairs)
+
+# Strategies are tried in order; each returns a rewritten response in the expected CSV format
+REPAIR_STRATEGIES = [
+    ("normalize_quotes", normalize_quotes),
+    ("strip_prefixes", strip_prefixes),
+    ("pair_fields", pair_fields),
+    ("labelled_pairs", labelled_pairs),
+]
+
+def repair_response(response, parse):
+    """
+    Try each local repair strategy until parse accepts the rewritten response.
+
+    :param response: Raw LLM output that failed to parse
+    :param parse: Callable turning a CSV string into flashcards, raising on failure
+    :return: (flashcards, strategy_name)
+    :raises ValueError: if every strategy fails
+    """
+    for name, strategy in REPAIR_STRATEGIES:
+        try:
+            repaired = strategy(response)
+            flashcards = parse(repaired)
+        except Exception as e:
+            logger.debug(f"Repair strategy {name} failed: {e}")
+            continue
+        logger.info(f"Response repaired locally with strategy: {name}")
+        return flashcards, name
+    raise ValueError("No local repair strategy could parse the response")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+import time
+
+# Logger set up
+logger = logging.getLogger("src/backend/token_estimator.py")
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    console_handler = logging.StreamHandler()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message)s")
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+
+LATIN = 'latin'
+CYRILLIC = 'cyrillic'
+CJK = 'cjk'
+OTHER = 'other'
+
+def detect_script(text, sample_size=2000):
+    """
+    Bucket a text by the script of most of its letters, looking only at the
+    first sample_size characters.
+    """
+    counts = {LATIN: 0, CYRILLIC: 0, CJK: 0, OTHER: 0}
+    for char in text[:sample_size]:
+        if not char.isalpha():
+            continue
+        code_point = ord(char)
+        if code_point < 0x250:
+            counts[LATIN] += 1
+        elif 0x400 <= code_point < 0x530:
+            counts[CYRILLIC] += 1
+        elif 0x3040 <= code_point < 0x3100 or 0x3400 <= code_point < 0xA000 or 0xAC00 <= code_point < 0xD7B0:
+            counts[CJK] += 1
+        else:
+            counts[OTHER] += 1
+    script = max(counts, key=counts.get)
+    return script if counts[script] else LATIN
+
+def fit_linear(samples, coverage=0.9):
+    """
+    Least-squares fit of tokens = per_char * input_chars + intercept.
+
+    The margin is the `coverage` quantile of the residuals, so that
+    per_char * chars + intercept + margin covers that share of real calls.
+
+    :param samples: list of (input_chars, tokens_used) pairs
+    :return: (per_char, intercept, margin)
+    """
+    n = len(samples)
+    mean_x = sum(x for x, _ in samples) / n
+    mean_y = sum(y for _, y in samples) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in samples)
+    if var_x == 0:
+        per_char = 0.0
+    else:
+        per_char = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in samples) / var_x)
+    intercept = mean_y - per_char * mean_x
+
+    residuals = sorted(y - (per_char * x + intercept) for x, y in samples)
+    margin = max(0.0, residuals[min(n - 1, int(coverage * n))])
+    return (per_char, intercept, margin)
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class TokenEstimator:
+    """
+    Token cost estimator calibrated per script bucket from recorded usage.
+
+    Fitted coefficients are read from the token_estimator_fit table and kept in
+    memory, reloaded at most every refresh_seconds and never from an event loop,
+    so an estimate never hits the database on the request path. Buckets without
+    a fit use the fallback estimator.
+    """
+    def __init__(self, fallback, refresh_seconds=3600):
+        self.fallback = fallback
+        self.refresh_seconds = refresh_seconds
+        self.coefficients = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        from flashcards.models import TokenEstimatorFit
+
+        coefficients = {
+            fit.script: (fit.per_char, fit.intercept, fit.margin)
+            for fit in TokenEstimatorFit.objects.all()
+        }
+        with self._lock:
+            self.coefficients = coefficients
+            self._loaded_at = time.monotonic()
+        logger.debug(f"Loaded token estimator coefficients: {coefficients}")
+
+    def _refresh_if_stale(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        if _in_event_loop():
+            # The ORM cannot run on the event loop: a sync caller (e.g. the token check) reloads them
+            return
+        try:
+            self.load()
+        except Exception as e:
+            # Keep the previous coefficients, try again after the next refresh interval
+            logger.error(f"Could not load token estimator coefficients: {e}")
+            self._loaded_at = time.monotonic()
+
+    def estimate(self, text, n_calls=1):
+        """
+        Estimate the total tokens of generating from text over n_calls LLM calls.
+        """
+        self._refresh_if_stale()
+        coefficients = self.coefficients.get(detect_script(text))
+        if coefficients is None:
+            return self.fallback(text, n_calls)
+        per_char, intercept, margin = coefficients
+        return int(per_char * len(text) + (intercept + margin) * n_calls)
@@ -1,5 +1,6 @@
 import logging
-from flashcards.models import TokenUsage
+from flashcards.models import TokenUsageBucket
+from src.backend.token_estimator import TokenEstimator
 
 # Logger set up
 logger = logging.getLogger("src/backend/usage_limits.py")
@@ -9,34 +10,57 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s: %(message
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+# Maximum characters sent to the LLM in a single generation call
+MAX_INPUT_LENGTH = 30000
+# Maximum characters accepted for a whole document (generated in chunks)
+MAX_DOCUMENT_LENGTH = 300000
+# Expected completion size of a single generation call
+OUTPUT_TOKENS_PER_CALL = 750
+
 class InsufficientTokensError(Exception):
     """Raised when user doesn't have enough tokens available"""
     pass
 
-def assert_input_length(input_text):
+def assert_input_length(input_text, max_length=MAX_INPUT_LENGTH):
     logger.info('Checking length of input text...')
     len_input_text = len(input_text)
     logger.debug(f'The text has {len_input_text} characters')
-    if len_input_text > 30000:
-        raise ValueError(f"Input text length {len(input_text)} exceeds maximum allowed length of 30000 characters")
+    if len_input_text > max_length:
+        raise ValueError(f"Input text length {len(input_text)} exceeds maximum allowed length of {max_length} characters")
 
-def estimate_tokens(text):
+def estimate_input_tokens(text):
     """
     Quick token estimation:
     - Average English word is ~1.3 tokens
     - Add 20% buffer for safety
     """
-    input_tokens = int(len(text.split()) * 1.3 * 1.2)
-    output_tokens = 750
+    return int(len(text.split()) * 1.3 * 1.2)
+
+def estimate_tokens_fixed(text, n_calls=1):
+    """
+    Fixed-coefficient estimate of generating cards from text over n_calls LLM calls.
+    Used until the calibrated estimator has a fit for the text's script.
+    """
+    input_tokens = estimate_input_tokens(text)
+    output_tokens = OUTPUT_TOKENS_PER_CALL * n_calls
     return input_tokens + output_tokens
 
-def assert_enough_tokens(user, input_text):
+# Calibrated from recorded usage by the fit_token_estimator management command
+token_estimator = TokenEstimator(fallback=estimate_tokens_fixed)
+
+def estimate_tokens(text, n_calls=1):
+    """
+    Estimate the total cost of generating cards from text, split over n_calls LLM calls.
+    """
+    return token_estimator.estimate(text, n_calls)
+
+def assert_enough_tokens(user, input_text, n_calls=1):
     logger.info('Checking user has enough tokens to proceed...')
 
     ### Available tokens
     # Get tokens used in the current time period (4 hours)
     hours = 4
-    tokens_used_during_period = TokenUsage.get_period_usage(user, hours)
+    tokens_used_during_period, most_recent_usage_timestamp = TokenUsageBucket.get_window(user, hours)
     logger.debug(f'User {user.username} consumed {tokens_used_during_period} tokens within the last {hours} hours')
     # Get maximum available tokens per period, from UserPlan table
     user_plan = user.userplan  # Using the OneToOne reverse relation
@@ -47,7 +71,7 @@ def assert_enough_tokens(user, input_text):
     logger.debug(f'User {user.username} has {available_tokens} available tokens in this period')
 
     ### Expected token cost
-    tokens_needed_estimate = estimate_tokens(input_text)
+    tokens_needed_estimate = estimate_tokens(input_text, n_calls)
     logger.debug(f'Job will use approximately {tokens_needed_estimate} tokens')
     
     ### Logic
@@ -56,7 +80,6 @@ def assert_enough_tokens(user, input_text):
         return True
     else:
         logger.info('Not enough tokens left!')
-        most_recent_usage_timestamp = TokenUsage.get_most_recent_timestamp(user)
         logger.info(f'Last token consumption happend at {most_recent_usage_timestamp}')
 
         error = InsufficientTokensError(
@@ -0,0 +1,23 @@
+import unittest
+from src.backend.box_matcher import BoxText, match_boxes_locally
+
+BOXES = [{'text': word} for word in "The French Revolution began in 1789 with the storming of the Bastille".split()]
+
+
+class MatchBoxesLocallyTests(unittest.TestCase):
+    def test_matches_long_answer(self):
+        score, box_indices = match_boxes_locally(
+            "How did the French Revolution begin?", "With the storming of the Bastille", BoxText(BOXES)
+        )
+
+        self.assertGreaterEqual(score, 80)
+        self.assertTrue({6, 7, 8, 9, 10, 11} <= set(box_indices))
+
+    def test_short_answer_is_left_to_the_llm(self):
+        score, box_indices = match_boxes_locally("When did the French Revolution begin?", "1789", BoxText(BOXES))
+
+        self.assertEqual((score, box_indices), (0.0, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
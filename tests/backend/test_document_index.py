@@ -0,0 +1,28 @@
+import unittest
+from src.backend.document_index import DocumentIndex, MIN_MAX_POSTING
+
+
+def words(text):
+    return [{'text': word} for word in text.split()]
+
+
+class DocumentIndexTests(unittest.TestCase):
+    def test_short_document_keeps_repeated_words(self):
+        index = DocumentIndex(words("Paris is the capital of France and the capital is big"))
+
+        self.assertEqual(index.max_posting, MIN_MAX_POSTING)
+        self.assertEqual(index.locate("the capital of France"), (100.0, [2, 3, 4, 5]))
+
+    def test_common_words_are_ignored_in_both_passes(self):
+        filler = " ".join(f"the w{i}" for i in range(600))
+        index = DocumentIndex(words(f"{filler} mitochondria power the cell {filler}"))
+
+        score, box_indices = index.locate("the mitochondria power the cell")
+
+        # "the" is too common to be looked up: the span is not stretched to its other occurrences
+        self.assertEqual(score, 100.0)
+        self.assertEqual(box_indices, [1200, 1201, 1202, 1203])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+from src.backend.llm_cache import LLMResponseCache, deferred_cache_writes, make_cache_key
+from src.backend.llm_client import LLMClient
+from src.backend.llm_replay import ReplayBackend
+
+
+class DictTier:
+    """
+    Persistent tier kept in a dict, standing in for DatabaseCacheTier.
+    """
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value):
+        self.entries[key] = value
+
+
+class LLMResponseCacheTests(unittest.TestCase):
+    def test_memory_tier_hit_and_miss(self):
+        cache = LLMResponseCache()
+        self.assertIsNone(cache.get("key"))
+
+        cache.set("key", ("response", 12))
+
+        self.assertEqual(cache.get("key"), ("response", 12))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = LLMResponseCache(max_entries=2)
+        cache.set("a", ("A", 1))
+        cache.set("b", ("B", 1))
+        cache.get("a")
+
+        cache.set("c", ("C", 1))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), ("A", 1))
+        self.assertEqual(cache.get("c"), ("C", 1))
+
+    def test_expired_entries_are_misses(self):
+        cache = LLMResponseCache(ttl=0)
+        cache.set("key", ("response", 12))
+
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_persistent_tier_fills_the_memory_tier(self):
+        tier = DictTier()
+        LLMResponseCache(persistent_tier=tier).set("key", ("response", 12))
+        self.assertEqual(tier.entries, {"key": ("response", 12)})
+
+        # Another worker, with an empty memory tier
+        cache = LLMResponseCache(persistent_tier=tier)
+        self.assertEqual(cache.get("key"), ("response", 12))
+        tier.entries.clear()
+        self.assertEqual(cache.get("key"), ("response", 12))
+
+    def test_async_memory_hits_stay_on_the_event_loop(self):
+        tier = DictTier()
+        tier.set("stored", ("stored response", 3))
+        cache = LLMResponseCache(persistent_tier=tier)
+
+        async def run():
+            await cache.aset("key", ("response", 12))
+            with mock.patch('src.backend.llm_cache.sync_to_async') as to_thread:
+                self.assertEqual(await cache.aget("key"), ("response", 12))
+                to_thread.assert_not_called()
+            return await cache.aget("stored"), await cache.aget("missing")
+
+        self.assertEqual(asyncio.run(run()), (("stored response", 3), None))
+        self.assertEqual(tier.entries["key"], ("response", 12))
+
+
+class LLMClientCacheTests(unittest.TestCase):
+    """
+    Caching of LLMClient responses, against replayed provider calls.
+    """
+    model = "test-model"
+
+    def setUp(self):
+        recordings = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+        with recordings:
+            for prompt, response in (("prompt", "response"), ("other prompt", "other response")):
+                recordings.write(json.dumps({
+                    'model': self.model, 'system_message': "system", 'prompt': prompt, 'response': response,
+                    'prompt_tokens': 10, 'completion_tokens': 5, 'latency': 0,
+                }) + "\n")
+        self.addCleanup(os.remove, recordings.name)
+        self.cache = LLMResponseCache()
+        self.client = LLMClient("test", model=self.model, cache=self.cache, backend=ReplayBackend(recordings.name, latency=0))
+
+    def test_repeated_call_is_served_from_cache(self):
+        self.assertEqual(self.client.query("prompt", "system"), ("response", 15))
+        self.assertEqual(self.client.query("prompt", "system"), ("response", 0))
+        self.assertEqual(self.cache.get(make_cache_key(self.model, "system", "prompt")), ("response", 15))
+
+    def test_use_cache_false_bypasses_the_cache(self):
+        self.client.query("prompt", "system")
+
+        self.assertEqual(self.client.query("prompt", "system", use_cache=False), ("response", 15))
+
+    def test_uncommitted_responses_are_not_cached(self):
+        with deferred_cache_writes():
+            self.client.query("prompt", "system")
+
+        self.assertIsNone(self.cache.get(make_cache_key(self.model, "system", "prompt")))
+        self.assertEqual(self.client.query("prompt", "system"), ("response", 15))
+
+    def test_committed_responses_are_cached(self):
+        with deferred_cache_writes() as cache_writes:
+            self.client.query("prompt", "system")
+            with deferred_cache_writes() as inner_writes:
+                self.client.query("other prompt", "system")
+                inner_writes.commit()
+            # Committed to the outer block, which is not committed yet
+            self.assertIsNone(self.cache.get(make_cache_key(self.model, "system", "other prompt")))
+            cache_writes.commit()
+
+        self.assertEqual(self.client.query("prompt", "system"), ("response", 0))
+        self.assertEqual(self.client.query("other prompt", "system"), ("other response", 0))
+
+    def test_async_calls_defer_cache_writes(self):
+        async def run():
+            with deferred_cache_writes():
+                await self.client.aquery("prompt", "system")
+            with deferred_cache_writes() as cache_writes:
+                async for _ in self.client.astream_query("other prompt", "system"):
+                    pass
+                await cache_writes.acommit()
+        asyncio.run(run())
+
+        self.assertIsNone(self.cache.get(make_cache_key(self.model, "system", "prompt")))
+        self.assertEqual(self.cache.get(make_cache_key(self.model, "system", "other prompt")), ("other response", 15))
+
+
+if __name__ == '__main__':
+    unittest.main()
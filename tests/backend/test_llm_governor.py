@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+from src.backend.llm_governor import LLMGovernor, LLMBusyError, TokenBucket
+
+
+class TokenBucketTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = 1000.0
+        patcher = mock.patch('src.backend.llm_governor.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refills_at_the_rate_per_minute(self):
+        bucket = TokenBucket(60)
+        bucket.take(60)
+        self.assertAlmostEqual(bucket.wait_time(10), 10.0)
+
+        self.clock += 30
+
+        self.assertEqual(bucket.wait_time(10), 0.0)
+        self.assertAlmostEqual(bucket.level, 30)
+
+    def test_holds_at_most_one_minute_of_budget(self):
+        bucket = TokenBucket(60)
+        self.clock += 600
+
+        self.assertEqual(bucket.wait_time(60), 0.0)
+        self.assertEqual(bucket.level, 60)
+        # Amounts above the capacity only need a full bucket
+        self.assertEqual(bucket.wait_time(1000), 0.0)
+
+    def test_debt_is_refilled_before_the_next_call(self):
+        bucket = TokenBucket(60)
+        bucket.take(90)
+
+        self.assertAlmostEqual(bucket.wait_time(1), 31.0)
+
+
+class LLMGovernorTests(unittest.TestCase):
+    def governor(self, **kwargs):
+        options = {'max_wait': 0.1, 'estimate': len}
+        options.update(kwargs)
+        return LLMGovernor(**options)
+
+    def test_requests_per_minute(self):
+        governor = self.governor(requests_per_minute=2)
+        for _ in range(2):
+            with governor.reserve("prompt"):
+                pass
+
+        with self.assertRaises(LLMBusyError):
+            with governor.reserve("prompt"):
+                pass
+
+    def test_tokens_per_minute_with_actual_usage_given_back(self):
+        governor = self.governor(tokens_per_minute=100)
+        with governor.reserve("x" * 80) as reservation:
+            reservation.actual_tokens = 20
+        # 20 tokens used: 80 of the 100 are available again
+        with governor.reserve("x" * 80) as reservation:
+            reservation.actual_tokens = 80
+
+        with self.assertRaises(LLMBusyError):
+            with governor.reserve("x" * 50):
+                pass
+
+    def test_waits_for_a_slot_then_times_out(self):
+        governor = self.governor(max_concurrency=1)
+        with governor.reserve("prompt"):
+            with self.assertRaises(LLMBusyError):
+                with governor.reserve("prompt"):
+                    pass
+
+    def test_waits_for_a_slot_released_by_another_call(self):
+        governor = self.governor(max_concurrency=1, max_wait=5.0)
+        holding, released = threading.Event(), threading.Event()
+
+        def hold_slot():
+            with governor.reserve("prompt"):
+                holding.set()
+                released.wait()
+        thread = threading.Thread(target=hold_slot)
+        thread.start()
+        holding.wait()
+        threading.Timer(0.1, released.set).start()
+
+        with governor.reserve("prompt"):
+            self.assertEqual(governor.in_flight, 1)
+        thread.join()
+
+    def test_slot_is_released_when_the_call_fails(self):
+        governor = self.governor(max_concurrency=1)
+        with self.assertRaises(RuntimeError):
+            with governor.reserve("prompt"):
+                raise RuntimeError("provider error")
+
+        self.assertEqual(governor.in_flight, 0)
+        with governor.reserve("prompt"):
+            pass
+
+    def test_async_reserve(self):
+        estimate_threads = []
+
+        def estimate(text):
+            estimate_threads.append(threading.current_thread())
+            return len(text)
+        governor = self.governor(max_concurrency=1, estimate=estimate)
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                async with governor.areserve("prompt"):
+                    raise RuntimeError("provider error")
+            async with governor.areserve("prompt"):
+                with self.assertRaises(LLMBusyError):
+                    async with governor.areserve("prompt"):
+                        pass
+        asyncio.run(run())
+
+        self.assertEqual(governor.in_flight, 0)
+        # The estimate runs on the event loop, without a thread hop
+        self.assertEqual(set(estimate_threads), {threading.main_thread()})
+
+
+if __name__ == '__main__':
+    unittest.main()
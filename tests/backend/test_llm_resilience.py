@@ -0,0 +1,194 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+import httpx
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.backend.llm_client import LLMClient
+from src.backend.llm_resilience import CircuitBreaker, CircuitOpenError, LLMBadRequestError
+
+
+class StubProvider(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible chat completions endpoint answering from a script: each
+    request takes the next step, an HTTP error status, "ok" or ("stall", seconds).
+    """
+    script = []
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with StubProvider.lock:
+            StubProvider.requests += 1
+            number = StubProvider.requests
+            step = StubProvider.script.pop(0) if StubProvider.script else "ok"
+        if isinstance(step, tuple):
+            time.sleep(step[1])
+            step = "ok"
+        if step != "ok":
+            self.reply(step, {"error": {"message": f"stub error {step}", "type": "stub"}})
+            return
+        self.reply(200, {
+            "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": f"response {number}"}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+        })
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on a stalled request
+            pass
+
+
+class LLMResilienceTests(unittest.TestCase):
+    """
+    Retries, circuit breaker and hedging of LLMClient against a stub provider
+    reached through base_url (LLM_BASE_URL in settings).
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubProvider)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubProvider.script = []
+        StubProvider.requests = 0
+
+    def client(self, **kwargs):
+        options = {'max_retries': 0, 'retry_backoff': 0, 'circuit_failure_threshold': 3, 'circuit_reset_seconds': 60}
+        options.update(kwargs)
+        return LLMClient("test", base_url=self.base_url, **options)
+
+    def test_retries_rate_limited_call(self):
+        StubProvider.script = [429, "ok"]
+
+        response, tokens = self.client(max_retries=2).query("prompt", "system", use_cache=False)
+
+        self.assertEqual((response, tokens), ("response 2", 2))
+        self.assertEqual(StubProvider.requests, 2)
+
+    def test_gives_up_after_max_retries_on_server_errors(self):
+        StubProvider.script = [500, 502, 503]
+        client = self.client(max_retries=2)
+
+        with self.assertRaises(RuntimeError):
+            client.query("prompt", "system", use_cache=False)
+
+        self.assertEqual(StubProvider.requests, 3)
+        self.assertEqual(client.circuit_breaker.state, CircuitBreaker.OPEN)
+
+    def test_open_circuit_fails_fast(self):
+        StubProvider.script = [500, 500]
+        client = self.client(circuit_failure_threshold=2)
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                client.query("prompt", "system", use_cache=False)
+
+        with self.assertRaises(CircuitOpenError):
+            client.query("prompt", "system", use_cache=False)
+        self.assertEqual(StubProvider.requests, 2)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        StubProvider.script = [500]
+        client = self.client(circuit_failure_threshold=1, circuit_reset_seconds=0)
+        with self.assertRaises(RuntimeError):
+            client.query("prompt", "system", use_cache=False)
+
+        self.assertEqual(client.query("prompt", "system", use_cache=False)[0], "response 2")
+        self.assertEqual(client.circuit_breaker.state, CircuitBreaker.CLOSED)
+
+    def test_bad_request_is_neutral_for_the_circuit(self):
+        StubProvider.script = [500, 500, 400, 500]
+        client = self.client()
+        for expected_error in (RuntimeError, RuntimeError, LLMBadRequestError):
+            with self.assertRaises(expected_error):
+                client.query("prompt", "system", use_cache=False)
+        # The bad request did not reset the two failures: the third server error opens the circuit
+        self.assertEqual(client.circuit_breaker.failures, 2)
+        with self.assertRaises(RuntimeError):
+            client.query("prompt", "system", use_cache=False)
+        self.assertEqual(client.circuit_breaker.state, CircuitBreaker.OPEN)
+
+    def test_bad_request_is_neutral_for_the_circuit_async(self):
+        StubProvider.script = [500, 400, 400]
+        client = self.client(circuit_failure_threshold=1, circuit_reset_seconds=0)
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await client.aquery("prompt", "system", use_cache=False)
+            # Each bad request is a half-open trial that neither closes nor reopens the circuit
+            for _ in range(2):
+                with self.assertRaises(LLMBadRequestError):
+                    await client.aquery("prompt", "system", use_cache=False)
+                self.assertEqual(client.circuit_breaker.state, CircuitBreaker.HALF_OPEN)
+            await client.aclose()
+        asyncio.run(run())
+
+    def test_stalled_call_times_out_and_is_retried(self):
+        StubProvider.script = [("stall", 1.0), "ok"]
+
+        response, tokens = self.client(max_retries=1).query("prompt", "system", timeout=0.3, use_cache=False)
+
+        self.assertEqual(response, "response 2")
+
+    def test_per_call_timeout_keeps_the_connect_timeout(self):
+        client = self.client(timeout=60.0, connect_timeout=2.0)
+        create = client.client.chat.completions.create
+        with mock.patch.object(client.client.chat.completions, 'create', wraps=create) as spy:
+            client.query("prompt", "system", use_cache=False)
+            client.query("prompt", "system", timeout=10.0, use_cache=False)
+
+        timeouts = [call.kwargs['timeout'] for call in spy.call_args_list]
+        self.assertEqual(timeouts, [httpx.Timeout(60.0, connect=2.0), httpx.Timeout(10.0, connect=2.0)])
+
+    def test_stalled_call_is_hedged(self):
+        StubProvider.script = [("stall", 1.0), "ok"]
+        client = self.client(hedge=True)
+        for _ in range(client.latency.min_samples):
+            client.latency.record(0.05)
+
+        start = time.monotonic()
+        response, tokens = client.query("prompt", "system", use_cache=False)
+
+        self.assertEqual(response, "response 2")
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    def test_stalled_call_is_hedged_async(self):
+        StubProvider.script = [("stall", 1.0), "ok"]
+        client = self.client(hedge=True)
+        for _ in range(client.latency.min_samples):
+            client.latency.record(0.05)
+
+        async def run():
+            start = time.monotonic()
+            response, tokens = await client.aquery("prompt", "system", use_cache=False)
+            await client.aclose()
+            return response, time.monotonic() - start
+        response, elapsed = asyncio.run(run())
+
+        self.assertEqual(response, "response 2")
+        self.assertLess(elapsed, 0.9)
+
+
+if __name__ == '__main__':
+    unittest.main()
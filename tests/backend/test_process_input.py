@@ -1 +1,44 @@
+import unittest
+from src.backend.input_content_processors import strip_repeated_lines, REPEATED_LINE_MIN_PAGES, MAX_REPEATED_LINE_CHARS
 
+
+def page(number, n_pages, body):
+    return "\n".join(["ACME Corp - Annual Report", "Confidential"] + body + [f"Page {number} of {n_pages}", "www.acme.example"])
+
+
+class StripRepeatedLinesTests(unittest.TestCase):
+    def test_removes_running_headers_footers_and_page_numbers(self):
+        bodies = [[f"Section {idx} starts here.", f"It covers topic {idx}.", "More details follow."] for idx in range(1, 6)]
+        pages = [page(idx, 5, body) for idx, body in enumerate(bodies, start=1)]
+
+        cleaned, removed_chars = strip_repeated_lines(pages)
+
+        # "More details follow." repeats exactly in the body of every page, like a watermark
+        self.assertEqual(cleaned, ["\n".join(body[:2]) for body in bodies])
+        self.assertEqual(removed_chars, sum(len(text) for text in pages) - sum(len(text) for text in cleaned))
+
+    def test_keeps_repeated_body_lines_with_different_numbers(self):
+        bodies = [["Introduction.", f"Step {idx}: mix {idx * 100} grams of flour.", f"Total revenue: {idx * 1000}", "Summary."] for idx in range(1, 6)]
+        pages = [page(idx, 5, body) for idx, body in enumerate(bodies, start=1)]
+
+        cleaned, _ = strip_repeated_lines(pages)
+
+        self.assertEqual(cleaned, ["\n".join(body[1:3]) for body in bodies])
+
+    def test_keeps_long_repeated_lines(self):
+        long_line = "This definition is repeated on every page because it matters. " * 3
+        self.assertGreater(len(long_line), MAX_REPEATED_LINE_CHARS)
+        pages = [page(idx, 4, ["Intro.", long_line, f"Point {idx}.", "End."]) for idx in range(1, 5)]
+
+        cleaned, _ = strip_repeated_lines(pages)
+
+        self.assertTrue(all(long_line in text for text in cleaned))
+
+    def test_short_documents_are_unchanged(self):
+        pages = [page(idx, 2, [f"Body of page {idx}.", "Shared line."]) for idx in range(1, REPEATED_LINE_MIN_PAGES)]
+
+        self.assertEqual(strip_repeated_lines(pages), (pages, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import asyncio
+import unittest
+from unittest import mock
+from src.backend.token_estimator import TokenEstimator, fit_linear
+
+
+class TokenEstimatorTests(unittest.TestCase):
+    def test_fit_linear(self):
+        per_char, intercept, margin = fit_linear([(chars, chars // 2 + 100) for chars in range(1000, 5000, 1000)])
+
+        self.assertEqual((per_char, intercept, margin), (0.5, 100.0, 0.0))
+
+    def test_does_not_reload_from_an_event_loop(self):
+        estimator = TokenEstimator(fallback=lambda text, n_calls: 42)
+
+        async def estimate():
+            return estimator.estimate("text")
+        with mock.patch.object(estimator, 'load') as load:
+            self.assertEqual(asyncio.run(estimate()), 42)
+            load.assert_not_called()
+
+            estimator.estimate("text")
+            load.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()